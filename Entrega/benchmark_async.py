@@ -0,0 +1,176 @@
+##
+## Load benchmark: sync app (demoApi under wsgi.py) vs async app (demoApiAsync)
+##
+## Both servers must be running against the same database, e.g.
+##   python wsgi.py --workers 1 --threads 32 --bind 127.0.0.1:5000
+##   hypercorn demoApiAsync:app --workers 1 --bind 127.0.0.1:5001
+##
+## For each concurrency level, N clients send requests at the same time and
+## the script prints throughput and latency percentiles per app:
+##   - report: GET /dbproj/report (read-only, admin token)
+##   - enroll: POST /dbproj/enroll_course_edition with one student per request,
+##             on a fresh benchmark edition (setup/teardown of
+##             benchmark_enrollment), checking that it was never overbooked
+##   - grades: POST /dbproj/submit_grades with one grade per request, by the
+##             coordinator of a fresh edition where every student is enrolled
+##
+## Usage: python benchmark_async.py [--scenario report|enroll|grades] [--concurrency 50 200 500]
+##
+
+import argparse
+import json
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+import jwt
+
+import demoApi
+import benchmark_enrollment
+from demoApi import app, db_connection
+
+
+def make_token(user_id, role):
+    return jwt.encode({
+        'user_id': user_id,
+        'role': role,
+        'exp': datetime.utcnow() + timedelta(hours=1)
+    }, app.config['JWT_SECRET_KEY'], algorithm='HS256')
+
+
+def send(base_url, method, path, token, body=None):
+    """(elapsed seconds, JSON reply or None) of one request"""
+    data = json.dumps(body).encode() if body is not None else None
+    req = urllib.request.Request(base_url + path, data=data, method=method, headers={
+        'Authorization': f'Bearer {token}',
+        'Content-Type': 'application/json'
+    })
+    started = time.perf_counter()
+    try:
+        with urllib.request.urlopen(req, timeout=60) as reply:
+            payload = json.loads(reply.read())
+    except (urllib.error.URLError, OSError, ValueError):
+        payload = None
+    return time.perf_counter() - started, payload
+
+
+def fire(base_url, calls):
+    """Send all calls (method, path, token, body) at once; returns (total, [(elapsed, reply)])"""
+    with ThreadPoolExecutor(max_workers=len(calls)) as executor:
+        started = time.perf_counter()
+        results = list(executor.map(lambda call: send(base_url, *call), calls))
+    return time.perf_counter() - started, results
+
+
+def summary(name, total, results):
+    latencies = sorted(elapsed for elapsed, _ in results)
+    ok = sum(1 for _, reply in results if reply and reply.get('status') == demoApi.StatusCodes['success'])
+    print(f'  {name:<8} {len(results) / total:>9.1f} req/s  p50 {latencies[len(latencies) // 2] * 1000:>8.1f}ms  '
+          f'p99 {latencies[int(len(latencies) * 0.99) - 1] * 1000:>8.1f}ms  ok {ok}/{len(results)}')
+
+
+def run_report(targets, concurrency, rounds):
+    token = make_token(0, 'admin')
+    for name, base_url in targets:
+        total, results = 0.0, []
+        for _ in range(rounds):
+            elapsed, replies = fire(base_url, [('GET', '/dbproj/report', token, None)] * concurrency)
+            total += elapsed
+            results += replies
+        summary(name, total, results)
+
+
+def run_enroll(targets, concurrency, rounds):
+    capacity = max(1, concurrency // 4)
+    all_ok = True
+    for name, base_url in targets:
+        total, results = 0.0, []
+        for _ in range(rounds):
+            benchmark_enrollment.teardown()
+            edition_id, class_id, student_ids = benchmark_enrollment.setup(concurrency, capacity)
+            calls = [('POST', f'/dbproj/enroll_course_edition/{edition_id}', make_token(student_id, 'student'), {'classes': [class_id]})
+                     for student_id in student_ids]
+            elapsed, replies = fire(base_url, calls)
+            total += elapsed
+            results += replies
+
+            with db_connection() as conn:
+                cur = conn.cursor()
+                cur.execute("SELECT COUNT(*) FROM course_enrollment WHERE edition_id = %s", (edition_id,))
+                enrolled = cur.fetchone()[0]
+            benchmark_enrollment.teardown()
+
+            if enrolled > capacity:
+                print(f'  {name}: OVERBOOKED ({enrolled} enrolled, capacity {capacity})')
+                all_ok = False
+        summary(name, total, results)
+    return all_ok
+
+
+def run_grades(targets, concurrency, rounds):
+    all_ok = True
+    for name, base_url in targets:
+        total, results = 0.0, []
+        for _ in range(rounds):
+            benchmark_enrollment.teardown()
+            edition_id, class_id, student_ids = benchmark_enrollment.setup(concurrency, concurrency)
+            with db_connection() as conn:
+                cur = conn.cursor()
+                cur.execute("SELECT coordinator_id FROM course_edition WHERE edition_id = %s", (edition_id,))
+                coordinator_id = cur.fetchone()[0]
+                cur.execute("""
+                    INSERT INTO course_enrollment (student_id, edition_id)
+                    SELECT unnest(%s::int[]), %s
+                """, (student_ids, edition_id))
+                conn.commit()
+
+            token = make_token(coordinator_id, 'instructor')
+            calls = [('POST', f'/dbproj/submit_grades/{edition_id}', token,
+                      {'period': 'Normal', 'grades': [[student_id, 8 + student_id % 12]]})
+                     for student_id in student_ids]
+            elapsed, replies = fire(base_url, calls)
+            total += elapsed
+            results += replies
+
+            with db_connection() as conn:
+                cur = conn.cursor()
+                cur.execute("SELECT COUNT(*) FROM course_enrollment WHERE edition_id = %s AND grade IS NOT NULL", (edition_id,))
+                graded = cur.fetchone()[0]
+            benchmark_enrollment.teardown()
+
+            if graded != concurrency:
+                print(f'  {name}: {graded} of {concurrency} grades stored')
+                all_ok = False
+        summary(name, total, results)
+    return all_ok
+
+
+SCENARIOS = {'report': run_report, 'enroll': run_enroll, 'grades': run_grades}
+
+
+def run(targets, scenario, concurrency_levels, rounds):
+    """Run scenario against every (name, base_url) target; False if a consistency check failed"""
+    all_ok = True
+    for concurrency in concurrency_levels:
+        print(f'{scenario}, {concurrency} concurrent requests, {rounds} rounds')
+        all_ok = SCENARIOS[scenario](targets, concurrency, rounds) is not False and all_ok
+    return all_ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load benchmark of the sync and async apps')
+    parser.add_argument('--sync-url', default='http://127.0.0.1:5000')
+    parser.add_argument('--async-url', default='http://127.0.0.1:5001')
+    parser.add_argument('--scenario', choices=sorted(SCENARIOS), default='report')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[50, 200, 500])
+    parser.add_argument('--rounds', type=int, default=3)
+    args = parser.parse_args()
+
+    targets = [('sync', args.sync_url), ('async', args.async_url)]
+    return run(targets, args.scenario, args.concurrency, args.rounds)
+
+
+if __name__ == '__main__':
+    raise SystemExit(0 if main() else 1)
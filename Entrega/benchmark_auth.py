@@ -0,0 +1,57 @@
+##
+## Benchmark of the per-request authentication overhead
+##
+## Times, with the token cache off (every request runs jwt.decode) and on
+## (repeat requests are served from token_cache):
+##   - authenticate: demoApi.authenticate() alone
+##   - request:      a full GET /dbproj/admin/cache_stats through the Flask
+##                   test client (token_required plus an endpoint that does
+##                   not touch the database)
+## and prints the token cache statistics.
+##
+## Usage: python benchmark_auth.py [number]
+##
+
+import sys
+import timeit
+from datetime import datetime, timedelta
+
+import jwt
+
+import demoApi
+from demoApi import app, authenticate, token_cache
+
+
+def make_token():
+    return jwt.encode({
+        'user_id': 1,
+        'role': 'admin',
+        'exp': datetime.utcnow() + timedelta(hours=1)
+    }, app.config['JWT_SECRET_KEY'], algorithm='HS256')
+
+
+def measure(func, number):
+    return min(timeit.repeat(func, number=number, repeat=5)) / number
+
+
+def run(number=20000):
+    header = f'Bearer {make_token()}'
+    client = app.test_client()
+
+    def request():
+        reply = client.get('/dbproj/admin/cache_stats', headers={'Authorization': header})
+        assert reply.status_code == 200
+
+    print(f'{"cache":>6} {"authenticate":>14} {"request":>12}')
+    for enabled in (False, True):
+        app.config['TOKEN_CACHE'] = enabled
+        token_cache.clear()
+        auth = measure(lambda: authenticate(header), number)
+        full = measure(request, max(1, number // 10))
+        print(f'{"on" if enabled else "off":>6} {auth * 1e6:>12.1f}us {full * 1e6:>10.1f}us')
+
+    print(f'token cache: {token_cache.stats()}')
+
+
+if __name__ == '__main__':
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 20000)
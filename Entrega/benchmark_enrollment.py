@@ -0,0 +1,159 @@
+##
+## Concurrency benchmark for /dbproj/enroll_course_edition
+##
+## Creates a temporary course edition with a small capacity and a few hundred
+## students, fires all enrollments at the same time through the Flask test
+## client and checks that the edition was never overbooked.
+##
+## Usage: python benchmark_enrollment.py [students] [capacity]
+##
+
+import sys
+import time
+import threading
+from datetime import datetime, timedelta
+
+import jwt
+
+import demoApi
+from demoApi import app, db_connection
+
+BENCH_PREFIX = 'bench_enroll_'
+BENCH_COURSE = 'BENCHENR'
+
+
+def setup(students, capacity):
+    """Create the coordinator, course, edition, class and students used by the benchmark"""
+    with db_connection() as conn:
+        cur = conn.cursor()
+        cur.execute("""
+            INSERT INTO users (username, password, email, role)
+            VALUES (%s, 'bench', NULL, 'instructor')
+            RETURNING user_id
+        """, (BENCH_PREFIX + 'coordinator',))
+        coordinator_id = cur.fetchone()[0]
+        cur.execute("INSERT INTO instructor (user_id, is_coordinator) VALUES (%s, true)", (coordinator_id,))
+
+        cur.execute("INSERT INTO course (code, name, credits) VALUES (%s, 'Benchmark course', 6)", (BENCH_COURSE,))
+        cur.execute("""
+            INSERT INTO course_edition (course_code, year, capacity, coordinator_id)
+            VALUES (%s, %s, %s, %s)
+            RETURNING edition_id
+        """, (BENCH_COURSE, datetime.now().year, capacity, coordinator_id))
+        edition_id = cur.fetchone()[0]
+        cur.execute("""
+            INSERT INTO class (edition_id, type, schedule)
+            VALUES (%s, 'T', 'Benchmark')
+            RETURNING class_id
+        """, (edition_id,))
+        class_id = cur.fetchone()[0]
+
+        cur.execute("""
+            INSERT INTO users (username, password, email, role)
+            SELECT %s || i, 'bench', NULL, 'student'
+            FROM generate_series(1, %s) AS i
+            RETURNING user_id
+        """, (BENCH_PREFIX + 'student_', students))
+        student_ids = [row[0] for row in cur.fetchall()]
+        cur.execute("""
+            INSERT INTO student (user_id, name)
+            SELECT unnest(%s::int[]), 'Benchmark student'
+        """, (student_ids,))
+
+        conn.commit()
+
+    return edition_id, class_id, student_ids
+
+
+def teardown():
+    """Remove everything created by setup()"""
+    with db_connection() as conn:
+        cur = conn.cursor()
+        cur.execute("DELETE FROM student_class WHERE class_id IN (SELECT class_id FROM class cl JOIN course_edition ced ON cl.edition_id = ced.edition_id WHERE ced.course_code = %s)", (BENCH_COURSE,))
+        cur.execute("DELETE FROM course_enrollment WHERE edition_id IN (SELECT edition_id FROM course_edition WHERE course_code = %s)", (BENCH_COURSE,))
+        cur.execute("DELETE FROM class WHERE edition_id IN (SELECT edition_id FROM course_edition WHERE course_code = %s)", (BENCH_COURSE,))
+        cur.execute("DELETE FROM course_edition WHERE course_code = %s", (BENCH_COURSE,))
+        cur.execute("DELETE FROM course WHERE code = %s", (BENCH_COURSE,))
+        cur.execute("DELETE FROM academic_record WHERE student_id IN (SELECT user_id FROM users WHERE username LIKE %s)", (BENCH_PREFIX + '%',))
+        cur.execute("DELETE FROM student WHERE user_id IN (SELECT user_id FROM users WHERE username LIKE %s)", (BENCH_PREFIX + '%',))
+        cur.execute("DELETE FROM instructor WHERE user_id IN (SELECT user_id FROM users WHERE username LIKE %s)", (BENCH_PREFIX + '%',))
+        cur.execute("DELETE FROM users WHERE username LIKE %s", (BENCH_PREFIX + '%',))
+        conn.commit()
+
+
+def make_token(user_id):
+    return jwt.encode({
+        'user_id': user_id,
+        'role': 'student',
+        'exp': datetime.utcnow() + timedelta(hours=1)
+    }, app.config['JWT_SECRET_KEY'], algorithm='HS256')
+
+
+def run(students=300, capacity=50):
+    # Deixar os pedidos esperar por conexões em vez de falhar com 503
+    app.config['DB_POOL_TIMEOUT'] = 60
+
+    teardown()
+    edition_id, class_id, student_ids = setup(students, capacity)
+    tokens = {student_id: make_token(student_id) for student_id in student_ids}
+
+    barrier = threading.Barrier(len(student_ids))
+    outcomes = {'success': 0, 'full': 0, 'other': 0}
+    outcomes_lock = threading.Lock()
+    latencies = []
+
+    def enroll(student_id):
+        client = app.test_client()
+        barrier.wait()
+        started = time.perf_counter()
+        reply = client.post(
+            f'/dbproj/enroll_course_edition/{edition_id}',
+            json={'classes': [class_id]},
+            headers={'Authorization': f'Bearer {tokens[student_id]}'}
+        ).get_json()
+        elapsed = time.perf_counter() - started
+
+        if reply['status'] == demoApi.StatusCodes['success']:
+            outcome = 'success'
+        elif reply.get('errors') == 'Course edition is full':
+            outcome = 'full'
+        else:
+            outcome = 'other'
+        with outcomes_lock:
+            outcomes[outcome] += 1
+            latencies.append(elapsed)
+
+    threads = [threading.Thread(target=enroll, args=(student_id,)) for student_id in student_ids]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    total = time.perf_counter() - started
+
+    with db_connection() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT COUNT(*) FROM course_enrollment WHERE edition_id = %s", (edition_id,))
+        enrolled = cur.fetchone()[0]
+        cur.execute("SELECT enrolled_count FROM course_edition WHERE edition_id = %s", (edition_id,))
+        counter = cur.fetchone()[0]
+
+    teardown()
+
+    latencies.sort()
+    print(f'students: {students}, capacity: {capacity}')
+    print(f'outcomes: {outcomes}')
+    print(f'enrolled rows: {enrolled}, enrolled_count: {counter}')
+    print(f'total: {total:.2f}s, p50: {latencies[len(latencies) // 2] * 1000:.1f}ms, '
+          f'p99: {latencies[int(len(latencies) * 0.99) - 1] * 1000:.1f}ms')
+    print(f'pool: {demoApi.get_db_pool().stats()}')
+
+    overbooked = enrolled > capacity or enrolled != counter or outcomes['success'] != enrolled
+    print('RESULT:', 'OVERBOOKED' if overbooked else 'OK (no overbooking)')
+    return not overbooked
+
+
+if __name__ == '__main__':
+    students = int(sys.argv[1]) if len(sys.argv) > 1 else 300
+    capacity = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+    sys.exit(0 if run(students, capacity) else 1)
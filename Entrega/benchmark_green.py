@@ -0,0 +1,75 @@
+##
+## Benchmark of the green-thread mode against the threaded mode
+##
+## Starts demoApi twice through wsgi.py, with the same number of workers:
+##   - threaded: gthread workers with --threads threads each
+##   - green:    gevent workers (--green), psycopg2 cooperative
+## and runs a scenario of benchmark_async against both (enroll and grades are
+## the endpoints that spend most of their time waiting for Postgres).
+##
+## Usage: python benchmark_green.py [--scenario enroll|grades|report] [--workers 1] [--threads 4]
+##                                  [--concurrency 50 200 500]
+##
+
+import argparse
+import os
+import socket
+import subprocess
+import sys
+import time
+
+import benchmark_async
+
+SERVERS = {
+    'threaded': ('127.0.0.1', 5010),
+    'green': ('127.0.0.1', 5011)
+}
+
+
+def start_server(name, args):
+    host, port = SERVERS[name]
+    command = [sys.executable, 'wsgi.py', '--bind', f'{host}:{port}', '--workers', str(args.workers),
+               '--threads', str(args.threads), '--pidfile', f'bench_{name}.pid']
+    if name == 'green':
+        command.append('--green')
+    # Sem API_GREEN herdado: o modo é escolhido só pela linha de comando
+    env = {key: value for key, value in os.environ.items() if key != 'API_GREEN'}
+    return subprocess.Popen(command, env=env, stdout=subprocess.DEVNULL)
+
+
+def wait_ready(name, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(SERVERS[name], timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise SystemExit(f'{name} server did not start on {SERVERS[name]}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Green-thread vs threaded mode benchmark')
+    parser.add_argument('--scenario', choices=sorted(benchmark_async.SCENARIOS), default='enroll')
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--threads', type=int, default=4)
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[50, 200, 500])
+    parser.add_argument('--rounds', type=int, default=3)
+    args = parser.parse_args()
+
+    servers = {name: start_server(name, args) for name in SERVERS}
+    try:
+        for name in SERVERS:
+            wait_ready(name)
+        targets = [(name, f'http://{host}:{port}') for name, (host, port) in SERVERS.items()]
+        print(f'workers: {args.workers}, threads (threaded mode): {args.threads}')
+        return benchmark_async.run(targets, args.scenario, args.concurrency, args.rounds)
+    finally:
+        for server in servers.values():
+            server.terminate()
+        for server in servers.values():
+            server.wait()
+
+
+if __name__ == '__main__':
+    raise SystemExit(0 if main() else 1)
@@ -0,0 +1,79 @@
+##
+## Microbenchmark for the JSON serialization of responses
+##
+## Builds degree_details-sized payloads (rows as returned by degree_details_row
+## plus Decimal grades, as student_details returns them) and times, per payload:
+##   - flask default: Flask's DefaultJSONProvider (stdlib json, sorted keys),
+##                    with the Decimal values converted by hand with float()
+##   - json:          dumps_json with JSON_SERIALIZER = 'json'
+##   - orjson:        dumps_json with JSON_SERIALIZER = 'orjson' (if installed)
+##
+## Usage: python benchmark_json.py [rows ...]
+##
+
+import sys
+import timeit
+from decimal import Decimal
+
+from flask.json.provider import DefaultJSONProvider
+
+import demoApi
+from demoApi import app, dumps_json
+
+
+def make_payload(rows):
+    """A degree_details-like response with rows course editions"""
+    results = []
+    for i in range(rows):
+        results.append({
+            'course_id': f'C{i % 400:04d}',
+            'course_name': f'Course number {i % 400}',
+            'course_edition_id': i,
+            'course_edition_year': 2015 + i % 10,
+            'capacity': 120,
+            'enrolled_count': 37 + i % 80,
+            'approved_count': 21 + i % 50,
+            'coordinator_id': 1000 + i % 60,
+            'instructors': [1000 + i % 60, 1100 + i % 40, 1200 + i % 30],
+            'average_grade': Decimal(f'{10 + i % 10}.{i % 100:02d}')
+        })
+    return {'status': demoApi.StatusCodes['success'], 'errors': None, 'results': results, 'next_cursor': None}
+
+
+def by_hand(payload):
+    """The payload with Decimal converted by hand, as the endpoints used to do"""
+    return {**payload, 'results': [
+        {**row, 'average_grade': float(row['average_grade'])} for row in payload['results']
+    ]}
+
+
+def measure(func, number):
+    return min(timeit.repeat(func, number=number, repeat=5)) / number
+
+
+def run(sizes):
+    flask_default = DefaultJSONProvider(app)
+    serializers = ['json'] + (['orjson'] if demoApi.orjson is not None else [])
+    original = app.config['JSON_SERIALIZER']
+
+    print(f'{"rows":>6} {"bytes":>9} {"flask default":>14} ' + ' '.join(f'{name:>10}' for name in serializers))
+    for rows in sizes:
+        payload = make_payload(rows)
+        number = max(1, 20000 // rows)
+
+        timings = [measure(lambda: flask_default.dumps(by_hand(payload)), number)]
+        for name in serializers:
+            app.config['JSON_SERIALIZER'] = name
+            timings.append(measure(lambda: dumps_json(payload), number))
+        app.config['JSON_SERIALIZER'] = original
+
+        size = len(dumps_json(payload).encode())
+        print(f'{rows:>6} {size:>9} ' + ' '.join(f'{t * 1000:>{w}.3f}ms' for t, w in zip(timings, [12] + [8] * len(serializers))))
+
+    if demoApi.orjson is None:
+        print('orjson is not installed, only the stdlib serializers were measured')
+
+
+if __name__ == '__main__':
+    sizes = [int(arg) for arg in sys.argv[1:]] or [50, 500, 5000]
+    run(sizes)
@@ -20,9 +20,33 @@ import time
 import random
 import datetime
 from datetime import datetime, timedelta  # ← Para expiração do token
+from datetime import date
+import decimal
 import jwt          # JWT handling tokens
 from functools import wraps
 import json
+import base64
+import hashlib
+import os
+import threading
+import queue
+import select
+import uuid
+import collections
+import concurrent.futures
+import multiprocessing
+import psycopg2.errors
+import psycopg2.extensions
+import psycopg2.pool
+from contextlib import contextmanager
+from flask.json.provider import DefaultJSONProvider
+
+import passwords
+
+try:
+    import orjson   # opcional: serialização JSON mais rápida
+except ImportError:
+    orjson = None
 
 app = flask.Flask(__name__)
 app.config['JWT_SECRET_KEY'] = 'some_jwt_secret_key'
@@ -35,49 +59,1810 @@ StatusCodes = {
     'success': 200,
     'api_error': 400,
     'internal_error': 500,
-    'unauthorized': 401
+    'unauthorized': 401,
+    'service_unavailable': 503
 }
 
+##########################################################
+## JSON SERIALIZATION
+##########################################################
+
+# Todas as respostas (flask.jsonify e streaming) passam por dumps_json. Com o
+# orjson instalado é usado por omissão; Decimal (notas, médias), date e
+# datetime são serializados aqui, por isso os endpoints passam os valores da
+# base de dados tal como vêm.
+app.config['JSON_SERIALIZER'] = 'orjson' if orjson is not None else 'json'
+
+
+def json_default(obj):
+    if isinstance(obj, decimal.Decimal):
+        return float(obj)
+    if isinstance(obj, (datetime, date)):
+        return obj.isoformat()
+    raise TypeError(f'Object of type {type(obj).__name__} is not JSON serializable')
+
+
+def dumps_json(obj):
+    """Serialize obj to a JSON string with the configured serializer"""
+    if app.config['JSON_SERIALIZER'] == 'orjson':
+        return orjson.dumps(obj, default=json_default, option=orjson.OPT_NON_STR_KEYS).decode()
+    return json.dumps(obj, default=json_default, separators=(',', ':'), ensure_ascii=False)
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    """Flask JSON provider backed by dumps_json"""
+
+    def dumps(self, obj, **kwargs):
+        return dumps_json(obj)
+
+    def loads(self, s, **kwargs):
+        if app.config['JSON_SERIALIZER'] == 'orjson':
+            return orjson.loads(s)
+        return json.loads(s)
+
+
+app.json = FastJSONProvider(app)
+
 ##########################################################
 ## DATABASE ACCESS
 ##########################################################
 
+DB_PARAMS = {
+    'user': 'postgres',
+    'password': 'postgres',
+    'host': '127.0.0.1',
+    'port': '5432',
+    #'database': 'dbfichas',
+    'database': 'bdproject'  # change to your database name
+}
+
+# Configuração do pool de conexões (ajustar à carga esperada)
+app.config['DB_POOL_MIN_SIZE'] = 2       # conexões abertas no arranque
+app.config['DB_POOL_MAX_SIZE'] = 20      # nunca abrir mais do que isto
+app.config['DB_POOL_TIMEOUT'] = 5        # segundos à espera de uma conexão livre
+app.config['DB_POOL_PING_AFTER'] = 30    # segundos parada antes de testar a conexão com SELECT 1
+
+
+class PoolTimeout(Exception):
+    """Raised when no connection becomes available within the acquire timeout"""
+
+
+class DatabaseUnavailable(Exception):
+    """Raised when the pool cannot open a new connection (database down or unreachable)"""
+
+
+class ConnectionPool:
+    """Thread-safe pool of psycopg2 connections.
+
+    Connections are checked on checkout (closed/broken ones are replaced and
+    long-idle ones are pinged) and rolled back on return, so a request never
+    sees a transaction left open by a previous one.
+    """
+
+    def __init__(self, minconn, maxconn, timeout, ping_after, **params):
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.ping_after = ping_after
+        self.params = params
+        self.pid = os.getpid()   # conexões não podem ser partilhadas com processos filhos
+
+        self._idle = []          # pilha de (conn, último uso) - LIFO mantém as conexões "quentes"
+        self._size = 0           # conexões abertas (livres + em uso + a abrir)
+        self._waiting = 0
+        self._closed = False
+        self._cond = threading.Condition()
+        self._counters = {
+            'created': 0,
+            'acquired': 0,
+            'released': 0,
+            'discarded': 0,
+            'timeouts': 0,
+            'waits': 0,
+            'wait_time': 0.0
+        }
+
+        try:
+            for _ in range(minconn):
+                self._idle.append((self._connect(), time.monotonic()))
+                self._size += 1
+        except DatabaseUnavailable:
+            for conn, _ in self._idle:
+                self._close_quietly(conn)
+            raise
+
+    def _connect(self):
+        try:
+            conn = psycopg2.connect(**self.params)
+        except psycopg2.OperationalError as error:
+            raise DatabaseUnavailable(str(error).strip()) from error
+        with self._cond:
+            self._counters['created'] += 1
+        return conn
+
+    def _is_healthy(self, conn, last_used):
+        if conn.closed:
+            return False
+        if conn.info.transaction_status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+            return False
+        if time.monotonic() - last_used < self.ping_after:
+            return True
+        try:
+            with conn.cursor() as cur:
+                cur.execute('SELECT 1')
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def _close_quietly(self, conn):
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+
+    def getconn(self):
+        deadline = time.monotonic() + self.timeout
+        with self._cond:
+            started = None
+            while True:
+                if self._closed:
+                    raise psycopg2.pool.PoolError('connection pool is closed')
+                if self._idle:
+                    conn, last_used = self._idle.pop()
+                    break
+                if self._size < self.maxconn:
+                    # Reservar o lugar já, a conexão é aberta fora do lock
+                    self._size += 1
+                    conn, last_used = None, None
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._counters['timeouts'] += 1
+                    raise PoolTimeout(f'No database connection available after {self.timeout}s')
+                if started is None:
+                    started = time.monotonic()
+                    self._counters['waits'] += 1
+                self._waiting += 1
+                self._cond.wait(remaining)
+                self._waiting -= 1
+            if started is not None:
+                self._counters['wait_time'] += time.monotonic() - started
+
+        if conn is not None and not self._is_healthy(conn, last_used):
+            logger.warning('Discarding broken pooled connection')
+            self._close_quietly(conn)
+            with self._cond:
+                self._counters['discarded'] += 1
+            conn = None
+
+        if conn is None:
+            try:
+                conn = self._connect()
+            except Exception:
+                with self._cond:
+                    self._size -= 1
+                    self._cond.notify()
+                raise
+
+        with self._cond:
+            self._counters['acquired'] += 1
+        return conn
+
+    def putconn(self, conn, discard=False):
+        if not discard and not conn.closed:
+            try:
+                # Desfazer qualquer transação que o pedido tenha deixado aberta
+                if conn.info.transaction_status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+                if conn.autocommit:
+                    conn.autocommit = False
+            except psycopg2.Error:
+                discard = True
+
+        with self._cond:
+            self._counters['released'] += 1
+            if discard or conn.closed or self._closed:
+                self._size -= 1
+                self._counters['discarded'] += 1
+                self._close_quietly(conn)
+            else:
+                self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+
+    def closeall(self):
+        with self._cond:
+            self._closed = True
+            for conn, _ in self._idle:
+                self._close_quietly(conn)
+            self._size -= len(self._idle)
+            self._idle = []
+            self._cond.notify_all()
+
+    def stats(self):
+        with self._cond:
+            stats = dict(self._counters)
+            stats.update({
+                'min_size': self.minconn,
+                'max_size': self.maxconn,
+                'size': self._size,
+                'idle': len(self._idle),
+                'in_use': self._size - len(self._idle),
+                'waiting': self._waiting,
+                'pid': self.pid
+            })
+        stats['wait_time'] = round(stats['wait_time'], 3)
+        return stats
+
+
+db_pool = None
+db_pool_lock = threading.Lock()
+
+def get_db_pool():
+    global db_pool
+    # Depois de um fork (workers do servidor WSGI) o pool herdado pertence ao
+    # processo pai: é abandonado sem fechar as conexões, que continuam a ser dele
+    if db_pool is None or db_pool.pid != os.getpid():
+        with db_pool_lock:
+            if db_pool is None or db_pool.pid != os.getpid():
+                db_pool = ConnectionPool(
+                    app.config['DB_POOL_MIN_SIZE'],
+                    app.config['DB_POOL_MAX_SIZE'],
+                    app.config['DB_POOL_TIMEOUT'],
+                    app.config['DB_POOL_PING_AFTER'],
+                    **DB_PARAMS
+                )
+                logger.info('Database connection pool created')
+    return db_pool
+
+def reset_db_pool_after_fork():
+    global db_pool_lock
+    db_pool_lock = threading.Lock()   # pode ter sido copiado bloqueado
+
+os.register_at_fork(after_in_child=reset_db_pool_after_fork)
+
+def close_db_pool():
+    """Close the idle connections of this process's pool (at shutdown or before forking)"""
+    global db_pool
+    with db_pool_lock:
+        if db_pool is not None and db_pool.pid == os.getpid():
+            db_pool.closeall()
+        db_pool = None
+
+def make_psycopg2_green():
+    """Make psycopg2 yield to other greenlets while it waits for the server (gevent).
+
+    Must be called after gevent's monkey patching; the same wait callback as
+    psycogreen.gevent.patch_psycopg().
+    """
+    from gevent.socket import wait_read, wait_write
+
+    def wait_callback(conn, timeout=None):
+        while True:
+            state = conn.poll()
+            if state == psycopg2.extensions.POLL_OK:
+                break
+            elif state == psycopg2.extensions.POLL_READ:
+                wait_read(conn.fileno(), timeout=timeout)
+            elif state == psycopg2.extensions.POLL_WRITE:
+                wait_write(conn.fileno(), timeout=timeout)
+            else:
+                raise psycopg2.OperationalError(f'Bad result from poll: {state}')
+
+    psycopg2.extensions.set_wait_callback(wait_callback)
+    logger.info('psycopg2 wait callback installed (green threads)')
+
+@contextmanager
 def db_connection():
-    print("Connecting to the PostgreSQL database...")
-    db = psycopg2.connect(
-        user='postgres',
-        password='postgres',
-        host='127.0.0.1',
-        port='5432',
-        #database='dbfichas',
-        database='bdproject'  # change to your database name
-    )
-    #db.autocommit = True  # ← ADD THIS LINE
-    print("Connection successful")
-    return db
+    """Borrow a pooled connection for the duration of the with block"""
+    pool = get_db_pool()
+    conn = pool.getconn()
+    discard = False
+    try:
+        yield conn
+    except (psycopg2.OperationalError, psycopg2.InterfaceError):
+        discard = True
+        raise
+    finally:
+        pool.putconn(conn, discard=discard)
 
 ##########################################################
 ## AUTHENTICATION HELPERS
 ##########################################################
 
+def authenticate(auth):
+    """(payload, None) for a valid Authorization header, (None, error message) otherwise"""
+    if not auth or not auth.startswith('Bearer '):
+        return None, 'Token missing or invalid'
+    token = auth.split(' ',1)[1]
+
+    # Tokens já verificados: a entrada expira no exp do token, por isso um token
+    # expirado nunca é servido pela cache e volta a ser recusado pelo jwt.decode
+    use_cache = app.config['TOKEN_CACHE']
+    if use_cache:
+        key = hashlib.sha256(token.encode()).digest()
+        payload = token_cache.get(key)
+        if payload is not None:
+            return payload, None
+
+    try:
+        payload = jwt.decode(token, app.config['JWT_SECRET_KEY'], algorithms=['HS256'])
+    except jwt.ExpiredSignatureError:
+        return None, 'Token expired'
+    except jwt.InvalidTokenError:
+        return None, 'Invalid token'
+
+    # Sem exp não há quando expirar a entrada: esses tokens são sempre verificados
+    if use_cache and isinstance(payload.get('exp'), (int, float)):
+        ttl = payload['exp'] - time.time()
+        if ttl > 0:
+            token_cache.set(key, payload, ttl=ttl)
+    return payload, None
+
 def token_required(f):
     @wraps(f)
     def decorated(*args, **kwargs):
-        auth = flask.request.headers.get('Authorization')
-        if not auth or not auth.startswith('Bearer '):
-            return flask.jsonify({'status': StatusCodes['unauthorized'], 'errors': 'Token missing or invalid', 'results': None}), 401
-        token = auth.split(' ',1)[1]
-        try:
-            payload = jwt.decode(token, app.config['JWT_SECRET_KEY'], algorithms=['HS256'])
-            flask.g.user_id = payload.get('user_id')
-            flask.g.role = payload.get('role')
-        except jwt.ExpiredSignatureError:
-            return flask.jsonify({'status': StatusCodes['unauthorized'], 'errors': 'Token expired', 'results': None}), 401
-        except jwt.InvalidTokenError:
-            return flask.jsonify({'status': StatusCodes['unauthorized'], 'errors': 'Invalid token', 'results': None}), 401
+        payload, error = authenticate(flask.request.headers.get('Authorization'))
+        if error:
+            return flask.jsonify({'status': StatusCodes['unauthorized'], 'errors': error, 'results': None}), 401
+        flask.g.user_id = payload.get('user_id')
+        flask.g.role = payload.get('role')
         return f(*args, **kwargs)
     return decorated
 
+@app.errorhandler(PoolTimeout)
+def handle_pool_timeout(error):
+    logger.error(f'Database pool exhausted: {error}')
+    return flask.jsonify({'status': StatusCodes['service_unavailable'], 'errors': 'Server busy, try again later', 'results': None}), 503
+
+@app.errorhandler(DatabaseUnavailable)
+def handle_database_unavailable(error):
+    logger.error(f'Database unavailable: {error}')
+    return flask.jsonify({'status': StatusCodes['service_unavailable'], 'errors': 'Database unavailable, try again later', 'results': None}), 503
+
+##########################################################
+## PASSWORDS
+##########################################################
+
+# As passwords são guardadas com scrypt (ver passwords.py). Cada hash demora
+# ~100 ms de CPU, por isso corre num pool de processos dedicado: no máximo
+# PASSWORD_HASH_WORKERS hashes em simultâneo e PASSWORD_HASH_MAX_PENDING
+# pedidos à espera (os seguintes recebem 503 de imediato), para que um pico de
+# logins não ocupe todos os workers de que as inscrições e notas precisam.
+# Com os valores por omissão um pedido espera no máximo ~0.5 s pela sua vez
+# (8 pedidos / 2 processos * 100 ms); o timeout só apanha um pool avariado.
+# Os processos do pool (spawn) importam de novo o módulo principal e demoram a
+# arrancar: são arrancados com o pool, ao iniciar cada processo da API, e esse
+# arranque (até PASSWORD_POOL_START_TIMEOUT) não conta para o timeout de um hash.
+app.config['PASSWORD_HASH_N'] = 2 ** 15
+app.config['PASSWORD_HASH_R'] = 8
+app.config['PASSWORD_HASH_P'] = 1
+app.config['PASSWORD_HASH_WORKERS'] = 2
+app.config['PASSWORD_HASH_MAX_PENDING'] = 8
+app.config['PASSWORD_HASH_TIMEOUT'] = 2    # segundos
+app.config['PASSWORD_POOL_START_TIMEOUT'] = 30
+
+
+class PasswordHashBusy(Exception):
+    """Raised when the password hashing pool has too many pending jobs"""
+
+
+password_pool = None
+password_pool_pid = None
+password_pool_warmup = []   # um job vazio por processo do pool, concluídos quando arrancaram
+password_pending = 0
+password_pool_lock = threading.Lock()
+
+
+def password_hash_params():
+    return app.config['PASSWORD_HASH_N'], app.config['PASSWORD_HASH_R'], app.config['PASSWORD_HASH_P']
+
+
+def get_password_pool():
+    global password_pool, password_pool_pid, password_pool_warmup
+    with password_pool_lock:
+        # Como o pool de conexões: um pool de processos por processo da API
+        if password_pool is None or password_pool_pid != os.getpid():
+            password_pool = concurrent.futures.ProcessPoolExecutor(
+                max_workers=app.config['PASSWORD_HASH_WORKERS'],
+                mp_context=multiprocessing.get_context('spawn')
+            )
+            password_pool_pid = os.getpid()
+            # Cada submit sem processos livres arranca um processo novo
+            password_pool_warmup = [password_pool.submit(os.getpid)
+                                    for _ in range(app.config['PASSWORD_HASH_WORKERS'])]
+        return password_pool
+
+
+def reset_password_pool_after_fork():
+    global password_pool_lock, password_pending
+    password_pool_lock = threading.Lock()
+    password_pending = 0
+
+os.register_at_fork(after_in_child=reset_password_pool_after_fork)
+
+
+@contextmanager
+def password_job_slot():
+    """Reserve one of the PASSWORD_HASH_MAX_PENDING slots (raises PasswordHashBusy)"""
+    global password_pending
+    with password_pool_lock:
+        if password_pending >= app.config['PASSWORD_HASH_MAX_PENDING']:
+            raise PasswordHashBusy('Too many password checks in progress')
+        password_pending += 1
+    try:
+        yield
+    finally:
+        with password_pool_lock:
+            password_pending -= 1
+
+
+def run_password_job(func, *args):
+    """Run func(*args) in the password pool and return its result"""
+    with password_job_slot():
+        pool = get_password_pool()
+        concurrent.futures.wait(password_pool_warmup, timeout=app.config['PASSWORD_POOL_START_TIMEOUT'])
+        future = pool.submit(func, *args)
+        try:
+            return future.result(timeout=app.config['PASSWORD_HASH_TIMEOUT'])
+        except concurrent.futures.TimeoutError:
+            future.cancel()
+            raise PasswordHashBusy('Password check timed out')
+
+
+def hash_new_password(password):
+    """Stored value for a new password, hashed in the password pool"""
+    return run_password_job(passwords.hash_password, password, *password_hash_params())
+
+
+def upgrade_password_hash(user_id, old_stored, password):
+    """Replace a legacy stored password by its hash; on failure it is retried at the next login"""
+    try:
+        hashed = hash_new_password(password)
+        with db_connection() as conn:
+            cur = conn.cursor()
+            # Só se a password não foi alterada entretanto
+            cur.execute("UPDATE users SET password = %s WHERE user_id = %s AND password = %s",
+                        (hashed, user_id, old_stored))
+            conn.commit()
+    except (PasswordHashBusy, PoolTimeout, psycopg2.DatabaseError) as error:
+        logger.warning(f'Password hash upgrade of user {user_id} postponed: {error}')
+
+
+@app.errorhandler(PasswordHashBusy)
+def handle_password_hash_busy(error):
+    logger.error(f'Password hashing pool busy: {error}')
+    return flask.jsonify({'status': StatusCodes['service_unavailable'], 'errors': 'Too many logins in progress, try again later', 'results': None}), 503
+
+##########################################################
+## CACHES
+##########################################################
+
+class LRUCache:
+    """Thread-safe bounded LRU mapping with optional per-entry TTL and hit/miss counters"""
+
+    def __init__(self, maxsize, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = collections.OrderedDict()   # key -> (value, expira em)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                value, expires = entry
+                if expires is None or expires > time.monotonic():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+            self.misses += 1
+            return default
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        expires = time.monotonic() + ttl if ttl is not None else None
+        with self._lock:
+            self._data[key] = (value, expires)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def pop(self, key):
+        with self._lock:
+            entry = self._data.pop(key, None)
+        return entry[0] if entry is not None else None
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._data),
+                'max_size': self.maxsize,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': round(self.hits / lookups, 3) if lookups else None
+            }
+
+
+# Respostas de student_details por student_id. Só mudam quando há notas
+# submetidas ou inscrições/remoções, e são invalidadas em todos os processos
+# (ver STUDENT_DATA_CHANNEL); o TTL é apenas uma rede de segurança.
+app.config['STUDENT_DETAILS_CACHE_SIZE'] = 5000
+app.config['STUDENT_DETAILS_CACHE_TTL'] = 600
+
+student_details_cache = LRUCache(app.config['STUDENT_DETAILS_CACHE_SIZE'], ttl=app.config['STUDENT_DETAILS_CACHE_TTL'])
+
+# Os dados de um student podem mudar em qualquer processo da API (ou fora dela):
+# os triggers de triggers.sql (secção 10) notificam o canal student_data, uma
+# vez por statement, com os student_ids separados por vírgulas e o listener dos
+# dados de referência, que também escuta este canal, retira as entradas desses
+# students das caches de cada processo. Enquanto o
+# listener não está ligado as caches por student não são usadas. A geração
+# muda a cada invalidação: um valor lido antes de uma invalidação não é guardado.
+STUDENT_DATA_CHANNEL = 'student_data'
+
+student_cache_stats = {'generation': 0, 'notifications': 0}
+student_cache_lock = threading.Lock()
+
+
+def student_caches_usable():
+    start_reference_listener()
+    return reference_data_stats['listening']
+
+
+def student_cache_generation():
+    return student_cache_stats['generation']
+
+
+def store_student_cache(cache, student_id, value, generation):
+    """Cache value for student_id unless the student's data was invalidated since generation"""
+    with student_cache_lock:
+        if student_cache_stats['generation'] == generation:
+            cache.set(student_id, value)
+
+
+def invalidate_student_caches(student_ids):
+    with student_cache_lock:
+        student_cache_stats['generation'] += 1
+        for student_id in student_ids:
+            passed_courses_cache.pop(student_id)
+            student_details_cache.pop(student_id)
+
+
+def clear_student_caches():
+    with student_cache_lock:
+        student_cache_stats['generation'] += 1
+        passed_courses_cache.clear()
+        student_details_cache.clear()
+
+# Payloads de tokens JWT já verificados, por digest SHA-256 do token: os clientes
+# reutilizam o mesmo token em muitos pedidos, que assim saltam a verificação
+# HMAC e o parsing dos claims. Cada entrada expira no exp do token. Ao mudar
+# JWT_SECRET_KEY chamar token_cache.clear().
+app.config['TOKEN_CACHE'] = True
+app.config['TOKEN_CACHE_SIZE'] = 10000
+
+token_cache = LRUCache(app.config['TOKEN_CACHE_SIZE'])
+
+
+##########################################################
+## PREREQUISITES
+##########################################################
+
+# Fecho transitivo dos pré-requisitos: course_code -> todos os pré-requisitos
+# (diretos e indiretos). É reconstruído quando a versão em cache_version muda
+# (trigger em course_prerequisites), versão essa que é lida na mesma query que
+# obtém a course_edition, sem round-trips extra.
+app.config['PASSED_COURSES_CACHE_SIZE'] = 10000
+app.config['PASSED_COURSES_CACHE_TTL'] = 300   # segundos (rede de segurança, ver STUDENT_DATA_CHANNEL)
+
+prerequisite_closure = {'version': None, 'closure': {}, 'cycles': []}
+prerequisite_closure_lock = threading.Lock()
+passed_courses_cache = LRUCache(app.config['PASSED_COURSES_CACHE_SIZE'], ttl=app.config['PASSED_COURSES_CACHE_TTL'])
+
+
+def build_prerequisite_closure(edges):
+    """Return (closure, cycles) for a list of (course_code, prerequisite_code) edges"""
+    graph = collections.defaultdict(set)
+    for course_code, prerequisite_code in edges:
+        graph[course_code].add(prerequisite_code)
+
+    closure = {}
+    cycles = []
+    for course_code in graph:
+        reachable = set()
+        stack = list(graph[course_code])
+        while stack:
+            code = stack.pop()
+            if code in reachable:
+                continue
+            reachable.add(code)
+            stack.extend(graph.get(code, ()))
+        if course_code in reachable:
+            # Um curso que é pré-requisito de si próprio nunca pode ser frequentado
+            cycles.append(course_code)
+        closure[course_code] = frozenset(reachable)
+
+    return closure, sorted(cycles)
+
+
+def get_prerequisite_closure(cur, version, force=False):
+    with prerequisite_closure_lock:
+        if not force and prerequisite_closure['version'] == version and prerequisite_closure['version'] is not None:
+            return prerequisite_closure['closure']
+
+        cur.execute("SELECT course_code, prerequisite_code FROM course_prerequisites")
+        closure, cycles = build_prerequisite_closure(cur.fetchall())
+        if cycles:
+            logger.error(f'Prerequisite cycles detected for courses: {cycles}')
+
+        prerequisite_closure.update({'version': version, 'closure': closure, 'cycles': cycles})
+        logger.info(f'Prerequisite closure rebuilt ({len(closure)} courses, version {version})')
+        return closure
+
+
+PASSED_COURSES_QUERY = """
+    SELECT DISTINCT ced.course_code
+    FROM course_enrollment ce
+    JOIN course_edition ced ON ce.edition_id = ced.edition_id
+    WHERE ce.student_id = %s AND ce.grade >= 9.5
+"""
+
+
+def get_passed_courses(cur, student_id, fresh=False):
+    """Set of course codes the student has passed (grade >= 9.5), cached per student.
+
+    With fresh=True the set is read on cur, in the caller's transaction, and
+    replaces the cached one.
+    """
+    usable = student_caches_usable()
+    passed = passed_courses_cache.get(student_id) if usable and not fresh else None
+    if passed is None:
+        generation = student_cache_generation()
+        cur.execute(PASSED_COURSES_QUERY, (student_id,))
+        passed = frozenset(row[0] for row in cur.fetchall())
+        if usable:
+            store_student_cache(passed_courses_cache, student_id, passed, generation)
+    return passed
+
+
+def meets_prerequisites(cur, student_id, required):
+    """True if the student passed every course in required"""
+    if not required or required <= get_passed_courses(cur, student_id):
+        return True
+    # A cache pode ainda não ter recebido a notificação de uma pauta acabada de
+    # lançar noutro processo: antes de recusar, reler na transação da inscrição
+    return required <= get_passed_courses(cur, student_id, fresh=True)
+
+
+##########################################################
+## REFERENCE DATA
+##########################################################
+
+# Dados de referência (degree_program, activity, course e os campos fixos de
+# course_edition) mudam poucas vezes por ano mas são lidos em quase todas as
+# escritas. Cada processo guarda-os em memória; uma thread com uma conexão
+# própria faz LISTEN reference_data e os triggers de triggers.sql (secção 9)
+# notificam a cada alteração, o que incrementa a geração e obriga a recarregar.
+# Sem o listener ligado os dados valem no máximo REFERENCE_DATA_FALLBACK_TTL.
+# O mesmo listener trata as notificações de STUDENT_DATA_CHANNEL.
+app.config['REFERENCE_DATA_CACHE'] = True
+app.config['REFERENCE_DATA_FALLBACK_TTL'] = 30   # segundos
+app.config['REFERENCE_LISTEN_RETRY'] = 5         # segundos até voltar a ligar o listener
+app.config['REFERENCE_LISTEN_PING'] = 60         # segundos sem notificações antes de testar a conexão
+
+REFERENCE_DATA_CHANNEL = 'reference_data'
+
+# nome -> (query que carrega a tabela, chave primeiro; query de uma linha)
+REFERENCE_TABLES = {
+    'degrees': ("SELECT degree_id, name, tuition_fee FROM degree_program",
+                "SELECT name, tuition_fee FROM degree_program WHERE degree_id = %s"),
+    'activities': ("SELECT activity_id, name, fee FROM activity",
+                   "SELECT name, fee FROM activity WHERE activity_id = %s"),
+    'courses': ("SELECT code, name, credits FROM course",
+                "SELECT name, credits FROM course WHERE code = %s"),
+    'editions': ("SELECT edition_id, course_code, year, capacity, coordinator_id FROM course_edition",
+                 "SELECT course_code, year, capacity, coordinator_id FROM course_edition WHERE edition_id = %s")
+}
+
+reference_data = {'generation': None, 'loaded_at': None, 'tables': None}
+reference_data_stats = {
+    'generation': 0,
+    'listening': False,
+    'notifications': 0,
+    'reloads': 0,
+    'fallback_lookups': 0,
+    'last_error': None
+}
+reference_data_lock = threading.Lock()
+reference_listener_thread = None
+
+
+def reference_key(table, value):
+    """Key of value in table (int ids, text course codes), None if it cannot be one"""
+    if table == 'courses':
+        return value
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def invalidate_reference_data():
+    reference_data_stats['generation'] += 1
+
+
+def reference_data_current():
+    """The cached tables if they are still valid, otherwise None"""
+    if not app.config['REFERENCE_DATA_CACHE']:
+        return None
+    start_reference_listener()
+
+    tables = reference_data['tables']
+    if tables is None or reference_data['generation'] != reference_data_stats['generation']:
+        return None
+    if not reference_data_stats['listening'] and time.monotonic() - reference_data['loaded_at'] > app.config['REFERENCE_DATA_FALLBACK_TTL']:
+        return None
+    return tables
+
+
+def store_reference_data(generation, rows):
+    """Build and cache the tables from {name: rows of its load query} read at generation"""
+    tables = {name: {row[0]: tuple(row[1:]) for row in table_rows} for name, table_rows in rows.items()}
+    # Uma notificação durante a leitura muda a geração: estes dados já nascem inválidos
+    reference_data.update(generation=generation, loaded_at=time.monotonic(), tables=tables)
+    reference_data_stats['reloads'] += 1
+    logger.info(f'Reference data loaded ({", ".join(f"{len(t)} {name}" for name, t in tables.items())})')
+    return tables
+
+
+def get_reference_data(cur, force=False):
+    """The reference tables, (re)loaded on cur when needed; None if the cache is off"""
+    tables = reference_data_current()
+    if (tables is not None and not force) or not app.config['REFERENCE_DATA_CACHE']:
+        return tables
+
+    with reference_data_lock:
+        tables = reference_data_current()
+        if tables is None or force:
+            generation = reference_data_stats['generation']
+            rows = {}
+            for name, (load_query, _) in REFERENCE_TABLES.items():
+                cur.execute(load_query)
+                rows[name] = cur.fetchall()
+            tables = store_reference_data(generation, rows)
+        return tables
+
+
+def reference_row(cur, table, value):
+    """Row of table for value (a tuple of the non-key columns), or None if it does not exist"""
+    key = reference_key(table, value)
+    if key is None:
+        return None
+
+    tables = get_reference_data(cur)
+    if tables is not None and key in tables[table]:
+        return tables[table][key]
+
+    # Cache desligada, ou linha criada depois da última notificação processada
+    reference_data_stats['fallback_lookups'] += 1
+    cur.execute(REFERENCE_TABLES[table][1], (key,))
+    return cur.fetchone()
+
+
+def reference_data_summary():
+    tables = reference_data['tables'] or {}
+    return {
+        **reference_data_stats,
+        'valid': reference_data_current() is not None,
+        'rows': {name: len(rows) for name, rows in tables.items()}
+    }
+
+
+def start_reference_listener():
+    global reference_listener_thread
+    if reference_listener_thread is not None:
+        return
+    with reference_data_lock:
+        if reference_listener_thread is not None:
+            return
+        reference_listener_thread = threading.Thread(target=reference_listener, name='reference-listener', daemon=True)
+        reference_listener_thread.start()
+
+
+def reset_reference_data_after_fork():
+    global reference_data_lock, reference_listener_thread
+    reference_data_lock = threading.Lock()
+    reference_listener_thread = None
+    # O listener não passa para o processo filho: sem ele a cache só vale o fallback TTL
+    reference_data_stats['listening'] = False
+    invalidate_reference_data()
+
+os.register_at_fork(after_in_child=reset_reference_data_after_fork)
+
+
+def dispatch_notifications(notifies):
+    student_ids = set()
+    reference_changed = False
+    for notify in notifies:
+        if notify.channel == STUDENT_DATA_CHANNEL:
+            student_ids.update(int(student_id) for student_id in notify.payload.split(','))
+        else:
+            reference_changed = True
+
+    if student_ids:
+        student_cache_stats['notifications'] += len(student_ids)
+        invalidate_student_caches(student_ids)
+    if reference_changed:
+        reference_data_stats['notifications'] += 1
+        invalidate_reference_data()
+        # Nomes de cursos, anos e coordenadores fazem parte de student_details
+        clear_student_caches()
+
+
+def reference_listener():
+    """LISTEN for reference data and student data changes; reconnects forever"""
+    while True:
+        conn = None
+        try:
+            conn = psycopg2.connect(**DB_PARAMS)
+            conn.autocommit = True
+            cur = conn.cursor()
+            cur.execute(f'LISTEN {REFERENCE_DATA_CHANNEL}')
+            cur.execute(f'LISTEN {STUDENT_DATA_CHANNEL}')
+            # Alterações feitas enquanto não estava à escuta não foram notificadas
+            invalidate_reference_data()
+            clear_student_caches()
+            reference_data_stats['listening'] = True
+            logger.info('Listening for reference data changes')
+
+            while True:
+                if select.select([conn], [], [], app.config['REFERENCE_LISTEN_PING']) == ([], [], []):
+                    cur.execute('SELECT 1')   # deteta uma conexão que morreu em silêncio
+                    continue
+                conn.poll()
+                if conn.notifies:
+                    notifies = list(conn.notifies)
+                    conn.notifies.clear()
+                    dispatch_notifications(notifies)
+        except Exception as error:
+            logger.error(f'Reference data listener error: {error}')
+            reference_data_stats['last_error'] = str(error)
+        finally:
+            reference_data_stats['listening'] = False
+            if conn is not None:
+                conn.close()
+        time.sleep(app.config['REFERENCE_LISTEN_RETRY'])
+
+##########################################################
+## ENROLLMENT QUEUE
+##########################################################
+
+# Modo em fila para a abertura das inscrições: enroll_course_edition grava um
+# ticket na tabela enrollment_ticket e responde logo; workers (threads em cada
+# processo da API) reclamam lotes de tickets com FOR UPDATE SKIP LOCKED e
+# processam-nos numa transação por lote, um savepoint por pedido, agrupados por
+# course_edition. O estado final do ticket é escrito na mesma transação que a
+# inscrição, por isso um worker que morre a meio deixa os tickets em 'queued'
+# para outro os processar, e qualquer processo responde ao estado de um ticket.
+# Um lote que falha com um erro transitório (ligação, serialização, deadlock,
+# timeout) volta à fila, até ENROLL_QUEUE_MAX_ATTEMPTS tentativas.
+app.config['ENROLL_QUEUE_MODE'] = False
+app.config['ENROLL_QUEUE_WORKERS'] = 4
+app.config['ENROLL_QUEUE_MAX_SIZE'] = 5000   # pedidos em espera antes de responder 503
+app.config['ENROLL_QUEUE_BATCH_SIZE'] = 50
+app.config['ENROLL_QUEUE_MAX_ATTEMPTS'] = 5
+app.config['ENROLL_QUEUE_POLL'] = 0.5        # segundos entre consultas à fila quando está vazia
+app.config['ENROLL_TICKET_TTL'] = 3600       # segundos que um ticket concluído fica disponível
+
+enrollment_queue_wakeup = threading.Event()   # acorda os workers deste processo num novo pedido
+enrollment_workers = []
+enrollment_workers_lock = threading.Lock()
+enrollment_tickets_expired_at = 0
+
+
+def start_enrollment_workers():
+    with enrollment_workers_lock:
+        if enrollment_workers:
+            return
+        for i in range(app.config['ENROLL_QUEUE_WORKERS']):
+            worker = threading.Thread(target=enrollment_worker, name=f'enrollment-worker-{i}', daemon=True)
+            worker.start()
+            enrollment_workers.append(worker)
+        logger.info(f'Started {len(enrollment_workers)} enrollment queue workers')
+
+
+def reset_enrollment_queue_after_fork():
+    # As threads não sobrevivem a um fork: o processo filho começa sem workers
+    global enrollment_queue_wakeup, enrollment_workers_lock
+    enrollment_workers.clear()
+    enrollment_queue_wakeup = threading.Event()
+    enrollment_workers_lock = threading.Lock()
+
+os.register_at_fork(after_in_child=reset_enrollment_queue_after_fork)
+
+
+def enqueue_enrollment(student_id, course_edition_id, classes):
+    """Queue an enrollment request (int ids, already validated) and return its ticket (raises queue.Full)"""
+    start_enrollment_workers()
+
+    ticket_id = uuid.uuid4().hex
+    with db_connection() as conn:
+        cur = conn.cursor()
+        try:
+            # Limite da fila e inserção numa só instrução
+            cur.execute("""
+                INSERT INTO enrollment_ticket (ticket_id, student_id, edition_id, classes)
+                SELECT %(ticket_id)s, %(student_id)s, %(edition_id)s, %(classes)s::int[]
+                WHERE (SELECT COUNT(*) FROM enrollment_ticket WHERE status = 'queued') < %(max_size)s
+                RETURNING (SELECT COUNT(*) FROM enrollment_ticket WHERE status = 'queued')
+            """, {'ticket_id': ticket_id, 'student_id': student_id, 'edition_id': course_edition_id,
+                  'classes': classes, 'max_size': app.config['ENROLL_QUEUE_MAX_SIZE']})
+            row = cur.fetchone()
+            conn.commit()
+        except psycopg2.DatabaseError:
+            conn.rollback()
+            raise
+
+    if row is None:
+        raise queue.Full()
+    enrollment_queue_wakeup.set()
+    return {'ticket_id': ticket_id, 'status': 'queued', 'queue_size': row[0] + 1}
+
+
+def get_enrollment_ticket(ticket_id):
+    with db_connection() as conn:
+        cur = conn.cursor()
+        cur.execute("""
+            SELECT ticket_id, student_id, edition_id, status, errors
+            FROM enrollment_ticket
+            WHERE ticket_id = %s AND (finished_at IS NULL OR finished_at > CURRENT_TIMESTAMP - make_interval(secs => %s))
+        """, (ticket_id, app.config['ENROLL_TICKET_TTL']))
+        row = cur.fetchone()
+        conn.commit()
+
+    if row is None:
+        return None
+    return dict(zip(('ticket_id', 'student_id', 'course_edition_id', 'status', 'errors'), row))
+
+
+def expire_enrollment_tickets(cur):
+    """Delete the finished tickets older than ENROLL_TICKET_TTL (the unfinished ones never expire)"""
+    global enrollment_tickets_expired_at
+    if time.monotonic() - enrollment_tickets_expired_at < 60:
+        return
+    enrollment_tickets_expired_at = time.monotonic()
+    cur.execute("""
+        DELETE FROM enrollment_ticket
+        WHERE finished_at < CURRENT_TIMESTAMP - make_interval(secs => %s)
+    """, (app.config['ENROLL_TICKET_TTL'],))
+
+
+def finish_enrollment_ticket(cur, ticket_id, status, errors=None):
+    cur.execute("""
+        UPDATE enrollment_ticket
+        SET status = %s, errors = %s, finished_at = CURRENT_TIMESTAMP
+        WHERE ticket_id = %s
+    """, (status, errors, ticket_id))
+
+
+def enrollment_worker():
+    while True:
+        try:
+            processed = process_enrollment_batch()
+        except Exception as error:
+            logger.error(f'Enrollment batch error: {error}')
+            processed = 0
+
+        if not processed:
+            # Fila vazia: esperar por um pedido deste processo ou pela próxima consulta
+            enrollment_queue_wakeup.wait(app.config['ENROLL_QUEUE_POLL'])
+            enrollment_queue_wakeup.clear()
+
+
+def process_enrollment_batch():
+    """Claim and process up to ENROLL_QUEUE_BATCH_SIZE queued tickets; returns how many were claimed"""
+    tickets = []
+    with db_connection() as conn:
+        cur = conn.cursor()
+        try:
+            expire_enrollment_tickets(cur)
+
+            # Os tickets ficam bloqueados por esta transação (os outros workers
+            # saltam-nos); se ela não chegar ao commit continuam em 'queued'
+            cur.execute("""
+                SELECT ticket_id, student_id, edition_id, classes
+                FROM enrollment_ticket
+                WHERE status = 'queued'
+                ORDER BY created_at
+                LIMIT %s
+                FOR UPDATE SKIP LOCKED
+            """, (app.config['ENROLL_QUEUE_BATCH_SIZE'],))
+            tickets = cur.fetchall()
+            if not tickets:
+                conn.commit()
+                return 0
+
+            accepted = []
+            for ticket_id, student_id, course_edition_id, classes in sorted(tickets, key=lambda t: t[2]):
+                cur.execute('SAVEPOINT enrollment')
+                try:
+                    error = enroll_in_course_edition(cur, student_id, course_edition_id, classes)
+                except psycopg2.IntegrityError as e:
+                    error = 'Integrity error: ' + str(e)
+                except psycopg2.OperationalError:
+                    # Transitório: o lote inteiro volta à fila
+                    raise
+                except psycopg2.DatabaseError as e:
+                    logger.error(f'Queued enrollment error: {e}')
+                    error = str(e)
+
+                if error:
+                    cur.execute('ROLLBACK TO SAVEPOINT enrollment')
+                    finish_enrollment_ticket(cur, ticket_id, 'rejected', error)
+                else:
+                    cur.execute('RELEASE SAVEPOINT enrollment')
+                    finish_enrollment_ticket(cur, ticket_id, 'enrolled')
+                    accepted.append(student_id)
+
+            conn.commit()
+        except psycopg2.DatabaseError as error:
+            conn.rollback()
+            if tickets:
+                transient = isinstance(error, (psycopg2.OperationalError, psycopg2.InterfaceError))
+                fail_enrollment_tickets([t[0] for t in tickets], str(error), transient)
+            raise
+
+    invalidate_student_caches(accepted)
+    return len(tickets)
+
+
+def fail_enrollment_tickets(ticket_ids, errors, transient):
+    # Um lote que falhou por inteiro só volta à fila com um erro transitório e
+    # enquanto tiver tentativas (evita repetir um pedido que falha sempre)
+    with db_connection() as conn:
+        cur = conn.cursor()
+        cur.execute("""
+            UPDATE enrollment_ticket
+            SET attempts = attempts + 1,
+                status = CASE WHEN %(transient)s AND attempts + 1 < %(max_attempts)s THEN 'queued' ELSE 'failed' END,
+                errors = %(errors)s,
+                finished_at = CASE WHEN %(transient)s AND attempts + 1 < %(max_attempts)s THEN NULL ELSE CURRENT_TIMESTAMP END
+            WHERE ticket_id = ANY(%(ticket_ids)s) AND status = 'queued'
+        """, {'transient': transient, 'max_attempts': app.config['ENROLL_QUEUE_MAX_ATTEMPTS'],
+              'errors': errors, 'ticket_ids': ticket_ids})
+        conn.commit()
+
+
+@app.route('/dbproj/admin/enrollment_queue', methods=['GET'])
+@token_required
+def enrollment_queue_stats():
+    # Estado da fila de inscrições, partilhada por todos os processos (apenas admin)
+    if flask.g.role != 'admin':
+        return flask.jsonify({'status': StatusCodes['unauthorized'], 'errors': 'Only admin can access this endpoint', 'results': None})
+
+    with db_connection() as conn:
+        cur = conn.cursor()
+        try:
+            cur.execute("SELECT status, COUNT(*) FROM enrollment_ticket GROUP BY status")
+            by_status = dict(cur.fetchall())
+            conn.commit()
+        except (Exception, psycopg2.DatabaseError) as error:
+            conn.rollback()
+            logger.error(f'Enrollment queue stats error: {error}')
+            return flask.jsonify({'status': StatusCodes['internal_error'], 'errors': str(error), 'results': None})
+
+    results = {
+        'enabled': app.config['ENROLL_QUEUE_MODE'],
+        'workers': len(enrollment_workers),
+        'queue_size': by_status.get('queued', 0),
+        'tickets': by_status
+    }
+    return flask.jsonify({'status': StatusCodes['success'], 'errors': None, 'results': results})
+
+##########################################################
+## STUDENT PURGE
+##########################################################
+
+# Soft delete de students: delete_student só marca student.deleted_at (o student
+# deixa de aparecer em student_details, rankings e relatórios, ver triggers.sql)
+# e um worker em background apaga os dados em lotes pequenos, fora das horas de
+# ponta, com pausas entre lotes e um lock_timeout curto para ceder às transações
+# da API. Com STUDENT_SOFT_DELETE a False o delete continua a ser imediato.
+app.config['STUDENT_SOFT_DELETE'] = False
+app.config['STUDENT_PURGE_BATCH_SIZE'] = 20
+app.config['STUDENT_PURGE_PAUSE'] = 2           # segundos entre lotes
+app.config['STUDENT_PURGE_INTERVAL'] = 300      # segundos entre passagens
+app.config['STUDENT_PURGE_GRACE'] = 3600        # segundos desde o soft delete até poder ser apagado
+app.config['STUDENT_PURGE_HOURS'] = (1, 6)      # janela fora de horas [início, fim) na hora local; None = sempre
+app.config['STUDENT_PURGE_LOCK_TIMEOUT'] = '2s'
+
+# Tabelas com dados de students, pela ordem em que são apagadas (filhos antes dos pais).
+# course_enrollment é apagado enquanto a linha de student ainda existe, para que os
+# triggers reconheçam students já retirados dos agregados pelo soft delete
+STUDENT_DATA_TABLES = [
+    ('activity_participation', 'student_id = ANY(%s)'),
+    ('student_class', 'student_id = ANY(%s)'),
+    ('course_enrollment', 'student_id = ANY(%s)'),
+    ('financial_transaction', 'account_id IN (SELECT account_id FROM financial_account WHERE student_id = ANY(%s))'),
+    ('financial_account', 'student_id = ANY(%s)'),
+    ('degree_enrollment', 'student_id = ANY(%s)'),
+    ('academic_record', 'student_id = ANY(%s)'),
+    ('student', 'user_id = ANY(%s)'),
+    ('users', 'user_id = ANY(%s)')
+]
+
+student_purge_stats = {
+    'leader': False,
+    'running': False,
+    'passes': 0,
+    'batches': 0,
+    'purged': 0,
+    'errors': 0,
+    'last_error': None,
+    'last_batch_at': None
+}
+student_purge_lock = threading.Lock()
+student_purge_worker_thread = None
+
+
+def soft_delete_students(cur, student_ids):
+    """Mark the students as deleted and return the ids that were not already marked"""
+    cur.execute("""
+        UPDATE student
+        SET deleted_at = CURRENT_TIMESTAMP
+        WHERE user_id = ANY(%s) AND deleted_at IS NULL
+        RETURNING user_id
+    """, (list(student_ids),))
+    return [row[0] for row in cur.fetchall()]
+
+
+def purge_students(cur, student_ids):
+    """Hard-delete the students' rows table by table; returns the row count per table"""
+    deleted = {}
+    for table, condition in STUDENT_DATA_TABLES:
+        cur.execute(f'DELETE FROM {table} WHERE {condition}', (list(student_ids),))
+        deleted[table] = cur.rowcount
+    return deleted
+
+
+def in_purge_window(hour=None):
+    window = app.config['STUDENT_PURGE_HOURS']
+    if window is None:
+        return True
+    if hour is None:
+        hour = datetime.now().hour
+    start, end = window
+    if start <= end:
+        return start <= hour < end
+    return hour >= start or hour < end   # janela que passa a meia-noite (e.g., (22, 6))
+
+
+def start_student_purge_worker():
+    global student_purge_worker_thread
+    with student_purge_lock:
+        if student_purge_worker_thread is not None:
+            return
+        student_purge_worker_thread = threading.Thread(target=student_purge_worker, name='student-purge-worker', daemon=True)
+        student_purge_worker_thread.start()
+        logger.info('Started student purge worker')
+
+
+def reset_student_purge_after_fork():
+    global student_purge_lock, student_purge_worker_thread
+    student_purge_lock = threading.Lock()
+    student_purge_worker_thread = None
+    student_purge_stats.update(leader=False, running=False, passes=0, batches=0, purged=0, errors=0, last_error=None, last_batch_at=None)
+
+os.register_at_fork(after_in_child=reset_student_purge_after_fork)
+
+
+def purge_student_batch():
+    """Purge one batch of soft-deleted students past the grace period; returns how many"""
+    with db_connection() as conn:
+        cur = conn.cursor()
+        try:
+            # Com vários processos (workers WSGI) só um apaga de cada vez
+            cur.execute("SELECT pg_try_advisory_xact_lock(hashtext('student_purge'))")
+            if not cur.fetchone()[0]:
+                conn.rollback()
+                return 0
+
+            # Não esperar por locks de transações da API: o lote é tentado mais tarde
+            cur.execute('SET LOCAL lock_timeout = %s', (app.config['STUDENT_PURGE_LOCK_TIMEOUT'],))
+            cur.execute("""
+                SELECT user_id
+                FROM student
+                WHERE deleted_at IS NOT NULL
+                  AND deleted_at < CURRENT_TIMESTAMP - make_interval(secs => %s)
+                ORDER BY deleted_at, user_id
+                LIMIT %s
+                FOR UPDATE SKIP LOCKED
+            """, (app.config['STUDENT_PURGE_GRACE'], app.config['STUDENT_PURGE_BATCH_SIZE']))
+            targets = [row[0] for row in cur.fetchall()]
+            if targets:
+                purge_students(cur, targets)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+    invalidate_student_caches(targets)
+    with student_purge_lock:
+        student_purge_stats['batches'] += 1
+        student_purge_stats['purged'] += len(targets)
+        student_purge_stats['last_batch_at'] = datetime.now().isoformat(timespec='seconds')
+    return len(targets)
+
+
+def run_student_purge_pass():
+    """Purge batches until no due students are left"""
+    with student_purge_lock:
+        student_purge_stats['running'] = True
+    try:
+        while purge_student_batch() >= app.config['STUDENT_PURGE_BATCH_SIZE']:
+            time.sleep(app.config['STUDENT_PURGE_PAUSE'])
+    finally:
+        with student_purge_lock:
+            student_purge_stats['running'] = False
+            student_purge_stats['passes'] += 1
+
+
+def record_student_purge_error(error):
+    logger.error(f'Student purge error: {error}')
+    with student_purge_lock:
+        student_purge_stats['errors'] += 1
+        student_purge_stats['last_error'] = str(error)
+
+
+def student_purge_worker():
+    # Só um processo (entre todos os workers WSGI) faz o purge: o que tem o
+    # advisory lock de sessão numa conexão própria. Os outros voltam a tentar a
+    # cada STUDENT_PURGE_INTERVAL e um deles assume o purge quando esse processo
+    # termina (o lock cai com a conexão).
+    while True:
+        conn = None
+        try:
+            conn = psycopg2.connect(**DB_PARAMS)
+            conn.autocommit = True
+            cur = conn.cursor()
+            cur.execute("SELECT pg_try_advisory_lock(hashtext('student_purge_worker'))")
+            if cur.fetchone()[0]:
+                student_purge_stats['leader'] = True
+                logger.info('This process runs the student purge')
+                while True:
+                    if in_purge_window():
+                        try:
+                            run_student_purge_pass()
+                        except Exception as error:
+                            record_student_purge_error(error)
+                    time.sleep(app.config['STUDENT_PURGE_INTERVAL'])
+                    cur.execute('SELECT 1')   # a conexão que segura o lock continua viva
+        except Exception as error:
+            record_student_purge_error(error)
+        finally:
+            student_purge_stats['leader'] = False
+            if conn is not None:
+                conn.close()
+        time.sleep(app.config['STUDENT_PURGE_INTERVAL'])
+
+
+@app.route('/dbproj/admin/student_purge', methods=['GET'])
+@token_required
+def student_purge_status():
+    # Progresso do purge de students apagados (apenas admin)
+    if flask.g.role != 'admin':
+        return flask.jsonify({'status': StatusCodes['unauthorized'], 'errors': 'Only admin can access this endpoint', 'results': None})
+
+    with db_connection() as conn:
+        cur = conn.cursor()
+
+        try:
+            cur.execute("""
+                SELECT COUNT(*),
+                       COUNT(*) FILTER (WHERE deleted_at < CURRENT_TIMESTAMP - make_interval(secs => %s)),
+                       MIN(deleted_at)
+                FROM student
+                WHERE deleted_at IS NOT NULL
+            """, (app.config['STUDENT_PURGE_GRACE'],))
+            pending, due, oldest = cur.fetchone()
+            conn.commit()
+
+            with student_purge_lock:
+                stats = dict(student_purge_stats)
+            results = {
+                'soft_delete': app.config['STUDENT_SOFT_DELETE'],
+                'worker': student_purge_worker_thread is not None,
+                'in_window': in_purge_window(),
+                'pending': pending,
+                'due': due,
+                'oldest_deleted_at': oldest.isoformat() if oldest else None,
+                **stats
+            }
+            response = {'status': StatusCodes['success'], 'errors': None, 'results': results}
+
+        except (Exception, psycopg2.DatabaseError) as error:
+            conn.rollback()
+            logger.error(f'Student purge status error: {error}')
+            response = {'status': StatusCodes['internal_error'], 'errors': str(error), 'results': None}
+
+    return flask.jsonify(response)
+
+
+@app.route('/dbproj/admin/student_purge/run', methods=['POST'])
+@token_required
+def run_student_purge():
+    # Apagar já um lote de students, ignorando a janela fora de horas (apenas admin)
+    if flask.g.role != 'admin':
+        return flask.jsonify({'status': StatusCodes['unauthorized'], 'errors': 'Only admin can access this endpoint', 'results': None})
+
+    try:
+        purged = purge_student_batch()
+    except (Exception, psycopg2.DatabaseError) as error:
+        logger.error(f'Student purge error: {error}')
+        return flask.jsonify({'status': StatusCodes['internal_error'], 'errors': str(error), 'results': None})
+
+    return flask.jsonify({'status': StatusCodes['success'], 'errors': None, 'results': {'purged': purged}})
+
+##########################################################
+## FINANCIAL LEDGER
+##########################################################
+
+# As cobranças (propinas, atividades) são inserções em financial_transaction
+# (post_financial_transaction em triggers.sql), sem UPDATE na linha da conta,
+# por isso cobranças concorrentes não esperam pelo lock da mesma linha. O saldo
+# atual é o saldo compactado de financial_account mais as transações recentes
+# (view financial_balance); um worker em background compacta periodicamente as
+# transações já confirmadas. compact_financial_transactions usa um advisory
+# lock: com vários workers do servidor só um compacta de cada vez.
+app.config['FINANCIAL_COMPACT_INTERVAL'] = 60      # segundos entre compactações
+app.config['FINANCIAL_COMPACT_BATCH_SIZE'] = 5000  # transações por transação de compactação
+
+financial_compaction_stats = {
+    'runs': 0,
+    'compacted': 0,
+    'errors': 0,
+    'last_error': None,
+    'last_run_at': None
+}
+financial_compaction_lock = threading.Lock()
+financial_compaction_worker_thread = None
+
+
+def post_financial_transaction(cur, student_id, amount, description, activity_id=None, degree_id=None):
+    """Append a charge to the student's ledger (creating the account if needed); returns its id"""
+    cur.execute("SELECT post_financial_transaction(%s, %s, %s, %s, %s)",
+                (student_id, amount, description, activity_id, degree_id))
+    return cur.fetchone()[0]
+
+
+def compact_financial_transactions():
+    """Fold the committed transactions into the account balances; returns how many were folded"""
+    batch_size = app.config['FINANCIAL_COMPACT_BATCH_SIZE']
+    total = 0
+    while True:
+        with db_connection() as conn:
+            cur = conn.cursor()
+            try:
+                cur.execute("SELECT compact_financial_transactions(%s)", (batch_size,))
+                compacted = cur.fetchone()[0]
+                conn.commit()
+            except psycopg2.DatabaseError:
+                conn.rollback()
+                raise
+        total += compacted
+        # Lote incompleto: não há mais (ou outro processo está a compactar)
+        if compacted < batch_size:
+            break
+
+    with financial_compaction_lock:
+        financial_compaction_stats['runs'] += 1
+        financial_compaction_stats['compacted'] += total
+        financial_compaction_stats['last_run_at'] = datetime.now().isoformat(timespec='seconds')
+    return total
+
+
+def start_financial_compaction_worker():
+    global financial_compaction_worker_thread
+    with financial_compaction_lock:
+        if financial_compaction_worker_thread is not None:
+            return
+        financial_compaction_worker_thread = threading.Thread(target=financial_compaction_worker, name='financial-compaction-worker', daemon=True)
+        financial_compaction_worker_thread.start()
+        logger.info('Started financial compaction worker')
+
+
+def reset_financial_compaction_after_fork():
+    global financial_compaction_lock, financial_compaction_worker_thread
+    financial_compaction_lock = threading.Lock()
+    financial_compaction_worker_thread = None
+    financial_compaction_stats.update(runs=0, compacted=0, errors=0, last_error=None, last_run_at=None)
+
+os.register_at_fork(after_in_child=reset_financial_compaction_after_fork)
+
+
+def financial_compaction_worker():
+    while True:
+        time.sleep(app.config['FINANCIAL_COMPACT_INTERVAL'])
+        try:
+            compact_financial_transactions()
+        except Exception as error:
+            logger.error(f'Financial compaction error: {error}')
+            with financial_compaction_lock:
+                financial_compaction_stats['errors'] += 1
+                financial_compaction_stats['last_error'] = str(error)
+
+
+@app.route('/dbproj/admin/financial/compact', methods=['POST'])
+@token_required
+def run_financial_compaction():
+    # Compactar já as transações financeiras pendentes (apenas admin)
+    if flask.g.role != 'admin':
+        return flask.jsonify({'status': StatusCodes['unauthorized'], 'errors': 'Only admin can access this endpoint', 'results': None})
+
+    try:
+        compacted = compact_financial_transactions()
+    except (Exception, psycopg2.DatabaseError) as error:
+        logger.error(f'Financial compaction error: {error}')
+        return flask.jsonify({'status': StatusCodes['internal_error'], 'errors': str(error), 'results': None})
+
+    with financial_compaction_lock:
+        stats = dict(financial_compaction_stats)
+    return flask.jsonify({'status': StatusCodes['success'], 'errors': None, 'results': {**stats, 'compacted_now': compacted}})
+
+##########################################################
+## PAGINATION
+##########################################################
+
+# Paginação por keyset: cada página devolve next_cursor, um token opaco com a
+# chave de ordenação da última linha; a página seguinte continua a partir dessa
+# chave (WHERE chave > cursor ... LIMIT), sem OFFSET, por isso o custo de cada
+# página não depende de quantas já foram lidas.
+app.config['PAGE_DEFAULT_LIMIT'] = 50
+app.config['PAGE_MAX_LIMIT'] = 500
+
+
+def encode_cursor(key):
+    """Opaque cursor for the sort key of the last row of a page"""
+    return base64.urlsafe_b64encode(json.dumps(list(key), separators=(',', ':')).encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor, types):
+    """Sort key from a cursor made by encode_cursor, checked against types (raises ValueError)"""
+    try:
+        key = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except (ValueError, TypeError):
+        raise ValueError('Invalid cursor')
+    if (not isinstance(key, list) or len(key) != len(types)
+            or not all(isinstance(v, t) and not isinstance(v, bool) for v, t in zip(key, types))):
+        raise ValueError('Invalid cursor')
+    return key
+
+
+def page_args(types, args=None):
+    """limit and decoded cursor (or None) from the query string (raises ValueError)"""
+    if args is None:
+        args = flask.request.args
+    max_limit = app.config['PAGE_MAX_LIMIT']
+    try:
+        limit = int(args.get('limit', app.config['PAGE_DEFAULT_LIMIT']))
+    except ValueError:
+        raise ValueError('limit must be an integer')
+    if limit < 1 or limit > max_limit:
+        raise ValueError(f'limit must be between 1 and {max_limit}')
+
+    cursor = args.get('cursor')
+    return limit, decode_cursor(cursor, types) if cursor else None
+
+##########################################################
+## STREAMING
+##########################################################
+
+# Respostas em streaming (?stream=1): a query corre num cursor do lado do servidor
+# (named cursor) e as linhas são lidas em blocos de STREAM_CHUNK_SIZE e enviadas
+# como fragmentos do array JSON à medida que chegam, por isso a memória usada não
+# depende do tamanho do resultado. status e errors vêm no fim do objeto para que
+# um erro a meio do envio ainda seja reportado.
+app.config['STREAM_CHUNK_SIZE'] = 500
+
+
+def wants_stream():
+    return flask.request.args.get('stream', '').lower() in ('1', 'true', 'yes')
+
+
+def stream_query(query, params, row_to_dict, label):
+    """Stream the rows of query as {"results": [...], "status": ..., "errors": ...}.
+
+    The connection is borrowed here, so pool timeouts and errors in the query
+    itself still get a normal response, and returned when the response closes.
+    """
+    pool = get_db_pool()
+    conn = pool.getconn()
+    state = {'discard': False}
+
+    def release():
+        pool.putconn(conn, discard=state['discard'])
+
+    try:
+        cur = conn.cursor(name=f'stream_{uuid.uuid4().hex}')
+        cur.itersize = app.config['STREAM_CHUNK_SIZE']
+        cur.execute(query, params)
+    except (Exception, psycopg2.DatabaseError) as error:
+        logger.error(f'{label} error: {error}')
+        state['discard'] = isinstance(error, (psycopg2.OperationalError, psycopg2.InterfaceError))
+        if not state['discard']:
+            conn.rollback()
+        release()
+        return flask.jsonify({'status': StatusCodes['internal_error'], 'errors': str(error), 'results': None})
+
+    def generate():
+        status, errors = StatusCodes['success'], None
+        yield '{"results": ['
+        try:
+            separator = ''
+            while True:
+                rows = cur.fetchmany(app.config['STREAM_CHUNK_SIZE'])
+                if not rows:
+                    break
+                yield separator + ','.join(dumps_json(row_to_dict(row)) for row in rows)
+                separator = ','
+            cur.close()
+            conn.commit()
+        except (Exception, psycopg2.DatabaseError) as error:
+            logger.error(f'{label} stream error: {error}')
+            state['discard'] = isinstance(error, (psycopg2.OperationalError, psycopg2.InterfaceError))
+            status, errors = StatusCodes['internal_error'], str(error)
+        yield f'], "status": {status}, "errors": {dumps_json(errors)}}}'
+
+    response = flask.Response(generate(), mimetype='application/json')
+    # Chamado pelo servidor quando a resposta termina (ou o cliente desliga)
+    response.call_on_close(release)
+    return response
+
+##########################################################
+## POSTGRES JSON
+##########################################################
+
+# Com PG_JSON_RESPONSES os endpoints de leitura pedem ao Postgres o documento
+# final ({"status", "errors", "results"[, "next_cursor"]}) já em JSON, via
+# json_agg(json_build_object(...)), e o texto é enviado tal como vem, sem criar
+# dicts nem serializar em Python. O documento é lido como texto (::text) para
+# que o psycopg2 não o descodifique.
+app.config['PG_JSON_RESPONSES'] = False
+
+
+def json_text_response(text):
+    return flask.Response(text, mimetype='application/json')
+
+
+def json_document_query(query, params, row_json, order_by, limit=None, key_json=None):
+    """(sql, params) of the query that returns the JSON text of the response for query.
+
+    row_json, order_by and key_json are SQL expressions over the output columns
+    of query, which must use named parameters. The query returns two columns:
+    the document and, with limit, the JSON text of key_json for the last kept
+    row when there is a next page (query returns up to limit + 1 rows and only
+    limit are kept). json_document turns them into the final response text.
+    """
+    if limit:
+        page_filter = 'FILTER (WHERE page_row <= %(page_size)s)'
+        next_key = f"""CASE WHEN COUNT(*) > %(page_size)s THEN
+                (array_agg({key_json}::text ORDER BY page_row) {page_filter})[%(page_size)s]
+            END"""
+    else:
+        page_filter = ''
+        next_key = 'NULL'
+
+    sql = f"""
+        SELECT json_build_object(
+            'status', %(status)s,
+            'errors', NULL,
+            'results', COALESCE(json_agg({row_json} ORDER BY page_row) {page_filter}, '[]'::json)
+        )::text,
+        {next_key}
+        FROM (
+            SELECT q.*, row_number() OVER (ORDER BY {order_by}) AS page_row
+            FROM ({query}) q
+        ) p
+    """
+    return sql, {**params, 'status': StatusCodes['success'], 'page_size': limit}
+
+
+def json_document(row, limit=None):
+    """Response text from a row of json_document_query, with next_cursor when paginated"""
+    document, next_key = row
+    if not limit:
+        return document
+    # O cursor é feito por encode_cursor, como nas respostas montadas em Python:
+    # o texto de json_build_array não tem o mesmo formato
+    next_cursor = encode_cursor(json.loads(next_key)) if next_key is not None else None
+    return f'{document[:-1]},"next_cursor":{json.dumps(next_cursor)}}}'
+
+
+def fetch_json_document(cur, query, params, row_json, order_by, limit=None, key_json=None):
+    """JSON text of the response for query, assembled by Postgres (see json_document_query)"""
+    cur.execute(*json_document_query(query, params, row_json, order_by, limit, key_json))
+    return json_document(cur.fetchone(), limit)
+
+##########################################################
+## SHARED QUERIES
+##########################################################
+
+# Quando vários dashboards atualizam ao mesmo tempo, top3, top_by_district,
+# report e degree_details correm a mesma query pesada em paralelo. Pedidos
+# concorrentes com os mesmos parâmetros passam a partilhar uma só execução
+# (single flight): o primeiro corre a query e os outros esperam pelo resultado.
+# Por endpoint, (ttl, stale) em segundos: durante ttl o resultado é servido da
+# cache; nos stale segundos seguintes continua a ser servido enquanto uma thread
+# o recalcula (stale-while-revalidate). (0, 0) = só partilha, sem cache.
+# Um pedido espera pela execução partilhada no máximo SHARED_QUERY_WAIT
+# segundos; depois corre a query ele próprio.
+app.config['SHARED_QUERIES'] = True
+app.config['SHARED_QUERY_CACHE'] = {
+    'top3': (5, 60),
+    'top_by_district': (5, 60),
+    'report': (30, 300),
+    'degree_details': (0, 0)   # muda a cada inscrição: só partilha
+}
+app.config['SHARED_QUERY_CACHE_SIZE'] = 1000
+app.config['SHARED_QUERY_WAIT'] = 10   # segundos
+
+
+class SingleFlight:
+    """Runs func once per key among concurrent callers, who all get its result (or exception)"""
+
+    def __init__(self):
+        self._calls = {}   # key -> {'done': Event, 'result': ..., 'error': ...}
+        self._lock = threading.Lock()
+        self.executions = 0
+        self.shared = 0
+        self.timeouts = 0
+
+    def in_flight(self, key):
+        with self._lock:
+            return key in self._calls
+
+    def _new_call(self, key):
+        # Chamada com self._lock
+        call = self._calls[key] = {'done': threading.Event(), 'result': None, 'error': None}
+        self.executions += 1
+        return call
+
+    def _run(self, key, call, func):
+        try:
+            call['result'] = func()
+            return call['result']
+        except BaseException as error:
+            call['error'] = error
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call['done'].set()
+
+    def do(self, key, func, timeout=None):
+        """Result of func, shared with the concurrent calls for key.
+
+        A caller that waits more than timeout seconds for another's execution
+        runs func itself.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._new_call(key)
+            else:
+                self.shared += 1
+
+        if leader:
+            return self._run(key, call, func)
+
+        if not call['done'].wait(timeout):
+            with self._lock:
+                self.timeouts += 1
+            return func()
+        if call['error'] is not None:
+            raise call['error']
+        return call['result']
+
+    def start(self, key, func):
+        """Run func for key in a background thread unless key is in flight; True if started"""
+        with self._lock:
+            if key in self._calls:
+                return False
+            call = self._new_call(key)
+
+        def run():
+            try:
+                self._run(key, call, func)
+            except Exception:
+                pass   # entregue a quem esperava; func trata do registo
+        threading.Thread(target=run, daemon=True).start()
+        return True
+
+    def reset(self):
+        # Depois de um fork as execuções em curso pertencem ao processo pai
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def stats(self):
+        with self._lock:
+            return {'executions': self.executions, 'shared': self.shared, 'timeouts': self.timeouts, 'in_flight': len(self._calls)}
+
+
+shared_query_flight = SingleFlight()
+shared_query_cache = LRUCache(app.config['SHARED_QUERY_CACHE_SIZE'])
+shared_query_stats = {'stale_served': 0, 'revalidations': 0, 'revalidation_errors': 0}
+
+os.register_at_fork(after_in_child=shared_query_flight.reset)
+
+
+def shared_query(name, params, load):
+    """Response of load() for endpoint name and params (hashable), see SHARED_QUERY_CACHE.
+
+    load must not use the request context (it may run in a background thread)
+    and returns the response dict or the JSON text of PG_JSON_RESPONSES; only
+    successful responses are cached.
+    """
+    if not app.config['SHARED_QUERIES']:
+        return load()
+
+    key = (name, app.config['PG_JSON_RESPONSES'], params)
+    wait = app.config['SHARED_QUERY_WAIT']
+    ttl, stale = app.config['SHARED_QUERY_CACHE'].get(name, (0, 0))
+    if not ttl and not stale:
+        return shared_query_flight.do(key, load, wait)
+
+    def load_and_cache():
+        response = load()
+        if isinstance(response, str) or response['status'] == StatusCodes['success']:
+            shared_query_cache.set(key, (response, time.monotonic()), ttl=ttl + stale)
+        return response
+
+    entry = shared_query_cache.get(key)
+    if entry is None:
+        return shared_query_flight.do(key, load_and_cache, wait)
+
+    response, loaded_at = entry
+    if time.monotonic() - loaded_at >= ttl:
+        shared_query_stats['stale_served'] += 1
+        # Só uma thread por chave: start verifica e regista a execução no mesmo lock
+        shared_query_flight.start(key, lambda: revalidate_shared_query(key, load_and_cache))
+    return response
+
+
+def revalidate_shared_query(key, load_and_cache):
+    try:
+        response = load_and_cache()
+    except Exception as error:
+        shared_query_stats['revalidation_errors'] += 1
+        logger.error(f'Revalidate {key[0]} error: {error}')
+        raise
+    shared_query_stats['revalidations'] += 1
+    return response
+
+
+def shared_response(response):
+    """Flask response for the result of shared_query"""
+    if isinstance(response, str):
+        return json_text_response(response)
+    return flask.jsonify(response)
+
+
+def shared_query_summary():
+    return {**shared_query_flight.stats(), **shared_query_stats, 'cache': shared_query_cache.stats()}
+
 ##########################################################
 ## ENDPOINTS
 ##########################################################
@@ -90,35 +1875,50 @@ def login_user():
 
     if not username or not password:
         return flask.jsonify({'status': StatusCodes['api_error'], 'errors': 'Username and password are required', 'results': None})
+    if not isinstance(password, str):
+        return flask.jsonify({'status': StatusCodes['api_error'], 'errors': 'Password must be a string', 'results': None})
 
-    # CONSULTA REAL À BD 
-    conn = db_connection()
-    cur = conn.cursor()
-    
+    # CONSULTA REAL À BD (a conexão é devolvida antes de verificar a password)
     try:
-        cur.execute("SELECT user_id, role FROM users WHERE username = %s AND password = %s", (username, password))
-        user = cur.fetchone()
-        
-        if not user:
-            return flask.jsonify({'status': StatusCodes['unauthorized'], 'errors': 'Invalid credentials', 'results': None})
-        
-        print("DEBUG - User found in login user:")
-        print(f"DEBUG - User ID: {user[0]}, Role: {user[1]}")
+        with db_connection() as conn:
+            cur = conn.cursor()
+            cur.execute("""
+                SELECT u.user_id, u.role, u.password
+                FROM users u
+                LEFT JOIN student s ON s.user_id = u.user_id
+                WHERE u.username = %s AND s.deleted_at IS NULL
+            """, (username,))
+            user = cur.fetchone()
+            conn.commit()
+    except psycopg2.DatabaseError as error:
+        return flask.jsonify({'status': StatusCodes['internal_error'], 'errors': str(error)})
+
+    if not user:
+        return flask.jsonify({'status': StatusCodes['unauthorized'], 'errors': 'Invalid credentials', 'results': None})
+
+    # Verificação no pool de processos (PasswordHashBusy -> 503)
+    matches, needs_rehash = run_password_job(passwords.verify_password, password, user[2], *password_hash_params())
+    if not matches:
+        return flask.jsonify({'status': StatusCodes['unauthorized'], 'errors': 'Invalid credentials', 'results': None})
+
+    try:
+        # Passwords antigas (texto simples ou outros parâmetros) são convertidas no login
+        if needs_rehash:
+            upgrade_password_hash(user[0], user[2], password)
+
         # GERAR JWT TOKEN REAL AQUI
         token = jwt.encode({
             'user_id': user[0],
             'role': user[1],
             'exp': datetime.utcnow() + timedelta(hours=24)
         }, app.config['JWT_SECRET_KEY'], algorithm='HS256')
-        
+
         response = {'status': StatusCodes['success'], 'errors': None, 'results': token}
         logger.info(f'User {username} logged in successfully')
         #print(f"Generated token: {token}")
-        
+
     except Exception as error:
         response = {'status': StatusCodes['internal_error'], 'errors': str(error)}
-    finally:
-        conn.close()
 
     return flask.jsonify(response)
 
@@ -139,44 +1939,46 @@ def register_student():
     # Apenas os campos MENCIONADOS NO ENUNCIADO
     if not username or not email or not password:
         return flask.jsonify({'status': StatusCodes['api_error'], 'errors': 'Username, email, and password are required', 'results': None})
+    if not isinstance(password, str):
+        return flask.jsonify({'status': StatusCodes['api_error'], 'errors': 'Password must be a string', 'results': None})
 
-    conn = db_connection()
-    cur = conn.cursor()
+    # Hash no pool de processos, antes de pedir uma conexão
+    password = hash_new_password(password)
 
-    try:
-        # 1. Inserir na tabela users com role 'student'
-        cur.execute("""
-            INSERT INTO users (username, password, email, role)
-            VALUES (%s, %s, %s, 'student')
-            RETURNING user_id
-        """, (username, password, email))
+    with db_connection() as conn:
+        cur = conn.cursor()
+
+        try:
+            # 1. Inserir na tabela users com role 'student'
+            cur.execute("""
+                INSERT INTO users (username, password, email, role)
+                VALUES (%s, %s, %s, 'student')
+                RETURNING user_id
+            """, (username, password, email))
         
-        user_id = cur.fetchone()[0]
+            user_id = cur.fetchone()[0]
 
-         # 2. Inserir na tabela student
-        cur.execute("""
-            INSERT INTO student (user_id)
-            VALUES (%s)
-        """, (user_id,))
+             # 2. Inserir na tabela student
+            cur.execute("""
+                INSERT INTO student (user_id)
+                VALUES (%s)
+            """, (user_id,))
         
-        # NOTA: O enunciado não pede para preencher outros campos automaticamente
-        # Campos como name, birth_date, etc. podem ser atualizados posteriormente
-        # ou através de endpoints específicos se necessário
+            # NOTA: O enunciado não pede para preencher outros campos automaticamente
+            # Campos como name, birth_date, etc. podem ser atualizados posteriormente
+            # ou através de endpoints específicos se necessário
         
-        conn.commit()
+            conn.commit()
 
-        response = {'status': StatusCodes['success'], 'errors': None, 'results': user_id}
+            response = {'status': StatusCodes['success'], 'errors': None, 'results': user_id}
 
-    except psycopg2.IntegrityError:
-        conn.rollback()
-        response = {'status': StatusCodes['api_error'], 'errors': 'Username already exists', 'results': None}
-    except (Exception, psycopg2.DatabaseError) as error:
-        conn.rollback()
-        logger.error(f'Register student error: {error}')
-        response = {'status': StatusCodes['internal_error'], 'errors': str(error), 'results': None}
-    finally:
-        if conn is not None:
-            conn.close()
+        except psycopg2.IntegrityError:
+            conn.rollback()
+            response = {'status': StatusCodes['api_error'], 'errors': 'Username already exists', 'results': None}
+        except (Exception, psycopg2.DatabaseError) as error:
+            conn.rollback()
+            logger.error(f'Register student error: {error}')
+            response = {'status': StatusCodes['internal_error'], 'errors': str(error), 'results': None}
 
     return flask.jsonify(response)
 
@@ -196,34 +1998,36 @@ def register_admin():
 
     if not username or not email or not password:
         return flask.jsonify({'status': StatusCodes['api_error'], 'errors': 'Username, email, and password are required', 'results': None})
+    if not isinstance(password, str):
+        return flask.jsonify({'status': StatusCodes['api_error'], 'errors': 'Password must be a string', 'results': None})
 
-    conn = db_connection()
-    cur = conn.cursor()
+    # Hash no pool de processos, antes de pedir uma conexão
+    password = hash_new_password(password)
 
-    try:
-        # 1. Inserir na tabela users
-        cur.execute("""
-            INSERT INTO users (username, password, email, role)
-            VALUES (%s, %s, %s, 'admin')
-            RETURNING user_id
-        """, (username, password, email))
-        user_id = cur.fetchone()[0]
-        # 2. Inserir na tabela admin
-        cur.execute("""
-            INSERT INTO admin (user_id)
-            VALUES (%s)
-        """, (user_id,))
-        conn.commit()
-        response = {'status': StatusCodes['success'], 'errors': None, 'results': user_id}
-    except psycopg2.IntegrityError:
-        conn.rollback()
-        response = {'status': StatusCodes['api_error'], 'errors': 'Username already exists', 'results': None}
-    except (Exception, psycopg2.DatabaseError) as error:
-        conn.rollback()
-        response = {'status': StatusCodes['internal_error'], 'errors': str(error), 'results': None}
-    finally:
-        if conn is not None:
-            conn.close()
+    with db_connection() as conn:
+        cur = conn.cursor()
+
+        try:
+            # 1. Inserir na tabela users
+            cur.execute("""
+                INSERT INTO users (username, password, email, role)
+                VALUES (%s, %s, %s, 'admin')
+                RETURNING user_id
+            """, (username, password, email))
+            user_id = cur.fetchone()[0]
+            # 2. Inserir na tabela admin
+            cur.execute("""
+                INSERT INTO admin (user_id)
+                VALUES (%s)
+            """, (user_id,))
+            conn.commit()
+            response = {'status': StatusCodes['success'], 'errors': None, 'results': user_id}
+        except psycopg2.IntegrityError:
+            conn.rollback()
+            response = {'status': StatusCodes['api_error'], 'errors': 'Username already exists', 'results': None}
+        except (Exception, psycopg2.DatabaseError) as error:
+            conn.rollback()
+            response = {'status': StatusCodes['internal_error'], 'errors': str(error), 'results': None}
 
     return flask.jsonify(response)
 
@@ -243,34 +2047,36 @@ def register_instructor():
 
     if not username or not email or not password:
         return flask.jsonify({'status': StatusCodes['api_error'], 'errors': 'Username, email, and password are required', 'results': None})
+    if not isinstance(password, str):
+        return flask.jsonify({'status': StatusCodes['api_error'], 'errors': 'Password must be a string', 'results': None})
 
-    conn = db_connection()
-    cur = conn.cursor()
+    # Hash no pool de processos, antes de pedir uma conexão
+    password = hash_new_password(password)
 
-    try:
-        # 1. Inserir na tabela users
-        cur.execute("""
-            INSERT INTO users (username, password, email, role)
-            VALUES (%s, %s, %s, 'instructor')
-            RETURNING user_id
-        """, (username, password, email))
-        user_id = cur.fetchone()[0]
-        # 2. Inserir na tabela instructor (com campo específico)
-        cur.execute("""
-            INSERT INTO instructor (user_id, is_coordinator)
-            VALUES (%s, %s)
-        """, (user_id, is_coordinator))
-        conn.commit()
-        response = {'status': StatusCodes['success'], 'errors': None, 'results': user_id}
-    except psycopg2.IntegrityError:
-        conn.rollback()
-        response = {'status': StatusCodes['api_error'], 'errors': 'Username already exists', 'results': None}
-    except (Exception, psycopg2.DatabaseError) as error:
-        conn.rollback()
-        response = {'status': StatusCodes['internal_error'], 'errors': str(error), 'results': None}
-    finally:
-        if conn is not None:
-            conn.close()
+    with db_connection() as conn:
+        cur = conn.cursor()
+
+        try:
+            # 1. Inserir na tabela users
+            cur.execute("""
+                INSERT INTO users (username, password, email, role)
+                VALUES (%s, %s, %s, 'instructor')
+                RETURNING user_id
+            """, (username, password, email))
+            user_id = cur.fetchone()[0]
+            # 2. Inserir na tabela instructor (com campo específico)
+            cur.execute("""
+                INSERT INTO instructor (user_id, is_coordinator)
+                VALUES (%s, %s)
+            """, (user_id, is_coordinator))
+            conn.commit()
+            response = {'status': StatusCodes['success'], 'errors': None, 'results': user_id}
+        except psycopg2.IntegrityError:
+            conn.rollback()
+            response = {'status': StatusCodes['api_error'], 'errors': 'Username already exists', 'results': None}
+        except (Exception, psycopg2.DatabaseError) as error:
+            conn.rollback()
+            response = {'status': StatusCodes['internal_error'], 'errors': str(error), 'results': None}
 
     return flask.jsonify(response)
 
@@ -289,47 +2095,43 @@ def enroll_degree(degree_id):
     if not student_id or not date:
         return flask.jsonify({'status': StatusCodes['api_error'], 'errors': 'Student ID and date are required', 'results': None})
 
-    conn = db_connection()
-    cur = conn.cursor()
+    with db_connection() as conn:
+        cur = conn.cursor()
 
-    try:
-        # 1. Verificar se o student existe
-        cur.execute("SELECT 1 FROM student WHERE user_id = %s", (student_id,))
-        if not cur.fetchone():
-            return flask.jsonify({'status': StatusCodes['api_error'], 'errors': 'Student does not exist', 'results': None})
+        try:
+            # 1. Verificar se o student existe
+            cur.execute("SELECT 1 FROM student WHERE user_id = %s AND deleted_at IS NULL", (student_id,))
+            if not cur.fetchone():
+                return flask.jsonify({'status': StatusCodes['api_error'], 'errors': 'Student does not exist', 'results': None})
 
-        # 2. Verificar se o degree existe
-        cur.execute("SELECT 1 FROM degree_program WHERE degree_id = %s", (degree_id,))
-        if not cur.fetchone():
-            return flask.jsonify({'status': StatusCodes['api_error'], 'errors': 'Degree program does not exist', 'results': None})
+            # 2. Verificar se o degree existe (dados de referência em memória)
+            if not reference_row(cur, 'degrees', degree_id):
+                return flask.jsonify({'status': StatusCodes['api_error'], 'errors': 'Degree program does not exist', 'results': None})
 
-        # 3. Verificar se já está matriculado
-        cur.execute("SELECT 1 FROM degree_enrollment WHERE student_id = %s AND degree_id = %s", (student_id, degree_id))
-        if cur.fetchone():
-            return flask.jsonify({'status': StatusCodes['api_error'], 'errors': 'Student is already enrolled in this degree', 'results': None})
+            # 3. Verificar se já está matriculado
+            cur.execute("SELECT 1 FROM degree_enrollment WHERE student_id = %s AND degree_id = %s", (student_id, degree_id))
+            if cur.fetchone():
+                return flask.jsonify({'status': StatusCodes['api_error'], 'errors': 'Student is already enrolled in this degree', 'results': None})
 
-        # 4. Inserir na tabela degree_enrollment
-        cur.execute("""
-            INSERT INTO degree_enrollment (student_id, degree_id, enrollment_date)
-            VALUES (%s, %s, %s)
-        """, (student_id, degree_id, date))
+            # 4. Inserir na tabela degree_enrollment
+            cur.execute("""
+                INSERT INTO degree_enrollment (student_id, degree_id, enrollment_date)
+                VALUES (%s, %s, %s)
+            """, (student_id, degree_id, date))
 
-        # 5. O TRIGGER deve criar automaticamente a financial_account
-        # Conforme exigido pelo enunciado: "generates a debt entry in the student's financial account"
+            # 5. O TRIGGER deve criar automaticamente a financial_account
+            # Conforme exigido pelo enunciado: "generates a debt entry in the student's financial account"
         
-        conn.commit()
-        response = {'status': StatusCodes['success'], 'errors': None}
+            conn.commit()
+            response = {'status': StatusCodes['success'], 'errors': None}
 
-    except psycopg2.IntegrityError as e:
-        conn.rollback()
-        response = {'status': StatusCodes['api_error'], 'errors': 'Integrity error: ' + str(e), 'results': None}
-    except (Exception, psycopg2.DatabaseError) as error:
-        conn.rollback()
-        logger.error(f'Enroll degree error: {error}')
-        response = {'status': StatusCodes['internal_error'], 'errors': str(error), 'results': None}
-    finally:
-        if conn is not None:
-            conn.close()
+        except psycopg2.IntegrityError as e:
+            conn.rollback()
+            response = {'status': StatusCodes['api_error'], 'errors': 'Integrity error: ' + str(e), 'results': None}
+        except (Exception, psycopg2.DatabaseError) as error:
+            conn.rollback()
+            logger.error(f'Enroll degree error: {error}')
+            response = {'status': StatusCodes['internal_error'], 'errors': str(error), 'results': None}
 
     return flask.jsonify(response)
 
@@ -342,52 +2144,123 @@ def enroll_activity(activity_id):
         return flask.jsonify({'status': StatusCodes['unauthorized'], 'errors': 'Only students can enroll in activities', 'results': None})
     current_user_id = flask.g.user_id
 
-    conn = db_connection()
-    cur = conn.cursor()
+    with db_connection() as conn:
+        cur = conn.cursor()
 
-    try:
-        # 1. Verificar se a activity existe
-        cur.execute("SELECT name, fee FROM activity WHERE activity_id = %s", (activity_id,))
-        activity = cur.fetchone()
-        if not activity:
-            return flask.jsonify({'status': StatusCodes['api_error'], 'errors': 'Activity does not exist', 'results': None})
+        try:
+            # 1. Verificar se a activity existe (dados de referência em memória)
+            activity = reference_row(cur, 'activities', activity_id)
+            if not activity:
+                return flask.jsonify({'status': StatusCodes['api_error'], 'errors': 'Activity does not exist', 'results': None})
         
-        activity_name = activity[0]
-        activity_fee = activity[1]
+            activity_name = activity[0]
+            activity_fee = activity[1]
 
-        # 2. Verificar se student já está inscrito
-        cur.execute("SELECT 1 FROM activity_participation WHERE student_id = %s AND activity_id = %s", (current_user_id, activity_id))
-        if cur.fetchone():
-            return flask.jsonify({'status': StatusCodes['api_error'], 'errors': 'Student is already enrolled in this activity', 'results': None})
+            # 2. Verificar se student já está inscrito
+            cur.execute("SELECT 1 FROM activity_participation WHERE student_id = %s AND activity_id = %s", (current_user_id, activity_id))
+            if cur.fetchone():
+                return flask.jsonify({'status': StatusCodes['api_error'], 'errors': 'Student is already enrolled in this activity', 'results': None})
 
-        # 3. Inserir na tabela activity_participation
-        cur.execute("""
-            INSERT INTO activity_participation (student_id, activity_id, registration_date)
-            VALUES (%s, %s, CURRENT_DATE)
-        """, (current_user_id, activity_id))
+            # 3. Inserir na tabela activity_participation
+            cur.execute("""
+                INSERT INTO activity_participation (student_id, activity_id, registration_date)
+                VALUES (%s, %s, CURRENT_DATE)
+            """, (current_user_id, activity_id))
 
-        # 4. Atualizar financial_account com a fee (conforme enunciado)
+            # 4. Lançar a fee na conta do student (conforme enunciado): uma nova
+            # transação no ledger, sem lock na linha de financial_account
+            post_financial_transaction(cur, current_user_id, activity_fee, f'Activity fee: {activity_name}', activity_id=activity_id)
+
+            conn.commit()
+            response = {'status': StatusCodes['success'], 'errors': None}
+
+        except psycopg2.IntegrityError:
+            conn.rollback()
+            response = {'status': StatusCodes['api_error'], 'errors': 'Database integrity error', 'results': None}
+        except (Exception, psycopg2.DatabaseError) as error:
+            conn.rollback()
+            logger.error(f'Enroll activity error: {error}')
+            response = {'status': StatusCodes['internal_error'], 'errors': str(error), 'results': None}
+
+    return flask.jsonify(response)
+
+def enroll_in_course_edition(cur, student_id, course_edition_id, classes):
+    """Run the enrollment checks and inserts on cur; returns an error message or None.
+
+    Does not commit nor roll back, the caller owns the transaction.
+    """
+    # 1. Verificar se course_edition existe e obter detalhes (dados de referência em memória)
+    edition = reference_row(cur, 'editions', course_edition_id)
+    if not edition:
+        return 'Course edition does not exist'
+
+    course_code, year, capacity, coordinator_id = edition
+
+    # 2. e 3. Numa só ida à base de dados: o contador de inscritos (muda a cada
+    # inscrição, não está na cache), se o student existe (e não foi apagado) e
+    # se já está inscrito
+    cur.execute("""
+        SELECT ce.enrolled_count,
+               s.user_id IS NULL OR s.deleted_at IS NOT NULL,
+               EXISTS (SELECT 1 FROM course_enrollment WHERE student_id = s.user_id AND edition_id = ce.edition_id),
+               (SELECT version FROM cache_version WHERE name = 'course_prerequisites') AS prerequisites_version
+        FROM course_edition ce
+        LEFT JOIN student s ON s.user_id = %(student_id)s
+        WHERE ce.edition_id = %(edition_id)s
+    """, {'student_id': student_id, 'edition_id': reference_key('editions', course_edition_id)})
+
+    edition_info = cur.fetchone()
+    if not edition_info:
+        return 'Course edition does not exist'
+
+    enrolled_count, student_missing, already_enrolled, prerequisites_version = edition_info
+
+    # Capacidade: leitura rápida do contador, sem lock; a verificação definitiva
+    # é feita no passo 6
+    if enrolled_count >= capacity:
+        return 'Course edition is full'
+    if student_missing:
+        return 'Student does not exist'
+    if already_enrolled:
+        return 'Student is already enrolled in this course edition'
+
+    # 4. Verificar pré-requisitos (conforme enunciado): o fecho transitivo e o
+    # conjunto de cursos aprovados estão em memória, basta uma inclusão de conjuntos
+    required = get_prerequisite_closure(cur, prerequisites_version or 0).get(course_code)
+    if not meets_prerequisites(cur, student_id, required):
+        return 'Student does not meet course prerequisites'
+
+    # 5. Inscrever student nas classes selecionadas
+    for class_id in classes:
+        # Verificar se a class pertence à course_edition
         cur.execute("""
-            UPDATE financial_account 
-            SET balance = balance + %s
-            WHERE student_id = %s
-        """, (activity_fee, current_user_id))
+            SELECT 1 FROM class 
+            WHERE class_id = %s AND edition_id = %s
+        """, (class_id, course_edition_id))
 
-        conn.commit()
-        response = {'status': StatusCodes['success'], 'errors': None}
+        if not cur.fetchone():
+            return f'Class {class_id} does not belong to course edition {course_edition_id}'
 
-    except psycopg2.IntegrityError:
-        conn.rollback()
-        response = {'status': StatusCodes['api_error'], 'errors': 'Database integrity error', 'results': None}
-    except (Exception, psycopg2.DatabaseError) as error:
-        conn.rollback()
-        logger.error(f'Enroll activity error: {error}')
-        response = {'status': StatusCodes['internal_error'], 'errors': str(error), 'results': None}
-    finally:
-        if conn is not None:
-            conn.close()
+        # Inserir na nova tabela student_class
+        cur.execute("""
+            INSERT INTO student_class (student_id, class_id)
+            VALUES (%s, %s)
+        """, (student_id, class_id))
+
+    # 6. Inserir enrollment: o trigger trigger_claim_course_seats reserva o lugar
+    # (incremento de enrolled_count) e falha se a edition ficar acima da
+    # capacidade. O lock da linha de course_edition só é tomado aqui, no fim,
+    # e dura até ao commit, por isso dois pedidos concorrentes nunca ocupam o
+    # último lugar
+    try:
+        cur.execute("""
+            INSERT INTO course_enrollment (student_id, edition_id)
+            VALUES (%s, %s)
+        """, (student_id, course_edition_id))
+    except psycopg2.errors.CheckViolation:
+        return 'Course edition is full'
 
-    return flask.jsonify(response)
+    return None
 
 @app.route('/dbproj/enroll_course_edition/<course_edition_id>', methods=['POST'])
 @token_required
@@ -398,109 +2271,64 @@ def enroll_course_edition(course_edition_id):
         return flask.jsonify({'status': StatusCodes['unauthorized'], 'errors': 'Only students can enroll in courses', 'results': None})
     current_user_id = flask.g.user_id
 
-    data = flask.request.get_json()
+    try:
+        course_edition_id = int(course_edition_id)
+    except ValueError:
+        return flask.jsonify({'status': StatusCodes['api_error'], 'errors': 'Invalid course edition ID', 'results': None})
+
+    data = flask.request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return flask.jsonify({'status': StatusCodes['api_error'], 'errors': 'Request body must be a JSON object', 'results': None})
     classes = data.get('classes', [])  # Lista de class_ids
 
     if not classes:
         return flask.jsonify({'status': StatusCodes['api_error'], 'errors': 'At least one class ID is required', 'results': None})
+    if not isinstance(classes, list) or not all(isinstance(i, int) and not isinstance(i, bool) for i in classes):
+        return flask.jsonify({'status': StatusCodes['api_error'], 'errors': 'classes must be a list of integers', 'results': None})
 
-    conn = db_connection()
-    cur = conn.cursor()
-
-    try:
-        # 1. Verificar se course_edition existe e obter detalhes
-        cur.execute("""
-            SELECT ce.course_code, ce.capacity, ce.year, c.name
-            FROM course_edition ce
-            JOIN course c ON ce.course_code = c.code
-            WHERE ce.edition_id = %s
-        """, (course_edition_id,))
-        
-        edition_info = cur.fetchone()
-        if not edition_info:
-            return flask.jsonify({'status': StatusCodes['api_error'], 'errors': 'Course edition does not exist', 'results': None})
-        
-        course_code, capacity, year, course_name = edition_info
+    # Modo em fila: o pedido é aceite de imediato e processado pelos workers
+    if app.config['ENROLL_QUEUE_MODE']:
+        try:
+            ticket = enqueue_enrollment(current_user_id, course_edition_id, classes)
+        except queue.Full:
+            return flask.jsonify({'status': StatusCodes['service_unavailable'], 'errors': 'Enrollment queue is full, try again later', 'results': None}), 503
+        return flask.jsonify({'status': StatusCodes['success'], 'errors': None, 'results': ticket})
 
-        # 2. Verificar capacidade da edition
-        cur.execute("""
-            SELECT COUNT(*) 
-            FROM course_enrollment 
-            WHERE edition_id = %s
-        """, (course_edition_id,))
-        
-        current_enrollments = cur.fetchone()[0]
-        if current_enrollments >= capacity:
-            return flask.jsonify({'status': StatusCodes['api_error'], 'errors': 'Course edition is full', 'results': None})
+    with db_connection() as conn:
+        cur = conn.cursor()
 
-        # 3. Verificar se student já está inscrito
-        cur.execute("""
-            SELECT 1 FROM course_enrollment 
-            WHERE student_id = %s AND edition_id = %s
-        """, (current_user_id, course_edition_id))
-        
-        if cur.fetchone():
-            return flask.jsonify({'status': StatusCodes['api_error'], 'errors': 'Student is already enrolled in this course edition', 'results': None})
+        try:
+            error = enroll_in_course_edition(cur, current_user_id, course_edition_id, classes)
+            if error:
+                conn.rollback()
+                return flask.jsonify({'status': StatusCodes['api_error'], 'errors': error, 'results': None})
 
-        # 4. Verificar pré-requisitos (conforme enunciado)
-        cur.execute("""
-            SELECT COUNT(*) FROM course_prerequisites cp
-            WHERE cp.course_code = %s
-            AND cp.prerequisite_code NOT IN (
-                SELECT c.code 
-                FROM course_enrollment ce
-                JOIN course_edition ced ON ce.edition_id = ced.edition_id
-                JOIN course c ON ced.course_code = c.code
-                WHERE ce.student_id = %s AND ce.grade >= 9.5
-            )
-        """, (course_code, current_user_id))
-        
-        missing_prerequisites = cur.fetchone()[0]
-        if missing_prerequisites > 0:
-            return flask.jsonify({'status': StatusCodes['api_error'], 'errors': 'Student does not meet course prerequisites', 'results': None})
+            conn.commit()
+            invalidate_student_caches([current_user_id])
+            response = {'status': StatusCodes['success'], 'errors': None}
 
-        # 5. Inserir enrollment
-        cur.execute("""
-            INSERT INTO course_enrollment (student_id, edition_id)
-            VALUES (%s, %s)
-        """, (current_user_id, course_edition_id))
+        except psycopg2.IntegrityError as e:
+            conn.rollback()
+            response = {'status': StatusCodes['api_error'], 'errors': 'Integrity error: ' + str(e), 'results': None}
+        except (Exception, psycopg2.DatabaseError) as error:
+            conn.rollback()
+            logger.error(f'Enroll course edition error: {error}')
+            response = {'status': StatusCodes['internal_error'], 'errors': str(error), 'results': None}
 
-        # 6. Inscrever student nas classes selecionadas
-        for class_id in classes:
-            # Verificar se a class pertence à course_edition
-            cur.execute("""
-                SELECT 1 FROM class 
-                WHERE class_id = %s AND edition_id = %s
-            """, (class_id, course_edition_id))
-            
-            if not cur.fetchone():
-                return flask.jsonify({
-                    'status': StatusCodes['api_error'], 
-                    'errors': f'Class {class_id} does not belong to course edition {course_edition_id}',
-                    'results': None
-                })
-            
-            # Inserir na nova tabela student_class
-            cur.execute("""
-                INSERT INTO student_class (student_id, class_id)
-                VALUES (%s, %s)
-            """, (current_user_id, class_id))
+    return flask.jsonify(response)
 
-        conn.commit()
-        response = {'status': StatusCodes['success'], 'errors': None}
+@app.route('/dbproj/enroll_course_edition/ticket/<ticket_id>', methods=['GET'])
+@token_required
+def enrollment_ticket_status(ticket_id):
+    # Consultar o estado de um pedido de inscrição em fila (o próprio student ou admin)
+    ticket = get_enrollment_ticket(ticket_id)
+    if ticket is None:
+        return flask.jsonify({'status': StatusCodes['api_error'], 'errors': 'Ticket does not exist or has expired', 'results': None})
 
-    except psycopg2.IntegrityError as e:
-        conn.rollback()
-        response = {'status': StatusCodes['api_error'], 'errors': 'Integrity error: ' + str(e), 'results': None}
-    except (Exception, psycopg2.DatabaseError) as error:
-        conn.rollback()
-        logger.error(f'Enroll course edition error: {error}')
-        response = {'status': StatusCodes['internal_error'], 'errors': str(error), 'results': None}
-    finally:
-        if conn is not None:
-            conn.close()
+    if flask.g.role != 'admin' and flask.g.user_id != ticket['student_id']:
+        return flask.jsonify({'status': StatusCodes['unauthorized'], 'errors': 'Permission denied', 'results': None})
 
-    return flask.jsonify(response)
+    return flask.jsonify({'status': StatusCodes['success'], 'errors': None, 'results': ticket})
 
 @app.route('/dbproj/submit_grades/<course_edition_id>', methods=['POST'])
 @token_required
@@ -519,68 +2347,150 @@ def submit_grades(course_edition_id):
     if not period or not grades:
         return flask.jsonify({'status': StatusCodes['api_error'], 'errors': 'Evaluation period and grades are required', 'results': None})
 
-    conn = db_connection()
-    cur = conn.cursor()
-
-    try:
-        # 1. Verificar se user é coordinator desta course_edition
-        cur.execute("""
-            SELECT coordinator_id FROM course_edition 
-            WHERE edition_id = %s
-        """, (course_edition_id,))
-        
-        result = cur.fetchone()
-        if not result:
-            return flask.jsonify({'status': StatusCodes['api_error'], 'errors': 'Course edition does not exist', 'results': None})
-            
-        coordinator_id = result[0]
-        if coordinator_id != current_user_id:
-            return flask.jsonify({'status': StatusCodes['unauthorized'], 'errors': 'Only the course coordinator can submit grades', 'results': None})
-
-        # 2. Processar cada grade
-        for grade_data in grades:
-            if len(grade_data) != 2:
-                continue  # Saltar entradas inválidas
-                
-            student_id, grade_value = grade_data
-            
-            # Validar grade
-            if not isinstance(grade_value, (int, float)) or grade_value < 0 or grade_value > 20:
-                return flask.jsonify({'status': StatusCodes['api_error'], 'errors': f'Invalid grade for student {student_id}', 'results': None})
-            
-            # 3. Verificar se student está inscrito na course_edition
-            cur.execute("""
-                SELECT 1 FROM course_enrollment 
-                WHERE student_id = %s AND edition_id = %s
-            """, (student_id, course_edition_id))
-            
-            if not cur.fetchone():
-                return flask.jsonify({'status': StatusCodes['api_error'], 'errors': f'Student {student_id} is not enrolled in this course edition', 'results': None})
-            
-            # 4. Atualizar ou inserir a grade
-            cur.execute("""
-                UPDATE course_enrollment 
-                SET grade = %s, evaluation_period = %s
-                WHERE student_id = %s AND edition_id = %s
-            """, (grade_value, period, student_id, course_edition_id))
-
-        # 5. Atualizar academic records (conforme enunciado)
-        # O enunciado diz: "updates the approved students' academic averages"
-        # Isso pode ser feito via trigger ou procedure adicional
-        
-        conn.commit()
-        response = {'status': StatusCodes['success'], 'errors': None}
+    with db_connection() as conn:
+        cur = conn.cursor()
 
-    except (Exception, psycopg2.DatabaseError) as error:
-        conn.rollback()
-        logger.error(f'Submit grades error: {error}')
-        response = {'status': StatusCodes['internal_error'], 'errors': str(error), 'results': None}
-    finally:
-        if conn is not None:
-            conn.close()
+        try:
+            # 1. Verificar se user é coordinator desta course_edition (dados de referência em memória)
+            edition = reference_row(cur, 'editions', course_edition_id)
+            if not edition:
+                return flask.jsonify({'status': StatusCodes['api_error'], 'errors': 'Course edition does not exist', 'results': None})
+
+            coordinator_id = edition[3]
+            if coordinator_id != current_user_id:
+                return flask.jsonify({'status': StatusCodes['unauthorized'], 'errors': 'Only the course coordinator can submit grades', 'results': None})
+
+            # 2. Validar as entradas do lado da aplicação (formato e intervalo da nota)
+            rejected = []
+            valid_grades = {}  # student_id -> grade (a última entrada repetida prevalece)
+            for grade_data in grades:
+                if not isinstance(grade_data, (list, tuple)) or len(grade_data) != 2:
+                    rejected.append({'student_id': None, 'errors': f'Invalid grade entry {grade_data}'})
+                    continue
+
+                student_id, grade_value = grade_data
+                try:
+                    student_id = int(student_id)
+                except (TypeError, ValueError):
+                    rejected.append({'student_id': student_id, 'errors': 'Invalid student ID'})
+                    continue
+
+                if isinstance(grade_value, bool) or not isinstance(grade_value, (int, float)) or grade_value < 0 or grade_value > 20:
+                    rejected.append({'student_id': student_id, 'errors': f'Invalid grade for student {student_id}'})
+                    continue
+
+                valid_grades[student_id] = grade_value
+
+            # 3. Aplicar toda a pauta numa única instrução: o UPDATE junta as notas com
+            # course_enrollment e as linhas que não foram atualizadas correspondem
+            # a students que não estão inscritos nesta course_edition
+            updated_count = 0
+            if valid_grades:
+                cur.execute("""
+                    WITH submitted AS (
+                        SELECT *
+                        FROM unnest(%s::int[], %s::numeric[]) AS g(student_id, grade)
+                    ),
+                    updated AS (
+                        UPDATE course_enrollment ce
+                        SET grade = s.grade, evaluation_period = %s, evaluated_at = CURRENT_TIMESTAMP
+                        FROM submitted s
+                        WHERE ce.student_id = s.student_id AND ce.edition_id = %s
+                          AND NOT is_soft_deleted(ce.student_id)
+                        RETURNING ce.student_id
+                    )
+                    SELECT s.student_id, (u.student_id IS NOT NULL) AS applied
+                    FROM submitted s
+                    LEFT JOIN updated u ON u.student_id = s.student_id
+                """, (list(valid_grades.keys()), list(valid_grades.values()), period, course_edition_id))
+
+                for student_id, applied in cur.fetchall():
+                    if applied:
+                        updated_count += 1
+                    else:
+                        rejected.append({'student_id': student_id, 'errors': f'Student {student_id} is not enrolled in this course edition'})
+
+            # Pauta tudo-ou-nada: qualquer entrada rejeitada desfaz as restantes
+            if rejected or updated_count == 0:
+                conn.rollback()
+                errors = rejected[0]['errors'] if rejected else 'No grades were submitted'
+                return flask.jsonify({'status': StatusCodes['api_error'], 'errors': errors, 'results': {'updated': 0, 'rejected': rejected}})
+
+            # 4. Atualizar academic records (conforme enunciado)
+            # O enunciado diz: "updates the approved students' academic averages"
+            # Feito pelo trigger trigger_after_grade_update
+
+            conn.commit()
+
+            # As notas mudaram: os cursos aprovados destes students têm de ser
+            # relidos (os outros processos são avisados pelos triggers)
+            invalidate_student_caches(valid_grades)
+
+            response = {'status': StatusCodes['success'], 'errors': None, 'results': {'updated': updated_count, 'rejected': rejected}}
+
+        except (Exception, psycopg2.DatabaseError) as error:
+            conn.rollback()
+            logger.error(f'Submit grades error: {error}')
+            response = {'status': StatusCodes['internal_error'], 'errors': str(error), 'results': None}
 
     return flask.jsonify(response)
 
+def student_details_row(course):
+    return {
+        'course_edition_id': course[0],
+        'course_name': course[1],
+        'course_edition_year': course[2],
+        'grade': course[3],
+        'evaluation_period': course[4],
+        'attendance': course[5],
+        'course_code': course[6],
+        'coordinator_id': course[7],
+        'coordinator_name': course[8]
+    }
+
+def student_details_query(student_id, limit, after=None):
+    """(query, params) for a page of student_details, limit + 1 rows after the cursor key"""
+    # Query para obter os cursos do student com detalhes, uma página de cada vez.
+    # As linhas do student vêm da chave primária (student_id, edition_id) de
+    # course_enrollment; lê-se mais uma linha para saber se há página seguinte
+    keyset = 'AND (ced.year, ce.edition_id) < (%(after_year)s, %(after_edition)s)' if after else ''
+    query = f"""
+        SELECT 
+            ce.edition_id,
+            c.name as course_name,
+            ced.year as course_year,
+            ce.grade,
+            ce.evaluation_period,
+            ce.attendance,
+            c.code as course_code,
+            ced.coordinator_id,
+            u.username as coordinator_name
+        FROM course_enrollment ce
+        JOIN course_edition ced ON ce.edition_id = ced.edition_id
+        JOIN course c ON ced.course_code = c.code
+        JOIN student s ON s.user_id = ce.student_id AND s.deleted_at IS NULL
+        LEFT JOIN users u ON ced.coordinator_id = u.user_id
+        WHERE ce.student_id = %(student_id)s
+            {keyset}
+        ORDER BY ced.year DESC, ce.edition_id DESC
+        LIMIT %(limit)s
+    """
+    params = {'student_id': student_id, 'after_year': after and after[0], 'after_edition': after and after[1], 'limit': limit + 1}
+    return query, params
+
+# O mesmo objeto que student_details_row, construído pelo Postgres
+STUDENT_DETAILS_ROW_JSON = """json_build_object(
+    'course_edition_id', edition_id,
+    'course_name', course_name,
+    'course_edition_year', course_year,
+    'grade', grade::float8,
+    'evaluation_period', evaluation_period,
+    'attendance', attendance,
+    'course_code', course_code,
+    'coordinator_id', coordinator_id,
+    'coordinator_name', coordinator_name
+)"""
+
 @app.route('/dbproj/student_details/<student_id>', methods=['GET'])
 @token_required
 def student_details(student_id):
@@ -588,61 +2498,219 @@ def student_details(student_id):
     # Usar flask.g.role e flask.g.user_id para verificar permissão
     current_user_id = flask.g.user_id
     current_user_role = flask.g.role
-    if current_user_role != 'admin' and current_user_id != int(student_id):
+    try:
+        student_id = int(student_id)
+    except ValueError:
+        return flask.jsonify({'status': StatusCodes['api_error'], 'errors': 'Invalid student ID', 'results': None})
+    if current_user_role != 'admin' and current_user_id != student_id:
         return flask.jsonify({'status': StatusCodes['unauthorized'], 'errors': 'Permission denied', 'results': None})
 
-    conn = db_connection()
-    cur = conn.cursor()
-
+    # Página pedida: cursor com (year, edition_id) da última linha da página anterior
     try:
-        # Query para obter todos os cursos do student com detalhes
-        cur.execute("""
-            SELECT 
-                ce.edition_id,
-                c.name as course_name,
-                ced.year as course_year,
-                ce.grade,
-                ce.evaluation_period,
-                ce.attendance,
-                c.code as course_code,
-                ced.coordinator_id,
-                u.username as coordinator_name
-            FROM course_enrollment ce
-            JOIN course_edition ced ON ce.edition_id = ced.edition_id
-            JOIN course c ON ced.course_code = c.code
-            LEFT JOIN users u ON ced.coordinator_id = u.user_id
-            WHERE ce.student_id = %s
-            ORDER BY ced.year DESC, ce.edition_id DESC
-        """, (student_id,))
+        limit, after = page_args((int, int))
+    except ValueError as e:
+        return flask.jsonify({'status': StatusCodes['api_error'], 'errors': str(e), 'results': None})
+
+    query, params = student_details_query(student_id, limit, after)
+
+    # Modo streaming: todas as linhas a partir do cursor (LIMIT NULL), sem cache
+    if wants_stream():
+        return stream_query(query, {**params, 'limit': None}, student_details_row, 'Student details')
+
+    # Só a primeira página com o limite por omissão fica em cache
+    use_cache = after is None and limit == app.config['PAGE_DEFAULT_LIMIT'] and student_caches_usable()
+    if use_cache:
+        cached = student_details_cache.get(student_id)
+        if isinstance(cached, str):
+            return json_text_response(cached)
+        if cached is not None:
+            return flask.jsonify({'status': StatusCodes['success'], 'errors': None, **cached})
+        generation = student_cache_generation()
+
+    with db_connection() as conn:
+        cur = conn.cursor()
+
+        try:
+            # Documento JSON montado pelo Postgres (fica em cache como texto)
+            if app.config['PG_JSON_RESPONSES']:
+                document = fetch_json_document(cur, query, params, STUDENT_DETAILS_ROW_JSON,
+                                               'course_year DESC, edition_id DESC', limit,
+                                               'json_build_array(course_year, edition_id)')
+                if use_cache:
+                    store_student_cache(student_details_cache, student_id, document, generation)
+                return json_text_response(document)
+
+            cur.execute(query, params)
         
-        courses = cur.fetchall()
+            courses = cur.fetchall()
+            has_more = len(courses) > limit
+            courses = courses[:limit]
         
-        # Construir resposta
-        resultStudentDetails = []
-        for course in courses:
-            resultStudentDetails.append({
-                'course_edition_id': course[0],
-                'course_name': course[1],
-                'course_edition_year': course[2],
-                'grade': float(course[3]) if course[3] is not None else None,
-                'evaluation_period': course[4],
-                'attendance': course[5],
-                'course_code': course[6],
-                'coordinator_id': course[7],
-                'coordinator_name': course[8]
-            })
+            # Construir resposta
+            resultStudentDetails = [student_details_row(course) for course in courses]
         
-        response = {'status': StatusCodes['success'], 'errors': None, 'results': resultStudentDetails}
+            page = {
+                'results': resultStudentDetails,
+                'next_cursor': encode_cursor((courses[-1][2], courses[-1][0])) if has_more else None
+            }
+            if use_cache:
+                store_student_cache(student_details_cache, student_id, page, generation)
+            response = {'status': StatusCodes['success'], 'errors': None, **page}
 
-    except (Exception, psycopg2.DatabaseError) as error:
-        logger.error(f'Student details error: {error}')
-        response = {'status': StatusCodes['internal_error'], 'errors': str(error), 'results': None}
-    finally:
-        if conn is not None:
-            conn.close()
+        except (Exception, psycopg2.DatabaseError) as error:
+            logger.error(f'Student details error: {error}')
+            response = {'status': StatusCodes['internal_error'], 'errors': str(error), 'results': None}
+
+    return flask.jsonify(response)
+
+def financial_transaction_row(r):
+    return {
+        'transaction_id': r[1],
+        'amount': r[2],
+        'description': r[3],
+        'date': r[4],
+        'activity_id': r[5],
+        'degree_id': r[6]
+    }
+
+def financial_statement_query(student_id, limit, after=None):
+    """(query, params) of a page of the student's statement (newest first) after the cursor (transaction_id).
+
+    Every row carries the current balance; a student with an account but no
+    transactions gets one row with NULL transaction columns.
+    """
+    query = """
+        SELECT fb.balance, ft.transaction_id, ft.amount, ft.description, ft.transaction_date, ft.activity_id, ft.degree_id
+        FROM financial_balance fb
+        LEFT JOIN LATERAL (
+            SELECT t.transaction_id, t.amount, t.description, t.transaction_date, t.activity_id, t.degree_id
+            FROM financial_transaction t
+            WHERE t.account_id = fb.account_id
+              AND (%(after_id)s::int IS NULL OR t.transaction_id < %(after_id)s)
+            ORDER BY t.transaction_id DESC
+            LIMIT %(limit)s
+        ) ft ON TRUE
+        WHERE fb.student_id = %(student_id)s
+        ORDER BY ft.transaction_id DESC
+    """
+    params = {'student_id': student_id, 'after_id': after and after[0], 'limit': limit + 1}
+    return query, params
+
+@app.route('/dbproj/financial_statement/<student_id>', methods=['GET'])
+@token_required
+def financial_statement(student_id):
+    # Verificar permissões: admin ou o próprio student
+    try:
+        student_id = int(student_id)
+    except ValueError:
+        return flask.jsonify({'status': StatusCodes['api_error'], 'errors': 'Invalid student ID', 'results': None})
+    if flask.g.role != 'admin' and flask.g.user_id != student_id:
+        return flask.jsonify({'status': StatusCodes['unauthorized'], 'errors': 'Permission denied', 'results': None})
+
+    # Página pedida: cursor com o transaction_id da última linha da página anterior
+    try:
+        limit, after = page_args((int,))
+    except ValueError as e:
+        return flask.jsonify({'status': StatusCodes['api_error'], 'errors': str(e), 'results': None})
+
+    query, params = financial_statement_query(student_id, limit, after)
+
+    with db_connection() as conn:
+        cur = conn.cursor()
+
+        try:
+            cur.execute(query, params)
+            rows = cur.fetchall()
+            conn.commit()
+            if not rows:
+                return flask.jsonify({'status': StatusCodes['api_error'], 'errors': 'Student has no financial account', 'results': None})
+
+            transactions = [r for r in rows if r[1] is not None]
+            has_more = len(transactions) > limit
+            transactions = transactions[:limit]
+
+            response = {
+                'status': StatusCodes['success'],
+                'errors': None,
+                'results': {
+                    'balance': rows[0][0],
+                    'transactions': [financial_transaction_row(r) for r in transactions]
+                },
+                'next_cursor': encode_cursor((transactions[-1][1],)) if has_more else None
+            }
+
+        except (Exception, psycopg2.DatabaseError) as error:
+            conn.rollback()
+            logger.error(f'Financial statement error: {error}')
+            response = {'status': StatusCodes['internal_error'], 'errors': str(error), 'results': None}
 
     return flask.jsonify(response)
 
+def degree_details_row(course):
+    return {
+        'course_id': course[0],
+        'course_name': course[1],
+        'course_edition_id': course[2],
+        'course_edition_year': course[3],
+        'capacity': course[4],
+        'enrolled_count': course[5],
+        'approved_count': course[6],
+        'coordinator_id': course[7],
+        'instructors': course[8] if course[8] is not None else []
+    }
+
+def degree_details_query(degree_id, limit, after=None):
+    """(query, params) for a page of degree_details, limit + 1 rows after the cursor key"""
+    # Query corrected to filter course editions that belong to the requested degree
+    # Uses degree_courses(degree_id, course_code) to find the courses associated with the degree.
+    # Counts and instructors come precomputed: enrolled_count is the seat counter of
+    # course_edition and course_edition_summary is kept up to date by triggers.
+    # Pages follow idx_course_edition_year_code (year DESC, course_code, edition_id);
+    # edition_id breaks ties between editions of the same course and year
+    keyset = '''AND (ce.year < %(after_year)s
+             OR (ce.year = %(after_year)s AND (c.code, ce.edition_id) > (%(after_code)s, %(after_edition)s)))''' if after else ''
+    query = f"""
+        SELECT
+            c.code AS course_id,
+            c.name AS course_name,
+            ce.edition_id AS course_edition_id,
+            ce.year AS course_edition_year,
+            ce.capacity,
+            ce.enrolled_count,
+            COALESCE(s.approved_count, 0) AS approved_count,
+            ce.coordinator_id,
+            s.instructors
+        FROM course_edition ce
+        JOIN course c ON ce.course_code = c.code
+        JOIN degree_courses dc ON dc.course_code = c.code AND dc.degree_id = %(degree_id)s
+        LEFT JOIN course_edition_summary s ON s.edition_id = ce.edition_id
+        WHERE TRUE
+            {keyset}
+        ORDER BY ce.year DESC, c.code, ce.edition_id
+        LIMIT %(limit)s
+    """
+    params = {
+        'degree_id': degree_id,
+        'after_year': after and after[0],
+        'after_code': after and after[1],
+        'after_edition': after and after[2],
+        'limit': limit + 1
+    }
+    return query, params
+
+# O mesmo objeto que degree_details_row, construído pelo Postgres
+DEGREE_DETAILS_ROW_JSON = """json_build_object(
+    'course_id', course_id,
+    'course_name', course_name,
+    'course_edition_id', course_edition_id,
+    'course_edition_year', course_edition_year,
+    'capacity', capacity,
+    'enrolled_count', enrolled_count,
+    'approved_count', approved_count,
+    'coordinator_id', coordinator_id,
+    'instructors', COALESCE(instructors, '{}')
+)"""
+
 @app.route('/dbproj/degree_details/<degree_id>', methods=['GET'])
 @token_required
 def degree_details(degree_id):
@@ -651,57 +2719,174 @@ def degree_details(degree_id):
     if flask.g.role != 'admin':
         return flask.jsonify({'status': StatusCodes['unauthorized'], 'errors': 'Only admin can view degree details', 'results': None})
 
-    conn = db_connection()
-    cur = conn.cursor()
+    # Página pedida: cursor com (year, course_code, edition_id) da última linha
+    try:
+        limit, after = page_args((int, str, int))
+    except ValueError as e:
+        return flask.jsonify({'status': StatusCodes['api_error'], 'errors': str(e), 'results': None})
+
+    query, params = degree_details_query(degree_id, limit, after)
+
+    # Modo streaming: todas as linhas a partir do cursor (LIMIT NULL)
+    if wants_stream():
+        return stream_query(query, {**params, 'limit': None}, degree_details_row, 'Degree details')
+
+    def load():
+        with db_connection() as conn:
+            cur = conn.cursor()
+
+            try:
+                if app.config['PG_JSON_RESPONSES']:
+                    return fetch_json_document(
+                        cur, query, params, DEGREE_DETAILS_ROW_JSON,
+                        'course_edition_year DESC, course_id, course_edition_id', limit,
+                        'json_build_array(course_edition_year, course_id, course_edition_id)')
+
+                cur.execute(query, params)
+
+                degree_courses = cur.fetchall()
+                has_more = len(degree_courses) > limit
+                degree_courses = degree_courses[:limit]
+
+                # Construir resposta
+                resultDegreeDetails = [degree_details_row(course) for course in degree_courses]
+
+                last = degree_courses[-1] if has_more else None
+                return {
+                    'status': StatusCodes['success'],
+                    'errors': None,
+                    'results': resultDegreeDetails,
+                    'next_cursor': encode_cursor((last[3], last[0], last[2])) if last else None
+                }
+
+            except (Exception, psycopg2.DatabaseError) as error:
+                logger.error(f'Degree details error: {error}')
+                return {'status': StatusCodes['internal_error'], 'errors': str(error), 'results': None}
+
+    return shared_response(shared_query('degree_details', (degree_id, limit, tuple(after or ())), load))
+
+# Ano usado por omissão no leaderboard e no top3 (ano letivo corrente)
+app.config['LEADERBOARD_DEFAULT_YEAR'] = 2024
+app.config['LEADERBOARD_MAX_N'] = 100
+
+# Top n students de um ano pela média, lido do ranking mantido por
+# update_grade_rankings() através do índice (year, average DESC) ou, para um
+# degree, do índice (year, degree_id, average DESC) de degree_year_average; só
+# um dos ramos corre e só as linhas dos vencedores são tocadas
+LEADERBOARD_QUERY = """
+    WITH ranked AS (
+        (SELECT r.student_id, r.average
+        FROM student_year_average r
+        WHERE %(degree_id)s IS NULL
+            AND r.year = %(year)s
+            AND r.grade_count > 0
+        ORDER BY r.average DESC NULLS LAST, r.student_id
+        LIMIT %(n)s)
+        UNION ALL
+        (SELECT r.student_id, r.average
+        FROM degree_year_average r
+        WHERE r.year = %(year)s
+            AND r.degree_id = %(degree_id)s
+            AND r.grade_count > 0
+        ORDER BY r.average DESC NULLS LAST, r.student_id
+        LIMIT %(n)s)
+    ), top_n AS (
+        SELECT r.student_id, s.name AS student_name, ROUND(r.average, 2) AS average_grade
+        FROM ranked r
+        JOIN student s ON s.user_id = r.student_id
+    )
+    SELECT 
+        t.student_id,
+        t.student_name,
+        t.average_grade,
+        COALESCE(
+            (SELECT json_agg(json_build_object(
+                'course_edition_id', ce.edition_id,
+                'course_edition_name', c.name || ' - ' || ed.year::text,
+                'grade', ce.grade,
+                'date', ed.year || '-01-01'
+            ))
+            FROM course_enrollment ce
+            JOIN course_edition ed ON ce.edition_id = ed.edition_id
+            JOIN course c ON ed.course_code = c.code
+            WHERE ce.student_id = t.student_id 
+                AND ce.grade IS NOT NULL
+                AND ed.year = %(year)s
+            ), '[]'::json) AS grades,
+        COALESCE(
+            (SELECT json_agg(a.name)
+            FROM activity_participation ap
+            JOIN activity a ON ap.activity_id = a.activity_id
+            WHERE ap.student_id = t.student_id
+            ), '[]'::json) AS activities
+    FROM top_n t
+    ORDER BY t.average_grade DESC, t.student_id
+"""
+
+def leaderboard_row(r):
+    return {
+        'student_id': r[0],
+        'student_name': r[1],
+        'average_grade': r[2],
+        # Já vêm como JSON correto
+        'grades': r[3] or [],
+        'activities': r[4] or []
+    }
+
+def leaderboard_document_query(year, degree_id=None, n=3, with_student_id=True):
+    """json_document_query for the leaderboard (see fetch_leaderboard_document)"""
+    row_json = f"""json_build_object(
+        {"'student_id', student_id," if with_student_id else ''}
+        'student_name', student_name,
+        'average_grade', average_grade::float8,
+        'grades', grades,
+        'activities', activities
+    )"""
+    return json_document_query(LEADERBOARD_QUERY, {'year': year, 'degree_id': degree_id, 'n': n},
+                               row_json, 'average_grade DESC, student_id')
+
+def fetch_leaderboard(cur, year, degree_id=None, n=3):
+    """Top n students of a year by average grade, optionally restricted to one degree"""
+    cur.execute(LEADERBOARD_QUERY, {'year': year, 'degree_id': degree_id, 'n': n})
+    return [leaderboard_row(r) for r in cur.fetchall()]
+
+def fetch_leaderboard_document(cur, year, degree_id=None, n=3, with_student_id=True):
+    """Same as fetch_leaderboard, as the JSON text of the whole response built by Postgres"""
+    cur.execute(*leaderboard_document_query(year, degree_id, n, with_student_id))
+    return cur.fetchone()[0]
+
+@app.route('/dbproj/leaderboard', methods=['GET'])
+@token_required
+def leaderboard():
+    # Permission check (only admin allowed)
+    if flask.g.role != 'admin':
+        return flask.jsonify({'status': StatusCodes['unauthorized'], 'errors': 'Only admin can access this endpoint', 'results': None})
 
     try:
-        # Query corrected to filter course editions that belong to the requested degree
-        # Uses degree_courses(degree_id, course_code) to find the courses associated with the degree
-        cur.execute("""
-            SELECT
-                c.code AS course_id,
-                c.name AS course_name,
-                ce.edition_id AS course_edition_id,
-                ce.year AS course_edition_year,
-                ce.capacity,
-                COUNT(ce_enroll.student_id) AS enrolled_count,
-                COUNT(ce_enroll.student_id) FILTER (WHERE ce_enroll.grade >= 9.5) AS approved_count,
-                ce.coordinator_id,
-                ARRAY_REMOVE(ARRAY_AGG(DISTINCT ia.instructor_id), NULL) AS instructors
-            FROM course_edition ce
-            JOIN course c ON ce.course_code = c.code
-            JOIN degree_courses dc ON dc.course_code = c.code AND dc.degree_id = %s
-            LEFT JOIN course_enrollment ce_enroll ON ce.edition_id = ce_enroll.edition_id
-            LEFT JOIN instructor_assignment ia ON ce.edition_id = ia.edition_id
-            GROUP BY c.code, c.name, ce.edition_id, ce.year, ce.capacity, ce.coordinator_id
-            ORDER BY ce.year DESC, c.code
-        """, (degree_id,))
-
-        degree_courses = cur.fetchall()
-        
-        # Construir resposta
-        resultDegreeDetails = []
-        for course in degree_courses:
-            resultDegreeDetails.append({
-                'course_id': course[0],
-                'course_name': course[1],
-                'course_edition_id': course[2],
-                'course_edition_year': course[3],
-                'capacity': course[4],
-                'enrolled_count': course[5],
-                'approved_count': course[6],
-                'coordinator_id': course[7],
-                'instructors': course[8] if course[8] is not None else []
-            })
-        
-        response = {'status': StatusCodes['success'], 'errors': None, 'results': resultDegreeDetails}
+        year = int(flask.request.args.get('year', app.config['LEADERBOARD_DEFAULT_YEAR']))
+        degree_id = flask.request.args.get('degree_id')
+        degree_id = int(degree_id) if degree_id else None
+        n = int(flask.request.args.get('n', 3))
+    except ValueError:
+        return flask.jsonify({'status': StatusCodes['api_error'], 'errors': 'year, degree_id and n must be integers', 'results': None})
 
-    except (Exception, psycopg2.DatabaseError) as error:
-        logger.error(f'Degree details error: {error}')
-        response = {'status': StatusCodes['internal_error'], 'errors': str(error), 'results': None}
-    finally:
-        if conn is not None:
-            conn.close()
+    if n < 1 or n > app.config['LEADERBOARD_MAX_N']:
+        return flask.jsonify({'status': StatusCodes['api_error'], 'errors': f'n must be between 1 and {app.config["LEADERBOARD_MAX_N"]}', 'results': None})
+
+    with db_connection() as conn:
+        cur = conn.cursor()
+        try:
+            if app.config['PG_JSON_RESPONSES']:
+                return json_text_response(fetch_leaderboard_document(cur, year, degree_id, n))
+
+            results = fetch_leaderboard(cur, year, degree_id, n)
+            conn.commit()
+            response = {'status': StatusCodes['success'], 'errors': None, 'results': results}
+
+        except (Exception, psycopg2.DatabaseError) as error:
+            logger.error(f'Leaderboard error: {error}')
+            conn.rollback()
+            response = {'status': StatusCodes['internal_error'], 'errors': str(error), 'results': None}
 
     return flask.jsonify(response)
 
@@ -713,89 +2898,48 @@ def top3_students():
     if flask.g.role != 'admin':
         return flask.jsonify({'status': StatusCodes['unauthorized'], 'errors': 'Only admin can access this endpoint', 'results': None})
 
-    conn = db_connection()
-    cur = conn.cursor()
-    try:
-        # Single SQL query that computes student averages for the current year,
-        # selects top 3 students and aggregates their grades and activities as JSON
-        cur.execute("""
-            WITH student_avg AS (
-                SELECT 
-                    s.user_id AS student_id,
-                    s.name AS student_name,
-                    ROUND(AVG(ce.grade)::numeric, 2) AS average_grade
-                FROM course_enrollment ce
-                JOIN course_edition ed ON ce.edition_id = ed.edition_id
-                JOIN student s ON ce.student_id = s.user_id
-                WHERE ce.grade IS NOT NULL
-                    AND ed.year = 2024  -- ← MUDAR PARA 2024
-                GROUP BY s.user_id, s.name
-            ),
-            top_three AS (
-                SELECT student_id, student_name, average_grade
-                FROM student_avg
-                ORDER BY average_grade DESC
-                LIMIT 3
-            )
-            SELECT 
-                t.student_id,
-                t.student_name,
-                t.average_grade,
-                COALESCE(
-                    (SELECT json_agg(json_build_object(
-                        'course_edition_id', ce.edition_id,
-                        'course_edition_name', c.name || ' - ' || ed.year::text,
-                        'grade', ce.grade,
-                        'date', ed.year || '-01-01'
-                    ))
-                    FROM course_enrollment ce
-                    JOIN course_edition ed ON ce.edition_id = ed.edition_id
-                    JOIN course c ON ed.course_code = c.code
-                    WHERE ce.student_id = t.student_id 
-                        AND ce.grade IS NOT NULL
-                        AND ed.year = 2024  -- ← MUDAR PARA 2024
-                    ), '[]'::json) AS grades,
-                COALESCE(
-                    (SELECT json_agg(a.name)
-                    FROM activity_participation ap
-                    JOIN activity a ON ap.activity_id = a.activity_id
-                    WHERE ap.student_id = t.student_id
-                    ), '[]'::json) AS activities
-            FROM top_three t
-            ORDER BY t.average_grade DESC
-        """)
-        rows = cur.fetchall()
-        results = []
-        for r in rows:
-            student_id = r[0]
-            student_name = r[1]
-            avg_grade = float(r[2]) if r[2] is not None else None
-            
-            # Já vêm como JSON correto
-            grades_json = r[3] or []
-            activities_json = r[4] or []
-
-            results.append({
-                'student_name': student_name,  # ← APENAS student_name (sem student_id)
-                'average_grade': avg_grade,
-                'grades': grades_json,
-                'activities': activities_json
-            })
-
-        # Commit the transaction if successful
-        conn.commit()
-        response = {'status': StatusCodes['success'], 'errors': None, 'results': results}
-
-    except (Exception, psycopg2.DatabaseError) as error:
-        logger.error(f'Top3 error: {error}')
-        # Rollback on error
-        conn.rollback()
-        response = {'status': StatusCodes['internal_error'], 'errors': str(error), 'results': None}
-    finally:
-        if conn is not None:
-            conn.close()
-
-    return flask.jsonify(response)
+    year = app.config['LEADERBOARD_DEFAULT_YEAR']
+
+    def load():
+        with db_connection() as conn:
+            cur = conn.cursor()
+            try:
+                # Top 3 do ano corrente, servido pelo leaderboard
+                if app.config['PG_JSON_RESPONSES']:
+                    return fetch_leaderboard_document(cur, year, n=3, with_student_id=False)
+
+                results = fetch_leaderboard(cur, year, n=3)
+                for result in results:
+                    del result['student_id']  # ← APENAS student_name (sem student_id)
+
+                # Commit the transaction if successful
+                conn.commit()
+                return {'status': StatusCodes['success'], 'errors': None, 'results': results}
+
+            except (Exception, psycopg2.DatabaseError) as error:
+                logger.error(f'Top3 error: {error}')
+                # Rollback on error
+                conn.rollback()
+                return {'status': StatusCodes['internal_error'], 'errors': str(error), 'results': None}
+
+    # Pedidos concorrentes partilham a mesma execução (ver SHARED QUERIES)
+    return shared_response(shared_query('top3', (year,), load))
+
+# Best student(s) per district, read from the state maintained by the triggers:
+# district_best holds each district's top average and the (district, average)
+# index on student_average finds the students with that average
+TOP_BY_DISTRICT_QUERY = """
+    SELECT sa.student_id, db.district, db.best_average AS average_grade
+    FROM district_best db
+    JOIN student_average sa ON sa.district = db.district AND sa.average = db.best_average
+    WHERE sa.grade_count > 0
+    ORDER BY db.best_average DESC, db.district, sa.student_id
+"""
+
+TOP_BY_DISTRICT_ROW_JSON = "json_build_object('student_id', student_id, 'district', district, 'average_grade', average_grade::float8)"
+
+def top_by_district_row(r):
+    return {'student_id': r[0], 'district': r[1], 'average_grade': r[2]}
 
 @app.route('/dbproj/top_by_district', methods=['GET'])
 @token_required
@@ -805,50 +2949,79 @@ def top_by_district():
     if flask.g.role != 'admin':
         return flask.jsonify({'status': StatusCodes['unauthorized'], 'errors': 'Only admin can access this endpoint', 'results': None})
 
-    conn = db_connection()
-    cur = conn.cursor()
+    def load():
+        with db_connection() as conn:
+            cur = conn.cursor()
+            try:
+                if app.config['PG_JSON_RESPONSES']:
+                    return fetch_json_document(
+                        cur, TOP_BY_DISTRICT_QUERY, {}, TOP_BY_DISTRICT_ROW_JSON,
+                        'average_grade DESC, district, student_id')
+
+                cur.execute(TOP_BY_DISTRICT_QUERY)
+
+                rows = cur.fetchall()
+                results = [top_by_district_row(r) for r in rows]
+
+                # Commit the transaction if successful
+                conn.commit()
+                return {'status': StatusCodes['success'], 'errors': None, 'results': results}
+
+            except (Exception, psycopg2.DatabaseError) as error:
+                logger.error(f'Top by district error: {error}')
+                # Rollback on error
+                conn.rollback()
+                return {'status': StatusCodes['internal_error'], 'errors': str(error), 'results': None}
+
+    return shared_response(shared_query('top_by_district', (), load))
+
+def monthly_report_row(r):
+    return {
+        'month': r[0],
+        'course_edition_id': r[1],
+        'course_edition_name': r[2],
+        'approved': int(r[3]) if r[3] is not None else 0,
+        'evaluated': int(r[4]) if r[4] is not None else 0
+    }
+
+# Reads the monthly rollup maintained by update_monthly_stats() (grades are bucketed
+# by their evaluated_at month). The query returns, for each month, the course edition
+# with the most approved students (grade >= 9.5) and counts of approved/evaluated.
+MONTHLY_REPORT_QUERY = """
+    SELECT DISTINCT ON (m.month)
+           TO_CHAR(m.month, 'YYYY-MM') AS month,
+           m.edition_id AS course_edition_id,
+           c.name AS course_edition_name,
+           m.approved,
+           m.evaluated
+    FROM monthly_edition_stats m
+    JOIN course_edition ce ON m.edition_id = ce.edition_id
+    JOIN course c ON ce.course_code = c.code
+    WHERE m.month BETWEEN %(start)s AND %(end)s
+      AND m.evaluated > 0
+    ORDER BY m.month DESC, m.approved DESC, m.edition_id
+"""
+
+MONTHLY_REPORT_ROW_JSON = """json_build_object(
+    'month', month,
+    'course_edition_id', course_edition_id,
+    'course_edition_name', course_edition_name,
+    'approved', COALESCE(approved, 0),
+    'evaluated', COALESCE(evaluated, 0)
+)"""
+
+def report_months(args):
+    """(start, end) months of the report from the query string (raises ValueError)"""
+    # Intervalo de meses (YYYY-MM, inclusivo); por omissão desde janeiro do ano anterior
+    today = datetime.now()
     try:
-        # Compute average grade per student and district, then pick top student(s) per district
-        cur.execute("""
-            WITH student_averages AS (
-                SELECT s.user_id AS student_id,
-                       s.district,
-                       ROUND(AVG(ce.grade)::numeric, 2) AS average_grade
-                FROM course_enrollment ce
-                JOIN student s ON ce.student_id = s.user_id
-                WHERE ce.grade IS NOT NULL AND s.district IS NOT NULL
-                GROUP BY s.user_id, s.district
-            ),
-            ranked AS (
-                SELECT *, RANK() OVER (PARTITION BY district ORDER BY average_grade DESC) AS rnk
-                FROM student_averages
-            )
-            SELECT student_id, district, average_grade
-            FROM ranked
-            WHERE rnk = 1
-            ORDER BY average_grade DESC
-        """)
-
-        rows = cur.fetchall()
-        results = [
-            {'student_id': r[0], 'district': r[1], 'average_grade': float(r[2])}
-            for r in rows
-        ]
-
-        # Commit the transaction if successful
-        conn.commit()
-        response = {'status': StatusCodes['success'], 'errors': None, 'results': results}
-
-    except (Exception, psycopg2.DatabaseError) as error:
-        logger.error(f'Top by district error: {error}')
-        # Rollback on error
-        conn.rollback()
-        response = {'status': StatusCodes['internal_error'], 'errors': str(error), 'results': None}
-    finally:
-        if conn is not None:
-            conn.close()
-
-    return flask.jsonify(response)
+        start = datetime.strptime(args.get('from', f'{today.year - 1}-01'), '%Y-%m')
+        end = datetime.strptime(args.get('to', today.strftime('%Y-%m')), '%Y-%m')
+    except ValueError:
+        raise ValueError('from and to must be months in YYYY-MM format')
+    if start > end:
+        raise ValueError('from must not be after to')
+    return start.date(), end.date()
 
 @app.route('/dbproj/report', methods=['GET'])
 @token_required
@@ -858,63 +3031,39 @@ def monthly_report():
     if flask.g.role != 'admin':
         return flask.jsonify({'status': StatusCodes['unauthorized'], 'errors': 'Only admin can access this endpoint', 'results': None})
 
-    conn = db_connection()
-    cur = conn.cursor()
     try:
-        # NOTE: the schema does not contain a grade timestamp. We aggregate by course_edition year
-        # and produce a month label as YEAR-01. If you have a date for the evaluation, replace the
-        # date logic below to use it (e.g., grade_date). The query returns, for each month, the
-        # course edition with the most approved students (grade >= 9.5) and counts of approved/evaluated.
-        cur.execute("""
-            WITH evaluation_stats AS (
-                SELECT TO_CHAR(TO_DATE(CE.year::text || '-01-01', 'YYYY-MM-DD'), 'YYYY-MM') AS month_label,
-                       ce.edition_id AS course_edition_id,
-                       c.name AS course_edition_name,
-                       COUNT(ce_en.student_id) FILTER (WHERE ce_en.grade IS NOT NULL) AS evaluated,
-                       COUNT(ce_en.student_id) FILTER (WHERE ce_en.grade >= 9.5) AS approved
-                FROM course_enrollment ce_en
-                JOIN course_edition ce ON ce_en.edition_id = ce.edition_id
-                JOIN course c ON ce.course_code = c.code
-                WHERE ce_en.grade IS NOT NULL
-                  AND ce.year >= EXTRACT(YEAR FROM CURRENT_DATE) - 1
-                GROUP BY month_label, ce.edition_id, c.name, ce.year
-            ),
-            best_per_month AS (
-                SELECT DISTINCT ON (month_label) *
-                FROM evaluation_stats
-                ORDER BY month_label, approved DESC
-            )
-            SELECT month_label AS month, course_edition_id, course_edition_name, approved, evaluated
-            FROM best_per_month
-            ORDER BY month_label DESC
-        """)
-
-        rows = cur.fetchall()
-        results = [
-            {
-                'month': r[0],
-                'course_edition_id': r[1],
-                'course_edition_name': r[2],
-                'approved': int(r[3]) if r[3] is not None else 0,
-                'evaluated': int(r[4]) if r[4] is not None else 0
-            }
-            for r in rows
-        ]
+        start, end = report_months(flask.request.args)
+    except ValueError as e:
+        return flask.jsonify({'status': StatusCodes['api_error'], 'errors': str(e), 'results': None})
+    params = {'start': start, 'end': end}
 
-        # Commit the transaction if successful
-        conn.commit()
-        response = {'status': StatusCodes['success'], 'errors': None, 'results': results}
+    if wants_stream():
+        return stream_query(MONTHLY_REPORT_QUERY, params, monthly_report_row, 'Monthly report')
 
-    except (Exception, psycopg2.DatabaseError) as error:
-        logger.error(f'Monthly report error: {error}')
-        # Rollback on error
-        conn.rollback()
-        response = {'status': StatusCodes['internal_error'], 'errors': str(error), 'results': None}
-    finally:
-        if conn is not None:
-            conn.close()
+    def load():
+        with db_connection() as conn:
+            cur = conn.cursor()
+            try:
+                if app.config['PG_JSON_RESPONSES']:
+                    return fetch_json_document(
+                        cur, MONTHLY_REPORT_QUERY, params, MONTHLY_REPORT_ROW_JSON, 'month DESC')
 
-    return flask.jsonify(response)
+                cur.execute(MONTHLY_REPORT_QUERY, params)
+
+                rows = cur.fetchall()
+                results = [monthly_report_row(r) for r in rows]
+
+                # Commit the transaction if successful
+                conn.commit()
+                return {'status': StatusCodes['success'], 'errors': None, 'results': results}
+
+            except (Exception, psycopg2.DatabaseError) as error:
+                logger.error(f'Monthly report error: {error}')
+                # Rollback on error
+                conn.rollback()
+                return {'status': StatusCodes['internal_error'], 'errors': str(error), 'results': None}
+
+    return shared_response(shared_query('report', (start, end), load))
 
 @app.route('/dbproj/delete_details/<student_id>', methods=['DELETE'])
 @token_required
@@ -924,115 +3073,305 @@ def delete_student(student_id):
     if flask.g.role != 'admin':
         return flask.jsonify({'status': StatusCodes['unauthorized'], 'errors': 'Only admin can delete student data', 'results': None})
 
-    conn = db_connection()
-    cur = conn.cursor()
-
     try:
-        # 1. Verificar se o student existe
-        cur.execute("SELECT 1 FROM users WHERE user_id = %s AND role = 'student'", (student_id,))
-        if not cur.fetchone():
-            return flask.jsonify({'status': StatusCodes['api_error'], 'errors': 'Student does not exist', 'results': None})
+        student_id = int(student_id)
+    except ValueError:
+        return flask.jsonify({'status': StatusCodes['api_error'], 'errors': 'Invalid student ID', 'results': None})
 
-        # 2. Remover dados por ordem (respeitando foreign keys)
-        # Começar pelas tabelas dependentes e terminar na tabela users
-        
-        # a. Remover activity participation
-        cur.execute("DELETE FROM activity_participation WHERE student_id = %s", (student_id,))
-        
-        # b. Remover student_class assignments
-        cur.execute("DELETE FROM student_class WHERE student_id = %s", (student_id,))
-        
-        # c. Remover course enrollments
-        cur.execute("DELETE FROM course_enrollment WHERE student_id = %s", (student_id,))
-        
-        # d. Remover financial_account
-        cur.execute("DELETE FROM financial_account WHERE student_id = %s", (student_id,))
-        
-        # e. Remover degree enrollments
-        cur.execute("DELETE FROM degree_enrollment WHERE student_id = %s", (student_id,))
-        
-        # f. Remover academic_record
-        cur.execute("DELETE FROM academic_record WHERE student_id = %s", (student_id,))
-        
-        # g. Remover da tabela student
-        cur.execute("DELETE FROM student WHERE user_id = %s", (student_id,))
-        
-        # h. Finalmente remover da tabela users
-        cur.execute("DELETE FROM users WHERE user_id = %s", (student_id,))
+    # soft: marcar como apagado e deixar o resto para o purge; hard: apagar já
+    mode = flask.request.args.get('mode', 'soft' if app.config['STUDENT_SOFT_DELETE'] else 'hard')
+    if mode not in ('soft', 'hard'):
+        return flask.jsonify({'status': StatusCodes['api_error'], 'errors': 'mode must be soft or hard', 'results': None})
 
-        conn.commit()
-        
-        # Verificar se realmente foi removido
-        cur.execute("SELECT 1 FROM users WHERE user_id = %s", (student_id,))
-        if not cur.fetchone():
-            response = {'status': StatusCodes['success'], 'errors': None, 'results': 'Student data deleted successfully'}
-        else:
-            response = {'status': StatusCodes['internal_error'], 'errors': 'Failed to delete student data', 'results': None}
+    with db_connection() as conn:
+        cur = conn.cursor()
 
-    except psycopg2.IntegrityError as e:
-        conn.rollback()
-        response = {'status': StatusCodes['api_error'], 'errors': f'Integrity error: {str(e)}', 'results': None}
-    except (Exception, psycopg2.DatabaseError) as error:
-        conn.rollback()
-        logger.error(f'Delete student error: {error}')
-        response = {'status': StatusCodes['internal_error'], 'errors': str(error), 'results': None}
-    finally:
-        if conn is not None:
-            conn.close()
+        try:
+            cur.execute("SELECT deleted_at IS NOT NULL FROM student WHERE user_id = %s FOR UPDATE", (student_id,))
+            row = cur.fetchone()
+            if not row:
+                conn.rollback()
+                return flask.jsonify({'status': StatusCodes['api_error'], 'errors': 'Student does not exist', 'results': None})
+            already_deleted = row[0]
+
+            if mode == 'soft':
+                if already_deleted:
+                    conn.rollback()
+                    return flask.jsonify({'status': StatusCodes['api_error'], 'errors': 'Student is already deleted', 'results': None})
+                soft_delete_students(cur, [student_id])
+                message = 'Student marked as deleted, data will be purged in the background'
+            elif already_deleted:
+                # Já retirado dos agregados pelo soft delete: apagar tabela a tabela
+                # para que os triggers de course_enrollment não o retirem outra vez
+                purge_students(cur, [student_id])
+                message = 'Student data deleted successfully'
+            else:
+                # Remover o user: as foreign keys ON DELETE CASCADE (estruturasv2.sql) removem
+                # student, inscrições, turmas, atividades, conta financeira e academic_record
+                cur.execute("DELETE FROM users WHERE user_id = %s AND role = 'student'", (student_id,))
+                message = 'Student data deleted successfully'
+
+            conn.commit()
+            invalidate_student_caches([student_id])
+            if mode == 'soft':
+                start_student_purge_worker()
+            response = {'status': StatusCodes['success'], 'errors': None, 'results': message}
+
+        except psycopg2.IntegrityError as e:
+            conn.rollback()
+            response = {'status': StatusCodes['api_error'], 'errors': f'Integrity error: {str(e)}', 'results': None}
+        except (Exception, psycopg2.DatabaseError) as error:
+            conn.rollback()
+            logger.error(f'Delete student error: {error}')
+            response = {'status': StatusCodes['internal_error'], 'errors': str(error), 'results': None}
+
+    return flask.jsonify(response)
+
+@app.route('/dbproj/delete_details/bulk', methods=['POST'])
+@token_required
+def delete_students_bulk():
+    # Remover vários students de uma vez (e.g., um curso que terminou), apenas admin.
+    # Aceita uma lista de ids e/ou um filtro por degree_id e data de matrícula
+    if flask.g.role != 'admin':
+        return flask.jsonify({'status': StatusCodes['unauthorized'], 'errors': 'Only admin can delete student data', 'results': None})
+
+    data = flask.request.get_json() or {}
+    student_ids = data.get('student_ids')
+    degree_id = data.get('degree_id')
+    enrolled_before = data.get('enrolled_before')  # YYYY-MM-DD
+
+    if not student_ids and not degree_id and not enrolled_before:
+        return flask.jsonify({'status': StatusCodes['api_error'], 'errors': 'student_ids or a filter (degree_id, enrolled_before) is required', 'results': None})
+    if student_ids is not None and (not isinstance(student_ids, list) or not all(isinstance(i, int) for i in student_ids)):
+        return flask.jsonify({'status': StatusCodes['api_error'], 'errors': 'student_ids must be a list of integers', 'results': None})
+
+    mode = flask.request.args.get('mode', 'soft' if app.config['STUDENT_SOFT_DELETE'] else 'hard')
+    if mode not in ('soft', 'hard'):
+        return flask.jsonify({'status': StatusCodes['api_error'], 'errors': 'mode must be soft or hard', 'results': None})
+
+    with db_connection() as conn:
+        cur = conn.cursor()
+
+        try:
+            # 1. Resolver os students a remover (bloqueados até ao fim da transação)
+            cur.execute("""
+                SELECT u.user_id
+                FROM users u
+                WHERE u.role = 'student'
+                  AND (%(ids)s::int[] IS NULL OR u.user_id = ANY(%(ids)s::int[]))
+                  AND ((%(degree_id)s::int IS NULL AND %(before)s::date IS NULL) OR EXISTS (
+                      SELECT 1 FROM degree_enrollment de
+                      WHERE de.student_id = u.user_id
+                        AND (%(degree_id)s::int IS NULL OR de.degree_id = %(degree_id)s::int)
+                        AND (%(before)s::date IS NULL OR de.enrollment_date < %(before)s::date)
+                  ))
+                ORDER BY u.user_id
+                FOR UPDATE
+            """, {'ids': student_ids, 'degree_id': degree_id, 'before': enrolled_before})
+            targets = [row[0] for row in cur.fetchall()]
+
+            if not targets:
+                conn.rollback()
+                return flask.jsonify({'status': StatusCodes['api_error'], 'errors': 'No matching students', 'results': None})
+
+            # 2. soft: marcar todos numa instrução; hard: uma instrução por tabela
+            # para todos os students, filhos antes dos pais
+            if mode == 'soft':
+                results = {'students': targets, 'marked': soft_delete_students(cur, targets)}
+            else:
+                results = {'students': targets, 'deleted': purge_students(cur, targets)}
+
+            conn.commit()
+            invalidate_student_caches(targets)
+            if mode == 'soft':
+                start_student_purge_worker()
+            response = {'status': StatusCodes['success'], 'errors': None, 'results': results}
+
+        except psycopg2.IntegrityError as e:
+            conn.rollback()
+            response = {'status': StatusCodes['api_error'], 'errors': f'Integrity error: {str(e)}', 'results': None}
+        except (Exception, psycopg2.DatabaseError) as error:
+            conn.rollback()
+            logger.error(f'Bulk delete students error: {error}')
+            response = {'status': StatusCodes['internal_error'], 'errors': str(error), 'results': None}
+
+    return flask.jsonify(response)
+
+
+@app.route('/dbproj/admin/pool_stats', methods=['GET'])
+@token_required
+def pool_stats():
+    # Estatísticas do pool de conexões para monitorização (apenas admin)
+    if flask.g.role != 'admin':
+        return flask.jsonify({'status': StatusCodes['unauthorized'], 'errors': 'Only admin can access this endpoint', 'results': None})
+
+    return flask.jsonify({'status': StatusCodes['success'], 'errors': None, 'results': get_db_pool().stats()})
+
+
+@app.route('/dbproj/admin/cache_stats', methods=['GET'])
+@token_required
+def cache_stats():
+    # Contadores de hits/misses das caches em memória deste processo (apenas admin)
+    if flask.g.role != 'admin':
+        return flask.jsonify({'status': StatusCodes['unauthorized'], 'errors': 'Only admin can access this endpoint', 'results': None})
+
+    results = {
+        'student_details': student_details_cache.stats(),
+        'passed_courses': passed_courses_cache.stats(),
+        'student_data': student_cache_stats,
+        'tokens': token_cache.stats(),
+        'reference_data': reference_data_summary(),
+        'shared_queries': shared_query_summary()
+    }
+    return flask.jsonify({'status': StatusCodes['success'], 'errors': None, 'results': results})
+
+@app.route('/dbproj/admin/degree_summary/rebuild', methods=['POST'])
+@token_required
+def rebuild_degree_summary():
+    # Reconstruir de raiz os contadores lidos por degree_details (apenas admin)
+    if flask.g.role != 'admin':
+        return flask.jsonify({'status': StatusCodes['unauthorized'], 'errors': 'Only admin can access this endpoint', 'results': None})
+
+    with db_connection() as conn:
+        cur = conn.cursor()
+
+        try:
+            cur.execute("SELECT rebuild_course_seats()")
+            cur.execute("SELECT rebuild_course_edition_summary()")
+            cur.execute("SELECT COUNT(*) FROM course_edition_summary")
+            editions = cur.fetchone()[0]
+            conn.commit()
+            response = {'status': StatusCodes['success'], 'errors': None, 'results': {'editions': editions}}
+
+        except (Exception, psycopg2.DatabaseError) as error:
+            conn.rollback()
+            logger.error(f'Rebuild degree summary error: {error}')
+            response = {'status': StatusCodes['internal_error'], 'errors': str(error), 'results': None}
+
+    return flask.jsonify(response)
+
+@app.route('/dbproj/admin/prerequisites/rebuild', methods=['POST'])
+@token_required
+def rebuild_prerequisites():
+    # Forçar a reconstrução do fecho transitivo dos pré-requisitos (apenas admin)
+    if flask.g.role != 'admin':
+        return flask.jsonify({'status': StatusCodes['unauthorized'], 'errors': 'Only admin can access this endpoint', 'results': None})
+
+    with db_connection() as conn:
+        cur = conn.cursor()
+
+        try:
+            cur.execute("SELECT version FROM cache_version WHERE name = 'course_prerequisites'")
+            row = cur.fetchone()
+            closure = get_prerequisite_closure(cur, row[0] if row else 0, force=True)
+            passed_courses_cache.clear()
+
+            results = {
+                'courses': len(closure),
+                'cycles': prerequisite_closure['cycles'],
+                'passed_courses_cache': passed_courses_cache.stats()
+            }
+            response = {'status': StatusCodes['success'], 'errors': None, 'results': results}
+
+        except (Exception, psycopg2.DatabaseError) as error:
+            logger.error(f'Rebuild prerequisites error: {error}')
+            response = {'status': StatusCodes['internal_error'], 'errors': str(error), 'results': None}
+
+    return flask.jsonify(response)
+
+@app.route('/dbproj/admin/reference_data/reload', methods=['POST'])
+@token_required
+def reload_reference_data():
+    # Forçar a releitura dos dados de referência deste processo (apenas admin);
+    # os outros workers recarregam ao receber a notificação dos triggers
+    if flask.g.role != 'admin':
+        return flask.jsonify({'status': StatusCodes['unauthorized'], 'errors': 'Only admin can access this endpoint', 'results': None})
+
+    if not app.config['REFERENCE_DATA_CACHE']:
+        return flask.jsonify({'status': StatusCodes['api_error'], 'errors': 'Reference data cache is disabled', 'results': None})
+
+    with db_connection() as conn:
+        cur = conn.cursor()
+
+        try:
+            get_reference_data(cur, force=True)
+            conn.rollback()
+            response = {'status': StatusCodes['success'], 'errors': None, 'results': reference_data_summary()}
+
+        except (Exception, psycopg2.DatabaseError) as error:
+            conn.rollback()
+            logger.error(f'Reload reference data error: {error}')
+            response = {'status': StatusCodes['internal_error'], 'errors': str(error), 'results': None}
 
     return flask.jsonify(response)
 
 
 def initialize_database():
     """Execute the initialization SQL script"""
-    try:
-        conn = db_connection()
-        cur = conn.cursor()
-        
-        # Read and execute the SQL file
-        with open('init_database.sql', 'r') as file:
-            sql_commands = file.read()
-            cur.execute(sql_commands)
-        
-        conn.commit()
-        print("Database initialized successfully!")
-        
-    except Exception as error:
-        print(f"Database initialization failed: {error}")
-        if conn:
+    with db_connection() as conn:
+        try:
+            cur = conn.cursor()
+            
+            # Read and execute the SQL file
+            with open('init_database.sql', 'r') as file:
+                sql_commands = file.read()
+                cur.execute(sql_commands)
+            
+            conn.commit()
+            print("Database initialized successfully!")
+            
+        except Exception as error:
+            print(f"Database initialization failed: {error}")
             conn.rollback()
-    finally:
-        if conn:
-            conn.close()
+
+# Versão das tabelas mantidas por triggers (academic_record, rankings, relatório
+# mensal, resumo por edição). Quando a guardada em cache_version é menor, as
+# tabelas são reconstruídas a partir das notas existentes; incrementar quando
+# uma alteração aos triggers obriga a recalculá-las.
+DERIVED_TABLES_VERSION = 2   # 2: degree_year_average
+
+DERIVED_TABLES_REBUILDS = [
+    'rebuild_academic_records',
+    'rebuild_grade_rankings',
+    'rebuild_monthly_stats',
+    'rebuild_course_edition_summary'
+]
 
 # No seu código Python, antes de criar triggers:
 def create_triggers():
-    try:
-        conn = db_connection()
-        cur = conn.cursor()
-        
-        # Verificar se os triggers já existem
-        cur.execute("""
-            SELECT COUNT(*) 
-            FROM information_schema.triggers 
-            WHERE trigger_name IN ('trigger_after_degree_enrollment', 'trigger_after_grade_update')
-        """)
-        
-        trigger_count = cur.fetchone()[0]
-        if trigger_count >= 2:
-            print("Triggers already exist, skipping creation")
-            return
-            
-        # Se não existirem, executar o script SQL
-        with open('triggers.sql', 'r') as file:
-            sql_commands = file.read()
-            cur.execute(sql_commands)
+    with db_connection() as conn:
+        try:
+            cur = conn.cursor()
+
+            # Os scripts são idempotentes e correm sempre: migrations.sql acrescenta
+            # a uma base de dados existente as colunas e tabelas de que os triggers
+            # precisam, triggers.sql (CREATE OR REPLACE / DROP ... IF EXISTS) as
+            # functions e triggers acrescentados depois de ter sido criada
+            for script in ('migrations.sql', 'triggers.sql'):
+                with open(script, 'r', encoding='utf-8') as file:
+                    cur.execute(file.read())
+
+            # Acertar os contadores de lugares com as inscrições que já existiam
+            # (feitas antes destes triggers ou por fora da API)
+            cur.execute("SELECT rebuild_course_seats()")
+
+            # Preencher as tabelas derivadas uma vez por versão
+            cur.execute("SELECT version FROM cache_version WHERE name = 'derived_tables'")
+            row = cur.fetchone()
+            if row is None or row[0] < DERIVED_TABLES_VERSION:
+                for function in DERIVED_TABLES_REBUILDS:
+                    cur.execute(f'SELECT {function}()')
+                cur.execute("""
+                    INSERT INTO cache_version (name, version) VALUES ('derived_tables', %s)
+                    ON CONFLICT (name) DO UPDATE SET version = EXCLUDED.version
+                """, (DERIVED_TABLES_VERSION,))
         
-        conn.commit()
-        print("Triggers created successfully!")
+            conn.commit()
+            print("Triggers created successfully!")
         
-    except Exception as error:
-        print(f"Error creating triggers: {error}")
+        except Exception as error:
+            conn.rollback()
+            print(f"Error creating triggers: {error}")
 
 if __name__ == '__main__':
     #logging config at top
@@ -1040,11 +3379,19 @@ if __name__ == '__main__':
     # initialize the database (create tables, triggers, etc.)
     initialize_database()
     create_triggers()
+    if app.config['STUDENT_SOFT_DELETE']:
+        start_student_purge_worker()
+    start_reference_listener()
+    start_financial_compaction_worker()
+    if app.config['ENROLL_QUEUE_MODE']:
+        start_enrollment_workers()
+    get_password_pool()
 
     host = '127.0.0.1'
     #host = '192.168.x.x'  # change to your IP if needed
     port = 5000 #normal port for Flask apps
     #app.run(host=host, port=port, debug=True)
+    # Servidor de desenvolvimento (um processo); em produção usar wsgi.py
     app.run(debug=False)
     #app.run(host=host, debug=True, threaded=True, port=port)
     #logger.info(f'API stubs online: http://{host}:{port}')
@@ -0,0 +1,1379 @@
+##
+## Async (ASGI) variant of the API
+##
+## The same routes, token_required semantics and responses as demoApi, on
+## Quart with psycopg 3 and an AsyncConnectionPool. A request waiting for the
+## database is a suspended coroutine instead of a blocked thread, so a single
+## process can keep hundreds of enrollments and report queries in flight while
+## the pool bounds the number of database connections:
+##
+##   hypercorn demoApiAsync:app --bind 127.0.0.1:5001
+##   uvicorn demoApiAsync:app --port 5001           (equivalent)
+##
+## The SQL, the caches, the JSON serializer and the configuration (app.config
+## of demoApi) are shared with demoApi; only the database access is async.
+## Not available here: the enrollment queue (ENROLL_QUEUE_MODE and its ticket
+## and stats routes), the student purge (worker and admin routes; students
+## soft-deleted here are purged by the sync app's worker) and the financial
+## ledger compaction (worker and admin route), which are served by the sync app.
+##
+
+import asyncio
+import time
+import uuid
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta
+from functools import wraps
+
+import jwt
+import passwords
+import psycopg
+import psycopg_pool
+from psycopg.conninfo import make_conninfo
+from psycopg.pq import TransactionStatus
+from quart import Quart, Response, g, jsonify, request
+from quart.json.provider import DefaultJSONProvider
+
+import demoApi
+from demoApi import (
+    StatusCodes, logger, authenticate, dumps_json, page_args,
+    student_details_cache, passed_courses_cache, token_cache, build_prerequisite_closure,
+    student_caches_usable, student_cache_generation, store_student_cache, invalidate_student_caches,
+    PASSED_COURSES_QUERY,
+    REFERENCE_TABLES, reference_key, reference_data_current, store_reference_data, reference_data_summary,
+    shared_query_cache, shared_query_stats,
+    financial_statement_query, financial_transaction_row,
+    PasswordHashBusy, password_hash_params,
+    STUDENT_DATA_TABLES, student_details_query, student_details_row, STUDENT_DETAILS_ROW_JSON,
+    degree_details_query, degree_details_row, DEGREE_DETAILS_ROW_JSON,
+    LEADERBOARD_QUERY, leaderboard_row, leaderboard_document_query,
+    TOP_BY_DISTRICT_QUERY, TOP_BY_DISTRICT_ROW_JSON, top_by_district_row,
+    MONTHLY_REPORT_QUERY, MONTHLY_REPORT_ROW_JSON, monthly_report_row, report_months,
+    json_document_query, json_document
+)
+
+app = Quart(__name__)
+
+# Configuração partilhada com demoApi (mesmas chaves e valores por omissão)
+config = demoApi.app.config
+
+
+class AsyncJSONProvider(DefaultJSONProvider):
+    """Quart JSON provider backed by demoApi.dumps_json"""
+
+    def dumps(self, obj, **kwargs):
+        return dumps_json(obj)
+
+    def loads(self, s, **kwargs):
+        return demoApi.app.json.loads(s)
+
+
+app.json = AsyncJSONProvider(app)
+
+##########################################################
+## DATABASE ACCESS
+##########################################################
+
+# Um pool por processo, aberto quando o servidor arranca; AsyncClientCursor faz
+# a interpolação dos parâmetros do lado do cliente, como o psycopg2, por isso as
+# queries de demoApi (e.g., %(degree_id)s IS NULL) funcionam sem alterações
+db_pool = None
+
+
+@app.before_serving
+async def open_db_pool():
+    global db_pool
+    params = {('dbname' if key == 'database' else key): value for key, value in demoApi.DB_PARAMS.items()}
+    db_pool = psycopg_pool.AsyncConnectionPool(
+        make_conninfo(**params),
+        min_size=config['DB_POOL_MIN_SIZE'],
+        max_size=config['DB_POOL_MAX_SIZE'],
+        timeout=config['DB_POOL_TIMEOUT'],
+        check=psycopg_pool.AsyncConnectionPool.check_connection,
+        kwargs={'cursor_factory': psycopg.AsyncClientCursor},
+        open=False
+    )
+    await db_pool.open()
+    logger.info('Async database connection pool created')
+    demoApi.get_password_pool()
+    demoApi.start_reference_listener()
+
+
+@app.after_serving
+async def close_db_pool():
+    await db_pool.close()
+
+
+async def release_connection(conn):
+    # Não devolver ao pool uma transação aberta (e.g., return a meio de um endpoint)
+    if not conn.closed and conn.info.transaction_status != TransactionStatus.IDLE:
+        try:
+            await conn.rollback()
+        except psycopg.Error:
+            pass
+    await db_pool.putconn(conn)
+
+
+@asynccontextmanager
+async def db_connection():
+    """Borrow a pooled connection for the duration of the async with block"""
+    conn = await db_pool.getconn()
+    try:
+        yield conn
+    finally:
+        await release_connection(conn)
+
+##########################################################
+## AUTHENTICATION HELPERS
+##########################################################
+
+def token_required(f):
+    @wraps(f)
+    async def decorated(*args, **kwargs):
+        payload, error = authenticate(request.headers.get('Authorization'))
+        if error:
+            return jsonify({'status': StatusCodes['unauthorized'], 'errors': error, 'results': None}), 401
+        g.user_id = payload.get('user_id')
+        g.role = payload.get('role')
+        return await f(*args, **kwargs)
+    return decorated
+
+@app.errorhandler(psycopg_pool.PoolTimeout)
+async def handle_pool_timeout(error):
+    logger.error(f'Database pool exhausted: {error}')
+    return jsonify({'status': StatusCodes['service_unavailable'], 'errors': 'Server busy, try again later', 'results': None}), 503
+
+@app.errorhandler(PasswordHashBusy)
+async def handle_password_hash_busy(error):
+    logger.error(f'Password hashing pool busy: {error}')
+    return jsonify({'status': StatusCodes['service_unavailable'], 'errors': 'Too many logins in progress, try again later', 'results': None}), 503
+
+##########################################################
+## PASSWORDS
+##########################################################
+
+# O mesmo pool de processos e os mesmos limites de demoApi; aqui o resultado é
+# esperado sem bloquear o event loop
+async def run_password_job(func, *args):
+    """Run func(*args) in the password pool of demoApi and return its result"""
+    with demoApi.password_job_slot():
+        pool = demoApi.get_password_pool()
+        warmup = [asyncio.wrap_future(f) for f in demoApi.password_pool_warmup if not f.done()]
+        if warmup:
+            await asyncio.wait(warmup, timeout=config['PASSWORD_POOL_START_TIMEOUT'])
+        future = pool.submit(func, *args)
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(future), config['PASSWORD_HASH_TIMEOUT'])
+        except asyncio.TimeoutError:
+            raise PasswordHashBusy('Password check timed out')
+
+
+async def upgrade_password_hash(user_id, old_stored, password):
+    """Replace a legacy stored password by its hash; on failure it is retried at the next login"""
+    try:
+        hashed = await run_password_job(passwords.hash_password, password, *password_hash_params())
+        async with db_connection() as conn:
+            await conn.execute("UPDATE users SET password = %s WHERE user_id = %s AND password = %s",
+                               (hashed, user_id, old_stored))
+            await conn.commit()
+    except (PasswordHashBusy, psycopg_pool.PoolTimeout, psycopg.DatabaseError) as error:
+        logger.warning(f'Password hash upgrade of user {user_id} postponed: {error}')
+
+##########################################################
+## PREREQUISITES
+##########################################################
+
+# O fecho transitivo e a cache de cursos aprovados são os de demoApi; o lock é
+# um asyncio.Lock para que a reconstrução não bloqueie o event loop
+prerequisite_closure_lock = asyncio.Lock()
+
+
+async def get_prerequisite_closure(cur, version, force=False):
+    closure = demoApi.prerequisite_closure
+    if not force and closure['version'] == version and closure['version'] is not None:
+        return closure['closure']
+
+    async with prerequisite_closure_lock:
+        if not force and closure['version'] == version and closure['version'] is not None:
+            return closure['closure']
+
+        await cur.execute("SELECT course_code, prerequisite_code FROM course_prerequisites")
+        built, cycles = build_prerequisite_closure(await cur.fetchall())
+        if cycles:
+            logger.error(f'Prerequisite cycles detected for courses: {cycles}')
+
+        closure.update({'version': version, 'closure': built, 'cycles': cycles})
+        logger.info(f'Prerequisite closure rebuilt ({len(built)} courses, version {version})')
+        return built
+
+
+async def get_passed_courses(cur, student_id, fresh=False):
+    """Set of course codes the student has passed (grade >= 9.5), cached per student"""
+    usable = student_caches_usable()
+    passed = passed_courses_cache.get(student_id) if usable and not fresh else None
+    if passed is None:
+        generation = student_cache_generation()
+        await cur.execute(PASSED_COURSES_QUERY, (student_id,))
+        passed = frozenset(row[0] for row in await cur.fetchall())
+        if usable:
+            store_student_cache(passed_courses_cache, student_id, passed, generation)
+    return passed
+
+
+async def meets_prerequisites(cur, student_id, required):
+    if not required or required <= await get_passed_courses(cur, student_id):
+        return True
+    # Reler na transação da inscrição antes de recusar (ver demoApi.meets_prerequisites)
+    return required <= await get_passed_courses(cur, student_id, fresh=True)
+
+##########################################################
+## REFERENCE DATA
+##########################################################
+
+# As tabelas em memória, a geração e o listener (thread com conexão psycopg2
+# própria) são os de demoApi; só o carregamento usa o cursor async
+reference_data_lock = asyncio.Lock()
+
+
+async def get_reference_data(cur, force=False):
+    tables = reference_data_current()
+    if (tables is not None and not force) or not config['REFERENCE_DATA_CACHE']:
+        return tables
+
+    async with reference_data_lock:
+        tables = reference_data_current()
+        if tables is None or force:
+            generation = demoApi.reference_data_stats['generation']
+            rows = {}
+            for name, (load_query, _) in REFERENCE_TABLES.items():
+                await cur.execute(load_query)
+                rows[name] = await cur.fetchall()
+            tables = store_reference_data(generation, rows)
+        return tables
+
+
+async def reference_row(cur, table, value):
+    """Async version of demoApi.reference_row"""
+    key = reference_key(table, value)
+    if key is None:
+        return None
+
+    tables = await get_reference_data(cur)
+    if tables is not None and key in tables[table]:
+        return tables[table][key]
+
+    demoApi.reference_data_stats['fallback_lookups'] += 1
+    await cur.execute(REFERENCE_TABLES[table][1], (key,))
+    return await cur.fetchone()
+
+##########################################################
+## STUDENT PURGE
+##########################################################
+
+async def soft_delete_students(cur, student_ids):
+    """Mark the students as deleted and return the ids that were not already marked"""
+    await cur.execute("""
+        UPDATE student
+        SET deleted_at = CURRENT_TIMESTAMP
+        WHERE user_id = ANY(%s) AND deleted_at IS NULL
+        RETURNING user_id
+    """, (list(student_ids),))
+    return [row[0] for row in await cur.fetchall()]
+
+
+async def purge_students(cur, student_ids):
+    """Hard-delete the students' rows table by table; returns the row count per table"""
+    deleted = {}
+    for table, condition in STUDENT_DATA_TABLES:
+        await cur.execute(f'DELETE FROM {table} WHERE {condition}', (list(student_ids),))
+        deleted[table] = cur.rowcount
+    return deleted
+
+##########################################################
+## STREAMING AND POSTGRES JSON
+##########################################################
+
+def wants_stream():
+    return request.args.get('stream', '').lower() in ('1', 'true', 'yes')
+
+
+def json_text_response(text):
+    return Response(text, mimetype='application/json')
+
+
+async def fetch_json_document(cur, query, params, row_json, order_by, limit=None, key_json=None):
+    """JSON text of the response for query, assembled by Postgres (see demoApi.json_document_query)"""
+    await cur.execute(*json_document_query(query, params, row_json, order_by, limit, key_json))
+    return json_document(await cur.fetchone(), limit)
+
+
+async def stream_query(query, params, row_to_dict, label):
+    """Stream the rows of query as {"results": [...], "status": ..., "errors": ...}.
+
+    Same format as demoApi.stream_query. The connection is borrowed inside the
+    generator, so a response that is never sent (the client went away before
+    the body started) holds none; errors, pool timeouts included, are reported
+    in status and errors at the end of the object.
+    """
+    async def generate():
+        status, errors = StatusCodes['success'], None
+        yield '{"results": ['
+        try:
+            # Devolvida ao pool no fim do bloco, também quando o envio é cancelado
+            async with db_connection() as conn:
+                try:
+                    cur = conn.cursor(name=f'stream_{uuid.uuid4().hex}')
+                    await cur.execute(query, params)
+                    separator = ''
+                    while True:
+                        rows = await cur.fetchmany(config['STREAM_CHUNK_SIZE'])
+                        if not rows:
+                            break
+                        yield separator + ','.join(dumps_json(row_to_dict(row)) for row in rows)
+                        separator = ','
+                    await cur.close()
+                    await conn.commit()
+                except (Exception, psycopg.DatabaseError) as error:
+                    logger.error(f'{label} stream error: {error}')
+                    status, errors = StatusCodes['internal_error'], str(error)
+        except psycopg_pool.PoolTimeout as error:
+            logger.error(f'Database pool exhausted: {error}')
+            status, errors = StatusCodes['service_unavailable'], 'Server busy, try again later'
+        yield f'], "status": {status}, "errors": {dumps_json(errors)}}}'
+
+    return Response(generate(), mimetype='application/json')
+
+##########################################################
+## SHARED QUERIES
+##########################################################
+
+# Mesmo comportamento que em demoApi (SHARED_QUERY_CACHE, a mesma cache de
+# respostas); a execução partilhada é uma asyncio.Task por chave, à qual os
+# pedidos concorrentes esperam com shield para que um cliente que desliga não
+# a cancele para os outros (no máximo SHARED_QUERY_WAIT segundos, depois correm
+# a query eles próprios)
+shared_query_tasks = {}   # key -> Task em curso
+shared_query_flight = {'executions': 0, 'shared': 0, 'timeouts': 0}
+
+
+def shared_query_task(key, load):
+    """The running task for key, started with load() if there is none"""
+    task = shared_query_tasks.get(key)
+    if task is not None:
+        shared_query_flight['shared'] += 1
+        return task
+
+    task = shared_query_tasks[key] = asyncio.ensure_future(load())
+    task.add_done_callback(lambda _: shared_query_tasks.pop(key, None))
+    shared_query_flight['executions'] += 1
+    return task
+
+
+async def wait_shared_query(key, load):
+    """Result of the shared execution of load for key (see shared_query_task)"""
+    leader = key not in shared_query_tasks
+    task = shared_query_task(key, load)
+    if leader:
+        return await asyncio.shield(task)
+    try:
+        return await asyncio.wait_for(asyncio.shield(task), config['SHARED_QUERY_WAIT'])
+    except asyncio.TimeoutError:
+        shared_query_flight['timeouts'] += 1
+        return await load()
+
+
+async def shared_query(name, params, load):
+    """Async version of demoApi.shared_query (load is a coroutine function)"""
+    if not config['SHARED_QUERIES']:
+        return await load()
+
+    key = (name, config['PG_JSON_RESPONSES'], params)
+    ttl, stale = config['SHARED_QUERY_CACHE'].get(name, (0, 0))
+    if not ttl and not stale:
+        return await wait_shared_query(key, load)
+
+    async def load_and_cache():
+        response = await load()
+        if isinstance(response, str) or response['status'] == StatusCodes['success']:
+            shared_query_cache.set(key, (response, time.monotonic()), ttl=ttl + stale)
+        return response
+
+    entry = shared_query_cache.get(key)
+    if entry is None:
+        return await wait_shared_query(key, load_and_cache)
+
+    response, loaded_at = entry
+    if time.monotonic() - loaded_at >= ttl:
+        shared_query_stats['stale_served'] += 1
+        # Verificação e criação sem await pelo meio: uma só task por chave
+        if key not in shared_query_tasks:
+            shared_query_task(key, load_and_cache).add_done_callback(shared_query_revalidated)
+    return response
+
+
+def shared_query_revalidated(task):
+    if task.cancelled():
+        return
+    error = task.exception()
+    if error is not None:
+        shared_query_stats['revalidation_errors'] += 1
+        logger.error(f'Revalidate shared query error: {error}')
+    else:
+        shared_query_stats['revalidations'] += 1
+
+
+def shared_response(response):
+    if isinstance(response, str):
+        return json_text_response(response)
+    return jsonify(response)
+
+##########################################################
+## ENDPOINTS
+##########################################################
+
+async def request_json():
+    """JSON body of the request ({} if missing or invalid), None if it is not an object"""
+    data = await request.get_json(silent=True) or {}
+    return data if isinstance(data, dict) else None
+
+
+@app.route('/dbproj/user', methods=['PUT'])
+async def login_user():
+    data = await request_json()
+    if data is None:
+        return jsonify({'status': StatusCodes['api_error'], 'errors': 'Request body must be a JSON object', 'results': None})
+    username = data.get('username')
+    password = data.get('password')
+
+    if not username or not password:
+        return jsonify({'status': StatusCodes['api_error'], 'errors': 'Username and password are required', 'results': None})
+    if not isinstance(password, str):
+        return jsonify({'status': StatusCodes['api_error'], 'errors': 'Password must be a string', 'results': None})
+
+    try:
+        async with db_connection() as conn:
+            cur = conn.cursor()
+            await cur.execute("""
+                SELECT u.user_id, u.role, u.password
+                FROM users u
+                LEFT JOIN student s ON s.user_id = u.user_id
+                WHERE u.username = %s AND s.deleted_at IS NULL
+            """, (username,))
+            user = await cur.fetchone()
+    except psycopg.DatabaseError as error:
+        return jsonify({'status': StatusCodes['internal_error'], 'errors': str(error)})
+
+    if not user:
+        return jsonify({'status': StatusCodes['unauthorized'], 'errors': 'Invalid credentials', 'results': None})
+
+    matches, needs_rehash = await run_password_job(passwords.verify_password, password, user[2], *password_hash_params())
+    if not matches:
+        return jsonify({'status': StatusCodes['unauthorized'], 'errors': 'Invalid credentials', 'results': None})
+
+    try:
+        if needs_rehash:
+            await upgrade_password_hash(user[0], user[2], password)
+
+        token = jwt.encode({
+            'user_id': user[0],
+            'role': user[1],
+            'exp': datetime.utcnow() + timedelta(hours=24)
+        }, config['JWT_SECRET_KEY'], algorithm='HS256')
+
+        response = {'status': StatusCodes['success'], 'errors': None, 'results': token}
+        logger.info(f'User {username} logged in successfully')
+
+    except Exception as error:
+        response = {'status': StatusCodes['internal_error'], 'errors': str(error)}
+
+    return jsonify(response)
+
+
+async def register_user(role, label):
+    """Insert into users and into the role's table; the body of the three register endpoints"""
+    data = await request_json()
+    if data is None:
+        return jsonify({'status': StatusCodes['api_error'], 'errors': 'Request body must be a JSON object', 'results': None})
+    username = data.get('username')
+    email = data.get('email')
+    password = data.get('password')
+    is_coordinator = data.get('is_coordinator', False)  # apenas para instructor
+
+    if not username or not email or not password:
+        return jsonify({'status': StatusCodes['api_error'], 'errors': 'Username, email, and password are required', 'results': None})
+    if not isinstance(password, str):
+        return jsonify({'status': StatusCodes['api_error'], 'errors': 'Password must be a string', 'results': None})
+
+    password = await run_password_job(passwords.hash_password, password, *password_hash_params())
+
+    async with db_connection() as conn:
+        cur = conn.cursor()
+
+        try:
+            await cur.execute("""
+                INSERT INTO users (username, password, email, role)
+                VALUES (%s, %s, %s, %s)
+                RETURNING user_id
+            """, (username, password, email, role))
+            user_id = (await cur.fetchone())[0]
+
+            if role == 'instructor':
+                await cur.execute("INSERT INTO instructor (user_id, is_coordinator) VALUES (%s, %s)", (user_id, is_coordinator))
+            elif role == 'admin':
+                await cur.execute("INSERT INTO admin (user_id) VALUES (%s)", (user_id,))
+            else:
+                await cur.execute("INSERT INTO student (user_id) VALUES (%s)", (user_id,))
+            await conn.commit()
+            response = {'status': StatusCodes['success'], 'errors': None, 'results': user_id}
+
+        except psycopg.IntegrityError:
+            await conn.rollback()
+            response = {'status': StatusCodes['api_error'], 'errors': 'Username already exists', 'results': None}
+        except (Exception, psycopg.DatabaseError) as error:
+            await conn.rollback()
+            logger.error(f'{label} error: {error}')
+            response = {'status': StatusCodes['internal_error'], 'errors': str(error), 'results': None}
+
+    return jsonify(response)
+
+
+@app.route('/dbproj/register/student', methods=['POST'])
+@token_required
+async def register_student():
+    if g.role != 'admin':
+        return jsonify({'status': StatusCodes['unauthorized'], 'errors': 'Only admin can register students', 'results': None})
+    return await register_user('student', 'Register student')
+
+
+@app.route('/dbproj/register/admin', methods=['POST'])
+@token_required
+async def register_admin():
+    if g.role != 'admin':
+        return jsonify({'status': StatusCodes['unauthorized'], 'errors': 'Only admin can register other admins', 'results': None})
+    return await register_user('admin', 'Register admin')
+
+
+@app.route('/dbproj/register/instructor', methods=['POST'])
+@token_required
+async def register_instructor():
+    if g.role != 'admin':
+        return jsonify({'status': StatusCodes['unauthorized'], 'errors': 'Only admin can register instructors', 'results': None})
+    return await register_user('instructor', 'Register instructor')
+
+
+@app.route('/dbproj/enroll_degree/<degree_id>', methods=['POST'])
+@token_required
+async def enroll_degree(degree_id):
+    if g.role != 'admin':
+        return jsonify({'status': StatusCodes['unauthorized'], 'errors': 'Only admin can enroll students in degrees', 'results': None})
+
+    data = await request_json()
+    if data is None:
+        return jsonify({'status': StatusCodes['api_error'], 'errors': 'Request body must be a JSON object', 'results': None})
+    student_id = data.get('student_id')
+    date = data.get('date')  # Data de matrícula
+
+    if not student_id or not date:
+        return jsonify({'status': StatusCodes['api_error'], 'errors': 'Student ID and date are required', 'results': None})
+
+    async with db_connection() as conn:
+        cur = conn.cursor()
+
+        try:
+            await cur.execute("SELECT 1 FROM student WHERE user_id = %s AND deleted_at IS NULL", (student_id,))
+            if not await cur.fetchone():
+                return jsonify({'status': StatusCodes['api_error'], 'errors': 'Student does not exist', 'results': None})
+
+            if not await reference_row(cur, 'degrees', degree_id):
+                return jsonify({'status': StatusCodes['api_error'], 'errors': 'Degree program does not exist', 'results': None})
+
+            await cur.execute("SELECT 1 FROM degree_enrollment WHERE student_id = %s AND degree_id = %s", (student_id, degree_id))
+            if await cur.fetchone():
+                return jsonify({'status': StatusCodes['api_error'], 'errors': 'Student is already enrolled in this degree', 'results': None})
+
+            # O trigger cria a financial_account e a dívida da propina
+            await cur.execute("""
+                INSERT INTO degree_enrollment (student_id, degree_id, enrollment_date)
+                VALUES (%s, %s, %s)
+            """, (student_id, degree_id, date))
+
+            await conn.commit()
+            response = {'status': StatusCodes['success'], 'errors': None}
+
+        except psycopg.IntegrityError as e:
+            await conn.rollback()
+            response = {'status': StatusCodes['api_error'], 'errors': 'Integrity error: ' + str(e), 'results': None}
+        except (Exception, psycopg.DatabaseError) as error:
+            await conn.rollback()
+            logger.error(f'Enroll degree error: {error}')
+            response = {'status': StatusCodes['internal_error'], 'errors': str(error), 'results': None}
+
+    return jsonify(response)
+
+
+@app.route('/dbproj/enroll_activity/<activity_id>', methods=['POST'])
+@token_required
+async def enroll_activity(activity_id):
+    if g.role != 'student':
+        return jsonify({'status': StatusCodes['unauthorized'], 'errors': 'Only students can enroll in activities', 'results': None})
+    current_user_id = g.user_id
+
+    async with db_connection() as conn:
+        cur = conn.cursor()
+
+        try:
+            activity = await reference_row(cur, 'activities', activity_id)
+            if not activity:
+                return jsonify({'status': StatusCodes['api_error'], 'errors': 'Activity does not exist', 'results': None})
+
+            await cur.execute("SELECT 1 FROM activity_participation WHERE student_id = %s AND activity_id = %s", (current_user_id, activity_id))
+            if await cur.fetchone():
+                return jsonify({'status': StatusCodes['api_error'], 'errors': 'Student is already enrolled in this activity', 'results': None})
+
+            await cur.execute("""
+                INSERT INTO activity_participation (student_id, activity_id, registration_date)
+                VALUES (%s, %s, CURRENT_DATE)
+            """, (current_user_id, activity_id))
+
+            # Nova transação no ledger (ver demoApi FINANCIAL LEDGER)
+            await cur.execute("SELECT post_financial_transaction(%s, %s, %s, %s, NULL)",
+                              (current_user_id, activity[1], f'Activity fee: {activity[0]}', activity_id))
+
+            await conn.commit()
+            response = {'status': StatusCodes['success'], 'errors': None}
+
+        except psycopg.IntegrityError:
+            await conn.rollback()
+            response = {'status': StatusCodes['api_error'], 'errors': 'Database integrity error', 'results': None}
+        except (Exception, psycopg.DatabaseError) as error:
+            await conn.rollback()
+            logger.error(f'Enroll activity error: {error}')
+            response = {'status': StatusCodes['internal_error'], 'errors': str(error), 'results': None}
+
+    return jsonify(response)
+
+
+async def enroll_in_course_edition(cur, student_id, course_edition_id, classes):
+    """Async version of demoApi.enroll_in_course_edition (same steps, same messages)"""
+    edition = await reference_row(cur, 'editions', course_edition_id)
+    if not edition:
+        return 'Course edition does not exist'
+
+    course_code, year, capacity, coordinator_id = edition
+
+    await cur.execute("""
+        SELECT ce.enrolled_count,
+               s.user_id IS NULL OR s.deleted_at IS NOT NULL,
+               EXISTS (SELECT 1 FROM course_enrollment WHERE student_id = s.user_id AND edition_id = ce.edition_id),
+               (SELECT version FROM cache_version WHERE name = 'course_prerequisites') AS prerequisites_version
+        FROM course_edition ce
+        LEFT JOIN student s ON s.user_id = %(student_id)s
+        WHERE ce.edition_id = %(edition_id)s
+    """, {'student_id': student_id, 'edition_id': reference_key('editions', course_edition_id)})
+
+    edition_info = await cur.fetchone()
+    if not edition_info:
+        return 'Course edition does not exist'
+
+    enrolled_count, student_missing, already_enrolled, prerequisites_version = edition_info
+
+    if enrolled_count >= capacity:
+        return 'Course edition is full'
+    if student_missing:
+        return 'Student does not exist'
+    if already_enrolled:
+        return 'Student is already enrolled in this course edition'
+
+    required = (await get_prerequisite_closure(cur, prerequisites_version or 0)).get(course_code)
+    if not await meets_prerequisites(cur, student_id, required):
+        return 'Student does not meet course prerequisites'
+
+    for class_id in classes:
+        await cur.execute("""
+            SELECT 1 FROM class
+            WHERE class_id = %s AND edition_id = %s
+        """, (class_id, course_edition_id))
+
+        if not await cur.fetchone():
+            return f'Class {class_id} does not belong to course edition {course_edition_id}'
+
+        await cur.execute("""
+            INSERT INTO student_class (student_id, class_id)
+            VALUES (%s, %s)
+        """, (student_id, class_id))
+
+    # Inscrição no fim: o trigger reserva o lugar e falha se a edition está cheia (ver demoApi)
+    try:
+        await cur.execute("""
+            INSERT INTO course_enrollment (student_id, edition_id)
+            VALUES (%s, %s)
+        """, (student_id, course_edition_id))
+    except psycopg.errors.CheckViolation:
+        return 'Course edition is full'
+
+    return None
+
+
+@app.route('/dbproj/enroll_course_edition/<course_edition_id>', methods=['POST'])
+@token_required
+async def enroll_course_edition(course_edition_id):
+    if g.role != 'student':
+        return jsonify({'status': StatusCodes['unauthorized'], 'errors': 'Only students can enroll in courses', 'results': None})
+    current_user_id = g.user_id
+
+    try:
+        course_edition_id = int(course_edition_id)
+    except ValueError:
+        return jsonify({'status': StatusCodes['api_error'], 'errors': 'Invalid course edition ID', 'results': None})
+
+    data = await request_json()
+    if data is None:
+        return jsonify({'status': StatusCodes['api_error'], 'errors': 'Request body must be a JSON object', 'results': None})
+    classes = data.get('classes', [])
+
+    if not classes:
+        return jsonify({'status': StatusCodes['api_error'], 'errors': 'At least one class ID is required', 'results': None})
+    if not isinstance(classes, list) or not all(isinstance(i, int) and not isinstance(i, bool) for i in classes):
+        return jsonify({'status': StatusCodes['api_error'], 'errors': 'classes must be a list of integers', 'results': None})
+
+    # Sem modo em fila: as inscrições em espera são coroutines à espera do pool
+    async with db_connection() as conn:
+        cur = conn.cursor()
+
+        try:
+            error = await enroll_in_course_edition(cur, current_user_id, course_edition_id, classes)
+            if error:
+                await conn.rollback()
+                return jsonify({'status': StatusCodes['api_error'], 'errors': error, 'results': None})
+
+            await conn.commit()
+            invalidate_student_caches([current_user_id])
+            response = {'status': StatusCodes['success'], 'errors': None}
+
+        except psycopg.IntegrityError as e:
+            await conn.rollback()
+            response = {'status': StatusCodes['api_error'], 'errors': 'Integrity error: ' + str(e), 'results': None}
+        except (Exception, psycopg.DatabaseError) as error:
+            await conn.rollback()
+            logger.error(f'Enroll course edition error: {error}')
+            response = {'status': StatusCodes['internal_error'], 'errors': str(error), 'results': None}
+
+    return jsonify(response)
+
+
+@app.route('/dbproj/submit_grades/<course_edition_id>', methods=['POST'])
+@token_required
+async def submit_grades(course_edition_id):
+    current_user_id = g.user_id
+    if g.role != 'instructor':
+        return jsonify({'status': StatusCodes['unauthorized'], 'errors': 'Only instructors can submit grades', 'results': None})
+
+    data = await request_json()
+    if data is None:
+        return jsonify({'status': StatusCodes['api_error'], 'errors': 'Request body must be a JSON object', 'results': None})
+    period = data.get('period')
+    grades = data.get('grades', [])
+
+    if not period or not grades:
+        return jsonify({'status': StatusCodes['api_error'], 'errors': 'Evaluation period and grades are required', 'results': None})
+
+    async with db_connection() as conn:
+        cur = conn.cursor()
+
+        try:
+            edition = await reference_row(cur, 'editions', course_edition_id)
+            if not edition:
+                return jsonify({'status': StatusCodes['api_error'], 'errors': 'Course edition does not exist', 'results': None})
+            if edition[3] != current_user_id:
+                return jsonify({'status': StatusCodes['unauthorized'], 'errors': 'Only the course coordinator can submit grades', 'results': None})
+
+            rejected = []
+            valid_grades = {}  # student_id -> grade (a última entrada repetida prevalece)
+            for grade_data in grades:
+                if not isinstance(grade_data, (list, tuple)) or len(grade_data) != 2:
+                    rejected.append({'student_id': None, 'errors': f'Invalid grade entry {grade_data}'})
+                    continue
+
+                student_id, grade_value = grade_data
+                try:
+                    student_id = int(student_id)
+                except (TypeError, ValueError):
+                    rejected.append({'student_id': student_id, 'errors': 'Invalid student ID'})
+                    continue
+
+                if isinstance(grade_value, bool) or not isinstance(grade_value, (int, float)) or grade_value < 0 or grade_value > 20:
+                    rejected.append({'student_id': student_id, 'errors': f'Invalid grade for student {student_id}'})
+                    continue
+
+                valid_grades[student_id] = grade_value
+
+            updated_count = 0
+            if valid_grades:
+                # float para todos: o psycopg 3 adapta a lista a partir do tipo dos elementos
+                await cur.execute("""
+                    WITH submitted AS (
+                        SELECT *
+                        FROM unnest(%s::int[], %s::numeric[]) AS g(student_id, grade)
+                    ),
+                    updated AS (
+                        UPDATE course_enrollment ce
+                        SET grade = s.grade, evaluation_period = %s, evaluated_at = CURRENT_TIMESTAMP
+                        FROM submitted s
+                        WHERE ce.student_id = s.student_id AND ce.edition_id = %s
+                          AND NOT is_soft_deleted(ce.student_id)
+                        RETURNING ce.student_id
+                    )
+                    SELECT s.student_id, (u.student_id IS NOT NULL) AS applied
+                    FROM submitted s
+                    LEFT JOIN updated u ON u.student_id = s.student_id
+                """, (list(valid_grades.keys()), [float(grade) for grade in valid_grades.values()], period, course_edition_id))
+
+                for student_id, applied in await cur.fetchall():
+                    if applied:
+                        updated_count += 1
+                    else:
+                        rejected.append({'student_id': student_id, 'errors': f'Student {student_id} is not enrolled in this course edition'})
+
+            # Pauta tudo-ou-nada (ver demoApi)
+            if rejected or updated_count == 0:
+                await conn.rollback()
+                errors = rejected[0]['errors'] if rejected else 'No grades were submitted'
+                return jsonify({'status': StatusCodes['api_error'], 'errors': errors, 'results': {'updated': 0, 'rejected': rejected}})
+
+            await conn.commit()
+
+            invalidate_student_caches(valid_grades)
+
+            response = {'status': StatusCodes['success'], 'errors': None, 'results': {'updated': updated_count, 'rejected': rejected}}
+
+        except (Exception, psycopg.DatabaseError) as error:
+            await conn.rollback()
+            logger.error(f'Submit grades error: {error}')
+            response = {'status': StatusCodes['internal_error'], 'errors': str(error), 'results': None}
+
+    return jsonify(response)
+
+
+@app.route('/dbproj/student_details/<student_id>', methods=['GET'])
+@token_required
+async def student_details(student_id):
+    try:
+        student_id = int(student_id)
+    except ValueError:
+        return jsonify({'status': StatusCodes['api_error'], 'errors': 'Invalid student ID', 'results': None})
+    if g.role != 'admin' and g.user_id != student_id:
+        return jsonify({'status': StatusCodes['unauthorized'], 'errors': 'Permission denied', 'results': None})
+
+    try:
+        limit, after = page_args((int, int), request.args)
+    except ValueError as e:
+        return jsonify({'status': StatusCodes['api_error'], 'errors': str(e), 'results': None})
+
+    query, params = student_details_query(student_id, limit, after)
+
+    if wants_stream():
+        return await stream_query(query, {**params, 'limit': None}, student_details_row, 'Student details')
+
+    # A mesma cache que a app síncrona: só a primeira página com o limite por omissão
+    use_cache = after is None and limit == config['PAGE_DEFAULT_LIMIT'] and student_caches_usable()
+    if use_cache:
+        cached = student_details_cache.get(student_id)
+        if isinstance(cached, str):
+            return json_text_response(cached)
+        if cached is not None:
+            return jsonify({'status': StatusCodes['success'], 'errors': None, **cached})
+        generation = student_cache_generation()
+
+    async with db_connection() as conn:
+        cur = conn.cursor()
+
+        try:
+            if config['PG_JSON_RESPONSES']:
+                document = await fetch_json_document(cur, query, params, STUDENT_DETAILS_ROW_JSON,
+                                                     'course_year DESC, edition_id DESC', limit,
+                                                     'json_build_array(course_year, edition_id)')
+                if use_cache:
+                    store_student_cache(student_details_cache, student_id, document, generation)
+                return json_text_response(document)
+
+            await cur.execute(query, params)
+
+            courses = await cur.fetchall()
+            has_more = len(courses) > limit
+            courses = courses[:limit]
+
+            page = {
+                'results': [student_details_row(course) for course in courses],
+                'next_cursor': demoApi.encode_cursor((courses[-1][2], courses[-1][0])) if has_more else None
+            }
+            if use_cache:
+                store_student_cache(student_details_cache, student_id, page, generation)
+            response = {'status': StatusCodes['success'], 'errors': None, **page}
+
+        except (Exception, psycopg.DatabaseError) as error:
+            logger.error(f'Student details error: {error}')
+            response = {'status': StatusCodes['internal_error'], 'errors': str(error), 'results': None}
+
+    return jsonify(response)
+
+
+@app.route('/dbproj/degree_details/<degree_id>', methods=['GET'])
+@token_required
+async def degree_details(degree_id):
+    if g.role != 'admin':
+        return jsonify({'status': StatusCodes['unauthorized'], 'errors': 'Only admin can view degree details', 'results': None})
+
+    try:
+        limit, after = page_args((int, str, int), request.args)
+    except ValueError as e:
+        return jsonify({'status': StatusCodes['api_error'], 'errors': str(e), 'results': None})
+
+    query, params = degree_details_query(degree_id, limit, after)
+
+    if wants_stream():
+        return await stream_query(query, {**params, 'limit': None}, degree_details_row, 'Degree details')
+
+    async def load():
+        async with db_connection() as conn:
+            cur = conn.cursor()
+
+            try:
+                if config['PG_JSON_RESPONSES']:
+                    return await fetch_json_document(
+                        cur, query, params, DEGREE_DETAILS_ROW_JSON,
+                        'course_edition_year DESC, course_id, course_edition_id', limit,
+                        'json_build_array(course_edition_year, course_id, course_edition_id)')
+
+                await cur.execute(query, params)
+
+                degree_courses = await cur.fetchall()
+                has_more = len(degree_courses) > limit
+                degree_courses = degree_courses[:limit]
+
+                last = degree_courses[-1] if has_more else None
+                return {
+                    'status': StatusCodes['success'],
+                    'errors': None,
+                    'results': [degree_details_row(course) for course in degree_courses],
+                    'next_cursor': demoApi.encode_cursor((last[3], last[0], last[2])) if last else None
+                }
+
+            except (Exception, psycopg.DatabaseError) as error:
+                logger.error(f'Degree details error: {error}')
+                return {'status': StatusCodes['internal_error'], 'errors': str(error), 'results': None}
+
+    return shared_response(await shared_query('degree_details', (degree_id, limit, tuple(after or ())), load))
+
+
+@app.route('/dbproj/financial_statement/<student_id>', methods=['GET'])
+@token_required
+async def financial_statement(student_id):
+    try:
+        student_id = int(student_id)
+    except ValueError:
+        return jsonify({'status': StatusCodes['api_error'], 'errors': 'Invalid student ID', 'results': None})
+    if g.role != 'admin' and g.user_id != student_id:
+        return jsonify({'status': StatusCodes['unauthorized'], 'errors': 'Permission denied', 'results': None})
+
+    try:
+        limit, after = page_args((int,), request.args)
+    except ValueError as e:
+        return jsonify({'status': StatusCodes['api_error'], 'errors': str(e), 'results': None})
+
+    query, params = financial_statement_query(student_id, limit, after)
+
+    async with db_connection() as conn:
+        cur = conn.cursor()
+
+        try:
+            await cur.execute(query, params)
+            rows = await cur.fetchall()
+            await conn.commit()
+            if not rows:
+                return jsonify({'status': StatusCodes['api_error'], 'errors': 'Student has no financial account', 'results': None})
+
+            transactions = [r for r in rows if r[1] is not None]
+            has_more = len(transactions) > limit
+            transactions = transactions[:limit]
+
+            response = {
+                'status': StatusCodes['success'],
+                'errors': None,
+                'results': {
+                    'balance': rows[0][0],
+                    'transactions': [financial_transaction_row(r) for r in transactions]
+                },
+                'next_cursor': demoApi.encode_cursor((transactions[-1][1],)) if has_more else None
+            }
+
+        except (Exception, psycopg.DatabaseError) as error:
+            await conn.rollback()
+            logger.error(f'Financial statement error: {error}')
+            response = {'status': StatusCodes['internal_error'], 'errors': str(error), 'results': None}
+
+    return jsonify(response)
+
+
+async def load_leaderboard(label, year, degree_id=None, n=3, with_student_id=True):
+    """Body of leaderboard and top3 (response dict, or JSON text with PG_JSON_RESPONSES)"""
+    async with db_connection() as conn:
+        cur = conn.cursor()
+        try:
+            if config['PG_JSON_RESPONSES']:
+                await cur.execute(*leaderboard_document_query(year, degree_id, n, with_student_id))
+                return (await cur.fetchone())[0]
+
+            await cur.execute(LEADERBOARD_QUERY, {'year': year, 'degree_id': degree_id, 'n': n})
+            results = [leaderboard_row(r) for r in await cur.fetchall()]
+            if not with_student_id:
+                for result in results:
+                    del result['student_id']
+
+            await conn.commit()
+            return {'status': StatusCodes['success'], 'errors': None, 'results': results}
+
+        except (Exception, psycopg.DatabaseError) as error:
+            logger.error(f'{label} error: {error}')
+            await conn.rollback()
+            return {'status': StatusCodes['internal_error'], 'errors': str(error), 'results': None}
+
+
+@app.route('/dbproj/leaderboard', methods=['GET'])
+@token_required
+async def leaderboard():
+    if g.role != 'admin':
+        return jsonify({'status': StatusCodes['unauthorized'], 'errors': 'Only admin can access this endpoint', 'results': None})
+
+    try:
+        year = int(request.args.get('year', config['LEADERBOARD_DEFAULT_YEAR']))
+        degree_id = request.args.get('degree_id')
+        degree_id = int(degree_id) if degree_id else None
+        n = int(request.args.get('n', 3))
+    except ValueError:
+        return jsonify({'status': StatusCodes['api_error'], 'errors': 'year, degree_id and n must be integers', 'results': None})
+
+    if n < 1 or n > config['LEADERBOARD_MAX_N']:
+        return jsonify({'status': StatusCodes['api_error'], 'errors': f'n must be between 1 and {config["LEADERBOARD_MAX_N"]}', 'results': None})
+
+    return shared_response(await load_leaderboard('Leaderboard', year, degree_id, n))
+
+
+@app.route('/dbproj/top3', methods=['GET'])
+@token_required
+async def top3_students():
+    if g.role != 'admin':
+        return jsonify({'status': StatusCodes['unauthorized'], 'errors': 'Only admin can access this endpoint', 'results': None})
+
+    year = config['LEADERBOARD_DEFAULT_YEAR']
+
+    async def load():
+        return await load_leaderboard('Top3', year, n=3, with_student_id=False)
+
+    return shared_response(await shared_query('top3', (year,), load))
+
+
+@app.route('/dbproj/top_by_district', methods=['GET'])
+@token_required
+async def top_by_district():
+    if g.role != 'admin':
+        return jsonify({'status': StatusCodes['unauthorized'], 'errors': 'Only admin can access this endpoint', 'results': None})
+
+    async def load():
+        async with db_connection() as conn:
+            cur = conn.cursor()
+            try:
+                if config['PG_JSON_RESPONSES']:
+                    return await fetch_json_document(
+                        cur, TOP_BY_DISTRICT_QUERY, {}, TOP_BY_DISTRICT_ROW_JSON,
+                        'average_grade DESC, district, student_id')
+
+                await cur.execute(TOP_BY_DISTRICT_QUERY)
+                results = [top_by_district_row(r) for r in await cur.fetchall()]
+
+                await conn.commit()
+                return {'status': StatusCodes['success'], 'errors': None, 'results': results}
+
+            except (Exception, psycopg.DatabaseError) as error:
+                logger.error(f'Top by district error: {error}')
+                await conn.rollback()
+                return {'status': StatusCodes['internal_error'], 'errors': str(error), 'results': None}
+
+    return shared_response(await shared_query('top_by_district', (), load))
+
+
+@app.route('/dbproj/report', methods=['GET'])
+@token_required
+async def monthly_report():
+    if g.role != 'admin':
+        return jsonify({'status': StatusCodes['unauthorized'], 'errors': 'Only admin can access this endpoint', 'results': None})
+
+    try:
+        start, end = report_months(request.args)
+    except ValueError as e:
+        return jsonify({'status': StatusCodes['api_error'], 'errors': str(e), 'results': None})
+    params = {'start': start, 'end': end}
+
+    if wants_stream():
+        return await stream_query(MONTHLY_REPORT_QUERY, params, monthly_report_row, 'Monthly report')
+
+    async def load():
+        async with db_connection() as conn:
+            cur = conn.cursor()
+            try:
+                if config['PG_JSON_RESPONSES']:
+                    return await fetch_json_document(
+                        cur, MONTHLY_REPORT_QUERY, params, MONTHLY_REPORT_ROW_JSON, 'month DESC')
+
+                await cur.execute(MONTHLY_REPORT_QUERY, params)
+                results = [monthly_report_row(r) for r in await cur.fetchall()]
+
+                await conn.commit()
+                return {'status': StatusCodes['success'], 'errors': None, 'results': results}
+
+            except (Exception, psycopg.DatabaseError) as error:
+                logger.error(f'Monthly report error: {error}')
+                await conn.rollback()
+                return {'status': StatusCodes['internal_error'], 'errors': str(error), 'results': None}
+
+    return shared_response(await shared_query('report', (start, end), load))
+
+
+def delete_mode():
+    return request.args.get('mode', 'soft' if config['STUDENT_SOFT_DELETE'] else 'hard')
+
+
+@app.route('/dbproj/delete_details/<student_id>', methods=['DELETE'])
+@token_required
+async def delete_student(student_id):
+    if g.role != 'admin':
+        return jsonify({'status': StatusCodes['unauthorized'], 'errors': 'Only admin can delete student data', 'results': None})
+
+    try:
+        student_id = int(student_id)
+    except ValueError:
+        return jsonify({'status': StatusCodes['api_error'], 'errors': 'Invalid student ID', 'results': None})
+
+    mode = delete_mode()
+    if mode not in ('soft', 'hard'):
+        return jsonify({'status': StatusCodes['api_error'], 'errors': 'mode must be soft or hard', 'results': None})
+
+    async with db_connection() as conn:
+        cur = conn.cursor()
+
+        try:
+            await cur.execute("SELECT deleted_at IS NOT NULL FROM student WHERE user_id = %s FOR UPDATE", (student_id,))
+            row = await cur.fetchone()
+            if not row:
+                await conn.rollback()
+                return jsonify({'status': StatusCodes['api_error'], 'errors': 'Student does not exist', 'results': None})
+            already_deleted = row[0]
+
+            if mode == 'soft':
+                if already_deleted:
+                    await conn.rollback()
+                    return jsonify({'status': StatusCodes['api_error'], 'errors': 'Student is already deleted', 'results': None})
+                await soft_delete_students(cur, [student_id])
+                message = 'Student marked as deleted, data will be purged in the background'
+            elif already_deleted:
+                await purge_students(cur, [student_id])
+                message = 'Student data deleted successfully'
+            else:
+                await cur.execute("DELETE FROM users WHERE user_id = %s AND role = 'student'", (student_id,))
+                message = 'Student data deleted successfully'
+
+            await conn.commit()
+            invalidate_student_caches([student_id])
+            response = {'status': StatusCodes['success'], 'errors': None, 'results': message}
+
+        except psycopg.IntegrityError as e:
+            await conn.rollback()
+            response = {'status': StatusCodes['api_error'], 'errors': f'Integrity error: {str(e)}', 'results': None}
+        except (Exception, psycopg.DatabaseError) as error:
+            await conn.rollback()
+            logger.error(f'Delete student error: {error}')
+            response = {'status': StatusCodes['internal_error'], 'errors': str(error), 'results': None}
+
+    return jsonify(response)
+
+
+@app.route('/dbproj/delete_details/bulk', methods=['POST'])
+@token_required
+async def delete_students_bulk():
+    if g.role != 'admin':
+        return jsonify({'status': StatusCodes['unauthorized'], 'errors': 'Only admin can delete student data', 'results': None})
+
+    data = await request_json()
+    if data is None:
+        return jsonify({'status': StatusCodes['api_error'], 'errors': 'Request body must be a JSON object', 'results': None})
+    student_ids = data.get('student_ids')
+    degree_id = data.get('degree_id')
+    enrolled_before = data.get('enrolled_before')  # YYYY-MM-DD
+
+    if not student_ids and not degree_id and not enrolled_before:
+        return jsonify({'status': StatusCodes['api_error'], 'errors': 'student_ids or a filter (degree_id, enrolled_before) is required', 'results': None})
+    if student_ids is not None and (not isinstance(student_ids, list) or not all(isinstance(i, int) for i in student_ids)):
+        return jsonify({'status': StatusCodes['api_error'], 'errors': 'student_ids must be a list of integers', 'results': None})
+
+    mode = delete_mode()
+    if mode not in ('soft', 'hard'):
+        return jsonify({'status': StatusCodes['api_error'], 'errors': 'mode must be soft or hard', 'results': None})
+
+    async with db_connection() as conn:
+        cur = conn.cursor()
+
+        try:
+            await cur.execute("""
+                SELECT u.user_id
+                FROM users u
+                WHERE u.role = 'student'
+                  AND (%(ids)s::int[] IS NULL OR u.user_id = ANY(%(ids)s::int[]))
+                  AND ((%(degree_id)s::int IS NULL AND %(before)s::date IS NULL) OR EXISTS (
+                      SELECT 1 FROM degree_enrollment de
+                      WHERE de.student_id = u.user_id
+                        AND (%(degree_id)s::int IS NULL OR de.degree_id = %(degree_id)s::int)
+                        AND (%(before)s::date IS NULL OR de.enrollment_date < %(before)s::date)
+                  ))
+                ORDER BY u.user_id
+                FOR UPDATE
+            """, {'ids': student_ids, 'degree_id': degree_id, 'before': enrolled_before})
+            targets = [row[0] for row in await cur.fetchall()]
+
+            if not targets:
+                await conn.rollback()
+                return jsonify({'status': StatusCodes['api_error'], 'errors': 'No matching students', 'results': None})
+
+            if mode == 'soft':
+                results = {'students': targets, 'marked': await soft_delete_students(cur, targets)}
+            else:
+                results = {'students': targets, 'deleted': await purge_students(cur, targets)}
+
+            await conn.commit()
+            invalidate_student_caches(targets)
+            response = {'status': StatusCodes['success'], 'errors': None, 'results': results}
+
+        except psycopg.IntegrityError as e:
+            await conn.rollback()
+            response = {'status': StatusCodes['api_error'], 'errors': f'Integrity error: {str(e)}', 'results': None}
+        except (Exception, psycopg.DatabaseError) as error:
+            await conn.rollback()
+            logger.error(f'Bulk delete students error: {error}')
+            response = {'status': StatusCodes['internal_error'], 'errors': str(error), 'results': None}
+
+    return jsonify(response)
+
+
+@app.route('/dbproj/admin/pool_stats', methods=['GET'])
+@token_required
+async def pool_stats():
+    # Estatísticas do AsyncConnectionPool deste processo (apenas admin)
+    if g.role != 'admin':
+        return jsonify({'status': StatusCodes['unauthorized'], 'errors': 'Only admin can access this endpoint', 'results': None})
+
+    return jsonify({'status': StatusCodes['success'], 'errors': None, 'results': db_pool.get_stats()})
+
+
+@app.route('/dbproj/admin/cache_stats', methods=['GET'])
+@token_required
+async def cache_stats():
+    if g.role != 'admin':
+        return jsonify({'status': StatusCodes['unauthorized'], 'errors': 'Only admin can access this endpoint', 'results': None})
+
+    results = {
+        'student_details': student_details_cache.stats(),
+        'passed_courses': passed_courses_cache.stats(),
+        'student_data': demoApi.student_cache_stats,
+        'tokens': token_cache.stats(),
+        'reference_data': reference_data_summary(),
+        'shared_queries': {
+            **shared_query_flight,
+            'in_flight': len(shared_query_tasks),
+            **shared_query_stats,
+            'cache': shared_query_cache.stats()
+        }
+    }
+    return jsonify({'status': StatusCodes['success'], 'errors': None, 'results': results})
+
+
+@app.route('/dbproj/admin/degree_summary/rebuild', methods=['POST'])
+@token_required
+async def rebuild_degree_summary():
+    if g.role != 'admin':
+        return jsonify({'status': StatusCodes['unauthorized'], 'errors': 'Only admin can access this endpoint', 'results': None})
+
+    async with db_connection() as conn:
+        cur = conn.cursor()
+
+        try:
+            await cur.execute("SELECT rebuild_course_seats()")
+            await cur.execute("SELECT rebuild_course_edition_summary()")
+            await cur.execute("SELECT COUNT(*) FROM course_edition_summary")
+            editions = (await cur.fetchone())[0]
+            await conn.commit()
+            response = {'status': StatusCodes['success'], 'errors': None, 'results': {'editions': editions}}
+
+        except (Exception, psycopg.DatabaseError) as error:
+            await conn.rollback()
+            logger.error(f'Rebuild degree summary error: {error}')
+            response = {'status': StatusCodes['internal_error'], 'errors': str(error), 'results': None}
+
+    return jsonify(response)
+
+
+@app.route('/dbproj/admin/prerequisites/rebuild', methods=['POST'])
+@token_required
+async def rebuild_prerequisites():
+    if g.role != 'admin':
+        return jsonify({'status': StatusCodes['unauthorized'], 'errors': 'Only admin can access this endpoint', 'results': None})
+
+    async with db_connection() as conn:
+        cur = conn.cursor()
+
+        try:
+            await cur.execute("SELECT version FROM cache_version WHERE name = 'course_prerequisites'")
+            row = await cur.fetchone()
+            closure = await get_prerequisite_closure(cur, row[0] if row else 0, force=True)
+            passed_courses_cache.clear()
+
+            results = {
+                'courses': len(closure),
+                'cycles': demoApi.prerequisite_closure['cycles'],
+                'passed_courses_cache': passed_courses_cache.stats()
+            }
+            response = {'status': StatusCodes['success'], 'errors': None, 'results': results}
+
+        except (Exception, psycopg.DatabaseError) as error:
+            logger.error(f'Rebuild prerequisites error: {error}')
+            response = {'status': StatusCodes['internal_error'], 'errors': str(error), 'results': None}
+
+    return jsonify(response)
+
+
+@app.route('/dbproj/admin/reference_data/reload', methods=['POST'])
+@token_required
+async def reload_reference_data():
+    if g.role != 'admin':
+        return jsonify({'status': StatusCodes['unauthorized'], 'errors': 'Only admin can access this endpoint', 'results': None})
+
+    if not config['REFERENCE_DATA_CACHE']:
+        return jsonify({'status': StatusCodes['api_error'], 'errors': 'Reference data cache is disabled', 'results': None})
+
+    async with db_connection() as conn:
+        cur = conn.cursor()
+
+        try:
+            await get_reference_data(cur, force=True)
+            await conn.rollback()
+            response = {'status': StatusCodes['success'], 'errors': None, 'results': reference_data_summary()}
+
+        except (Exception, psycopg.DatabaseError) as error:
+            await conn.rollback()
+            logger.error(f'Reload reference data error: {error}')
+            response = {'status': StatusCodes['internal_error'], 'errors': str(error), 'results': None}
+
+    return jsonify(response)
+
+
+if __name__ == '__main__':
+    # Servidor de desenvolvimento (hypercorn, um processo); a base de dados é
+    # inicializada por demoApi / wsgi.py --init-db
+    app.run(port=5001)
@@ -13,13 +13,17 @@ CREATE TABLE users (
 -- Tabela de Estudantes
 -- ========================
 CREATE TABLE student (
-    user_id INT PRIMARY KEY REFERENCES users(user_id),
+    user_id INT PRIMARY KEY REFERENCES users(user_id) ON DELETE CASCADE,
     name TEXT NOT NULL,
     birth_date DATE,
     address TEXT,
-    district TEXT
+    district TEXT,
+    deleted_at TIMESTAMP
 );
 
+-- Students apagados (soft delete) à espera do purge
+CREATE INDEX idx_student_deleted_at ON student (deleted_at) WHERE deleted_at IS NOT NULL;
+
 -- ========================
 -- Tabela de Professores
 -- ========================
@@ -40,9 +44,10 @@ CREATE TABLE admin (
 -- ========================
 CREATE TABLE academic_record (
     record_id SERIAL PRIMARY KEY,
-    student_id INT NOT NULL REFERENCES student(user_id),
+    student_id INT NOT NULL UNIQUE REFERENCES student(user_id) ON DELETE CASCADE,
     average NUMERIC(5,2),
-    approved_courses INT,
+    approved_courses INT NOT NULL DEFAULT 0,
+    approved_grade_sum NUMERIC(10,2) NOT NULL DEFAULT 0,  -- soma das notas aprovadas (média incremental)
     current_semester INT
 );
 
@@ -58,10 +63,13 @@ CREATE TABLE degree_program (
 -- ========================
 -- Conta Financeira
 -- ========================
+-- balance é o saldo compactado: a soma das transações já compactadas. O saldo
+-- atual (com as transações recentes) é lido de financial_balance
 CREATE TABLE financial_account (
     account_id SERIAL PRIMARY KEY,
-    student_id INT NOT NULL REFERENCES student(user_id),
-    balance NUMERIC(10,2) NOT NULL
+    student_id INT NOT NULL UNIQUE REFERENCES student(user_id) ON DELETE CASCADE,
+    balance NUMERIC(10,2) NOT NULL DEFAULT 0,
+    compacted_at TIMESTAMP
 );
 
 -- ========================
@@ -81,10 +89,14 @@ CREATE TABLE course_edition (
     course_code VARCHAR(10) NOT NULL REFERENCES course(code),
     year INT NOT NULL,
     capacity INT NOT NULL,
+    enrolled_count INT NOT NULL DEFAULT 0 CHECK (enrolled_count >= 0),  -- lugares ocupados
     schedule TEXT,
     coordinator_id INT NOT NULL REFERENCES instructor(user_id)
 );
 
+-- Ordem (e paginação por keyset) de degree_details
+CREATE INDEX idx_course_edition_year_code ON course_edition (year DESC, course_code, edition_id);
+
 -- ========================
 -- Aulas
 -- ========================
@@ -95,6 +107,17 @@ CREATE TABLE class (
     schedule TEXT NOT NULL
 );
 
+-- ========================
+-- Turmas dos Estudantes
+-- ========================
+CREATE TABLE student_class (
+    student_id INT NOT NULL REFERENCES student(user_id) ON DELETE CASCADE,
+    class_id INT NOT NULL REFERENCES class(class_id),
+    PRIMARY KEY (student_id, class_id)
+);
+
+CREATE INDEX idx_student_class_class_id ON student_class (class_id);
+
 -- ========================
 -- Salas
 -- ========================
@@ -127,7 +150,7 @@ CREATE TABLE activity (
 -- Inscrições em Graus
 -- ========================
 CREATE TABLE degree_enrollment (
-    student_id INT NOT NULL REFERENCES student(user_id),
+    student_id INT NOT NULL REFERENCES student(user_id) ON DELETE CASCADE,
     degree_id INT NOT NULL REFERENCES degree_program(degree_id),
     enrollment_date DATE NOT NULL,
     PRIMARY KEY (student_id, degree_id)
@@ -137,9 +160,11 @@ CREATE TABLE degree_enrollment (
 -- Inscrições em Cursos
 -- ========================
 CREATE TABLE course_enrollment (
-    student_id INT NOT NULL REFERENCES student(user_id),
+    student_id INT NOT NULL REFERENCES student(user_id) ON DELETE CASCADE,
     edition_id INT NOT NULL REFERENCES course_edition(edition_id),
     grade NUMERIC(5,2),
+    evaluation_period TEXT,       -- época de avaliação (e.g., 'Normal', 'Recurso')
+    evaluated_at TIMESTAMP,       -- momento em que a nota foi lançada
     attendance INT,
     PRIMARY KEY (student_id, edition_id)
 );
@@ -148,7 +173,7 @@ CREATE TABLE course_enrollment (
 -- Participação em Atividades
 -- ========================
 CREATE TABLE activity_participation (
-    student_id INT NOT NULL REFERENCES student(user_id),
+    student_id INT NOT NULL REFERENCES student(user_id) ON DELETE CASCADE,
     activity_id INT NOT NULL REFERENCES activity(activity_id),
     registration_date DATE NOT NULL,
     PRIMARY KEY (student_id, activity_id)
@@ -182,15 +207,134 @@ CREATE TABLE degree_courses (
     PRIMARY KEY (degree_id, course_code)
 );
 
+-- ========================
+-- Resumo por Edição (mantido por triggers, lido por degree_details)
+-- ========================
+CREATE TABLE course_edition_summary (
+    edition_id INT PRIMARY KEY REFERENCES course_edition(edition_id) ON DELETE CASCADE,
+    approved_count INT NOT NULL DEFAULT 0,
+    instructors INT[] NOT NULL DEFAULT '{}'
+);
+
+-- ========================
+-- Médias por Estudante e Ano (mantidas por triggers, lidas pelo leaderboard)
+-- ========================
+CREATE TABLE student_year_average (
+    student_id INT NOT NULL REFERENCES student(user_id) ON DELETE CASCADE,
+    year INT NOT NULL,
+    grade_sum NUMERIC(10,2) NOT NULL DEFAULT 0,
+    grade_count INT NOT NULL DEFAULT 0,
+    average NUMERIC(5,2),
+    PRIMARY KEY (student_id, year)
+);
+
+-- Só os students com notas (average NULL ficaria à frente num ORDER BY ... DESC)
+CREATE INDEX idx_student_year_average_ranking ON student_year_average (year, average DESC NULLS LAST, student_id)
+    WHERE grade_count > 0;
+
+-- Cópia de student_year_average por cada degree do student: o leaderboard de um
+-- degree lê o top n diretamente do índice (year, degree_id, average DESC)
+CREATE TABLE degree_year_average (
+    student_id INT NOT NULL REFERENCES student(user_id) ON DELETE CASCADE,
+    degree_id INT NOT NULL,
+    year INT NOT NULL,
+    grade_count INT NOT NULL,
+    average NUMERIC(5,2),
+    PRIMARY KEY (student_id, degree_id, year)
+);
+
+CREATE INDEX idx_degree_year_average_ranking ON degree_year_average (year, degree_id, average DESC NULLS LAST, student_id)
+    WHERE grade_count > 0;
+
+-- ========================
+-- Média Global por Estudante e Melhor Média por Distrito (mantidas por triggers)
+-- ========================
+CREATE TABLE student_average (
+    student_id INT PRIMARY KEY REFERENCES student(user_id) ON DELETE CASCADE,
+    district TEXT,
+    grade_sum NUMERIC(10,2) NOT NULL DEFAULT 0,
+    grade_count INT NOT NULL DEFAULT 0,
+    average NUMERIC(5,2)
+);
+
+CREATE INDEX idx_student_average_district ON student_average (district, average DESC);
+
+CREATE TABLE district_best (
+    district TEXT PRIMARY KEY,
+    best_average NUMERIC(5,2)
+);
+
+-- ========================
+-- Avaliações por Mês e Edição (mantidas por triggers, lidas por /dbproj/report)
+-- ========================
+CREATE TABLE monthly_edition_stats (
+    month DATE NOT NULL,          -- primeiro dia do mês da avaliação
+    edition_id INT NOT NULL REFERENCES course_edition(edition_id) ON DELETE CASCADE,
+    evaluated INT NOT NULL DEFAULT 0,
+    approved INT NOT NULL DEFAULT 0,
+    PRIMARY KEY (month, edition_id)
+);
+
+-- ========================
+-- Versões de dados em cache na API
+-- ========================
+CREATE TABLE cache_version (
+    name TEXT PRIMARY KEY,
+    version BIGINT NOT NULL DEFAULT 0
+);
+
+INSERT INTO cache_version (name, version) VALUES ('course_prerequisites', 0);
+
 -- ========================
 -- Transações Financeiras
 -- ========================
 CREATE TABLE financial_transaction (
     transaction_id SERIAL PRIMARY KEY,
-    account_id INT NOT NULL REFERENCES financial_account(account_id),
+    account_id INT NOT NULL REFERENCES financial_account(account_id) ON DELETE CASCADE,
     amount NUMERIC(10,2) NOT NULL,
     description TEXT NOT NULL,
     transaction_date TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
     activity_id INT REFERENCES activity(activity_id),
-    degree_id INT REFERENCES degree_program(degree_id)
+    degree_id INT REFERENCES degree_program(degree_id),
+    compacted BOOLEAN NOT NULL DEFAULT FALSE   -- já somada a financial_account.balance
+);
+
+-- Extrato por conta, mais recentes primeiro
+CREATE INDEX idx_financial_transaction_account ON financial_transaction (account_id, transaction_id DESC);
+
+-- Transações ainda por compactar (poucas: são somadas ao saldo a cada leitura)
+CREATE INDEX idx_financial_transaction_pending ON financial_transaction (account_id, transaction_id) WHERE NOT compacted;
+
+-- Saldo atual: saldo compactado mais as transações recentes
+CREATE VIEW financial_balance AS
+SELECT fa.account_id,
+       fa.student_id,
+       fa.balance + COALESCE((
+           SELECT SUM(ft.amount)
+           FROM financial_transaction ft
+           WHERE ft.account_id = fa.account_id AND NOT ft.compacted
+       ), 0) AS balance
+FROM financial_account fa;
+
+-- ========================
+-- Fila de Inscrições (ENROLL_QUEUE_MODE)
+-- ========================
+-- Partilhada por todos os processos da API: qualquer worker aceita pedidos,
+-- processa-os e responde ao estado de qualquer ticket
+CREATE TABLE enrollment_ticket (
+    ticket_id TEXT PRIMARY KEY,
+    student_id INT NOT NULL REFERENCES student(user_id) ON DELETE CASCADE,
+    edition_id INT NOT NULL,
+    classes INT[] NOT NULL,
+    status TEXT NOT NULL DEFAULT 'queued' CHECK (status IN ('queued', 'enrolled', 'rejected', 'failed')),
+    errors TEXT,
+    attempts INT NOT NULL DEFAULT 0,        -- lotes que falharam com um erro transitório
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    finished_at TIMESTAMP
 );
+
+-- Pedidos em espera, por ordem de chegada
+CREATE INDEX idx_enrollment_ticket_queued ON enrollment_ticket (created_at) WHERE status = 'queued';
+
+-- Tickets concluídos, para a expiração
+CREATE INDEX idx_enrollment_ticket_finished ON enrollment_ticket (finished_at) WHERE finished_at IS NOT NULL;
@@ -0,0 +1,155 @@
+-- =============================================
+-- MIGRATION OF AN EXISTING DATABASE
+-- =============================================
+
+-- Leva uma base de dados criada com uma versão anterior de estruturasv2.sql
+-- até ao esquema atual (colunas, tabelas, índices e constraints de que os
+-- triggers de triggers.sql precisam). Pode ser executado mais do que uma vez e
+-- numa base de dados nova não altera nada. Corre em create_triggers, antes de
+-- triggers.sql; as tabelas mantidas por triggers são depois reconstruídas a
+-- partir dos dados existentes (ver DERIVED_TABLES_VERSION em demoApi.py).
+
+-- 1. Soft delete de students
+ALTER TABLE student ADD COLUMN IF NOT EXISTS deleted_at TIMESTAMP;
+CREATE INDEX IF NOT EXISTS idx_student_deleted_at ON student (deleted_at) WHERE deleted_at IS NOT NULL;
+
+-- 2. Apagar um user apaga os dados do student (foreign keys ON DELETE CASCADE)
+ALTER TABLE student DROP CONSTRAINT IF EXISTS student_user_id_fkey,
+    ADD CONSTRAINT student_user_id_fkey FOREIGN KEY (user_id) REFERENCES users(user_id) ON DELETE CASCADE;
+ALTER TABLE academic_record DROP CONSTRAINT IF EXISTS academic_record_student_id_fkey,
+    ADD CONSTRAINT academic_record_student_id_fkey FOREIGN KEY (student_id) REFERENCES student(user_id) ON DELETE CASCADE;
+ALTER TABLE financial_account DROP CONSTRAINT IF EXISTS financial_account_student_id_fkey,
+    ADD CONSTRAINT financial_account_student_id_fkey FOREIGN KEY (student_id) REFERENCES student(user_id) ON DELETE CASCADE;
+ALTER TABLE degree_enrollment DROP CONSTRAINT IF EXISTS degree_enrollment_student_id_fkey,
+    ADD CONSTRAINT degree_enrollment_student_id_fkey FOREIGN KEY (student_id) REFERENCES student(user_id) ON DELETE CASCADE;
+ALTER TABLE course_enrollment DROP CONSTRAINT IF EXISTS course_enrollment_student_id_fkey,
+    ADD CONSTRAINT course_enrollment_student_id_fkey FOREIGN KEY (student_id) REFERENCES student(user_id) ON DELETE CASCADE;
+ALTER TABLE activity_participation DROP CONSTRAINT IF EXISTS activity_participation_student_id_fkey,
+    ADD CONSTRAINT activity_participation_student_id_fkey FOREIGN KEY (student_id) REFERENCES student(user_id) ON DELETE CASCADE;
+ALTER TABLE financial_transaction DROP CONSTRAINT IF EXISTS financial_transaction_account_id_fkey,
+    ADD CONSTRAINT financial_transaction_account_id_fkey FOREIGN KEY (account_id) REFERENCES financial_account(account_id) ON DELETE CASCADE;
+
+-- 3. academic_record: um por student, média incremental
+-- (os registos são derivados das notas: os repetidos são apagados e tudo é
+-- recalculado por rebuild_academic_records)
+DELETE FROM academic_record ar
+USING academic_record keep
+WHERE keep.student_id = ar.student_id AND keep.record_id < ar.record_id;
+CREATE UNIQUE INDEX IF NOT EXISTS academic_record_student_id_key ON academic_record (student_id);
+UPDATE academic_record SET approved_courses = 0 WHERE approved_courses IS NULL;
+ALTER TABLE academic_record ALTER COLUMN approved_courses SET DEFAULT 0,
+    ALTER COLUMN approved_courses SET NOT NULL;
+ALTER TABLE academic_record ADD COLUMN IF NOT EXISTS approved_grade_sum NUMERIC(10,2) NOT NULL DEFAULT 0;
+
+-- 4. financial_account: uma por student; balance passa a ser o saldo compactado.
+-- O saldo antigo já inclui todas as transações existentes, por isso estas
+-- entram como compactadas (só as novas usam o valor por omissão FALSE)
+CREATE UNIQUE INDEX IF NOT EXISTS financial_account_student_id_key ON financial_account (student_id);
+ALTER TABLE financial_account ALTER COLUMN balance SET DEFAULT 0;
+ALTER TABLE financial_account ADD COLUMN IF NOT EXISTS compacted_at TIMESTAMP;
+ALTER TABLE financial_transaction ADD COLUMN IF NOT EXISTS compacted BOOLEAN NOT NULL DEFAULT TRUE;
+ALTER TABLE financial_transaction ALTER COLUMN compacted SET DEFAULT FALSE;
+CREATE INDEX IF NOT EXISTS idx_financial_transaction_account ON financial_transaction (account_id, transaction_id DESC);
+CREATE INDEX IF NOT EXISTS idx_financial_transaction_pending ON financial_transaction (account_id, transaction_id) WHERE NOT compacted;
+
+CREATE OR REPLACE VIEW financial_balance AS
+SELECT fa.account_id,
+       fa.student_id,
+       fa.balance + COALESCE((
+           SELECT SUM(ft.amount)
+           FROM financial_transaction ft
+           WHERE ft.account_id = fa.account_id AND NOT ft.compacted
+       ), 0) AS balance
+FROM financial_account fa;
+
+-- 5. Lugares ocupados (acertados por rebuild_course_seats) e ordem de degree_details
+ALTER TABLE course_edition ADD COLUMN IF NOT EXISTS enrolled_count INT NOT NULL DEFAULT 0 CHECK (enrolled_count >= 0);
+CREATE INDEX IF NOT EXISTS idx_course_edition_year_code ON course_edition (year DESC, course_code, edition_id);
+
+-- 6. Turmas dos estudantes
+CREATE TABLE IF NOT EXISTS student_class (
+    student_id INT NOT NULL REFERENCES student(user_id) ON DELETE CASCADE,
+    class_id INT NOT NULL REFERENCES class(class_id),
+    PRIMARY KEY (student_id, class_id)
+);
+CREATE INDEX IF NOT EXISTS idx_student_class_class_id ON student_class (class_id);
+
+-- 7. Época e data das notas
+ALTER TABLE course_enrollment ADD COLUMN IF NOT EXISTS evaluation_period TEXT;
+ALTER TABLE course_enrollment ADD COLUMN IF NOT EXISTS evaluated_at TIMESTAMP;
+
+-- 8. Tabelas mantidas por triggers (preenchidas pelas functions rebuild_*)
+CREATE TABLE IF NOT EXISTS course_edition_summary (
+    edition_id INT PRIMARY KEY REFERENCES course_edition(edition_id) ON DELETE CASCADE,
+    approved_count INT NOT NULL DEFAULT 0,
+    instructors INT[] NOT NULL DEFAULT '{}'
+);
+
+CREATE TABLE IF NOT EXISTS student_year_average (
+    student_id INT NOT NULL REFERENCES student(user_id) ON DELETE CASCADE,
+    year INT NOT NULL,
+    grade_sum NUMERIC(10,2) NOT NULL DEFAULT 0,
+    grade_count INT NOT NULL DEFAULT 0,
+    average NUMERIC(5,2),
+    PRIMARY KEY (student_id, year)
+);
+DROP INDEX IF EXISTS idx_student_year_average_rank;
+CREATE INDEX IF NOT EXISTS idx_student_year_average_ranking ON student_year_average (year, average DESC NULLS LAST, student_id)
+    WHERE grade_count > 0;
+
+CREATE TABLE IF NOT EXISTS degree_year_average (
+    student_id INT NOT NULL REFERENCES student(user_id) ON DELETE CASCADE,
+    degree_id INT NOT NULL,
+    year INT NOT NULL,
+    grade_count INT NOT NULL,
+    average NUMERIC(5,2),
+    PRIMARY KEY (student_id, degree_id, year)
+);
+CREATE INDEX IF NOT EXISTS idx_degree_year_average_ranking ON degree_year_average (year, degree_id, average DESC NULLS LAST, student_id)
+    WHERE grade_count > 0;
+
+CREATE TABLE IF NOT EXISTS student_average (
+    student_id INT PRIMARY KEY REFERENCES student(user_id) ON DELETE CASCADE,
+    district TEXT,
+    grade_sum NUMERIC(10,2) NOT NULL DEFAULT 0,
+    grade_count INT NOT NULL DEFAULT 0,
+    average NUMERIC(5,2)
+);
+CREATE INDEX IF NOT EXISTS idx_student_average_district ON student_average (district, average DESC);
+
+CREATE TABLE IF NOT EXISTS district_best (
+    district TEXT PRIMARY KEY,
+    best_average NUMERIC(5,2)
+);
+
+CREATE TABLE IF NOT EXISTS monthly_edition_stats (
+    month DATE NOT NULL,
+    edition_id INT NOT NULL REFERENCES course_edition(edition_id) ON DELETE CASCADE,
+    evaluated INT NOT NULL DEFAULT 0,
+    approved INT NOT NULL DEFAULT 0,
+    PRIMARY KEY (month, edition_id)
+);
+
+-- 9. Versões de dados em cache na API
+CREATE TABLE IF NOT EXISTS cache_version (
+    name TEXT PRIMARY KEY,
+    version BIGINT NOT NULL DEFAULT 0
+);
+INSERT INTO cache_version (name, version) VALUES ('course_prerequisites', 0)
+ON CONFLICT (name) DO NOTHING;
+
+-- 10. Fila de inscrições (ENROLL_QUEUE_MODE)
+CREATE TABLE IF NOT EXISTS enrollment_ticket (
+    ticket_id TEXT PRIMARY KEY,
+    student_id INT NOT NULL REFERENCES student(user_id) ON DELETE CASCADE,
+    edition_id INT NOT NULL,
+    classes INT[] NOT NULL,
+    status TEXT NOT NULL DEFAULT 'queued' CHECK (status IN ('queued', 'enrolled', 'rejected', 'failed')),
+    errors TEXT,
+    attempts INT NOT NULL DEFAULT 0,        -- lotes que falharam com um erro transitório
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    finished_at TIMESTAMP
+);
+ALTER TABLE enrollment_ticket ADD COLUMN IF NOT EXISTS attempts INT NOT NULL DEFAULT 0;
+CREATE INDEX IF NOT EXISTS idx_enrollment_ticket_queued ON enrollment_ticket (created_at) WHERE status = 'queued';
+CREATE INDEX IF NOT EXISTS idx_enrollment_ticket_finished ON enrollment_ticket (finished_at) WHERE finished_at IS NOT NULL;
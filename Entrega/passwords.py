@@ -0,0 +1,58 @@
+##
+## Password hashing (scrypt, memory-hard)
+##
+## Stored format: scrypt$<n>$<r>$<p>$<salt>$<hash> (salt and hash in base64).
+## These functions are CPU and memory heavy (~100 ms, 32 MiB with the default
+## parameters of demoApi) and run in the process pool of demoApi. They only
+## depend on the standard library, but the pool workers are spawned and import
+## the main module again (demoApi or wsgi, with Flask and the rest), so
+## starting them is slow: demoApi starts them ahead of the first hash.
+##
+
+import base64
+import hashlib
+import hmac
+import os
+
+SALT_BYTES = 16
+HASH_BYTES = 32
+
+
+def _scrypt(password, salt, n, r, p):
+    # maxmem acima dos 128 * n * r bytes usados pelo scrypt
+    return hashlib.scrypt(password.encode(), salt=salt, n=n, r=r, p=p,
+                          maxmem=256 * n * r, dklen=HASH_BYTES)
+
+
+def hash_password(password, n, r, p):
+    """Hash of password in the stored format"""
+    salt = os.urandom(SALT_BYTES)
+    digest = _scrypt(password, salt, n, r, p)
+    return '$'.join(['scrypt', str(n), str(r), str(p),
+                     base64.b64encode(salt).decode(), base64.b64encode(digest).decode()])
+
+
+def is_hashed(stored):
+    return stored.startswith('scrypt$')
+
+
+def verify_password(password, stored, n, r, p):
+    """(matches, needs_rehash) of password against the stored value.
+
+    Values not in the stored format are legacy plaintext passwords: they are
+    compared as they are and always need a rehash, as do hashes made with
+    parameters other than (n, r, p).
+    """
+    if not is_hashed(stored):
+        matches = hmac.compare_digest(password.encode(), stored.encode())
+        return matches, matches
+
+    try:
+        _, stored_n, stored_r, stored_p, salt, digest = stored.split('$')
+        stored_n, stored_r, stored_p = int(stored_n), int(stored_r), int(stored_p)
+        salt, digest = base64.b64decode(salt), base64.b64decode(digest)
+    except ValueError:
+        return False, False
+
+    matches = hmac.compare_digest(_scrypt(password, salt, stored_n, stored_r, stored_p), digest)
+    return matches, matches and (stored_n, stored_r, stored_p) != (n, r, p)
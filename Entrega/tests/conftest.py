@@ -0,0 +1,11 @@
+##
+## Tests of the API helpers (python -m pytest tests, from Entrega)
+##
+## They need the packages of requirements.txt (each module is skipped without
+## them); the tests that need a database say so in their module.
+##
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,47 @@
+import pytest
+
+demoApi = pytest.importorskip('demoApi')
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(demoApi.time, 'monotonic', clock)
+    return clock
+
+
+def test_lru_cache_evicts_least_recently_used():
+    cache = demoApi.LRUCache(2)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    assert cache.get('a') == 1
+    cache.set('c', 3)
+    assert cache.get('b') is None
+    assert cache.get('a') == 1 and cache.get('c') == 3
+    assert cache.stats()['evictions'] == 1
+
+
+def test_lru_cache_entries_expire(clock):
+    cache = demoApi.LRUCache(10, ttl=5)
+    cache.set('a', 1)
+    cache.set('b', 2, ttl=20)
+    clock.now += 6
+    assert cache.get('a') is None
+    assert cache.get('b') == 2
+
+
+def test_lru_cache_pop_and_stats():
+    cache = demoApi.LRUCache(10)
+    cache.set('a', 1)
+    assert cache.pop('a') == 1
+    assert cache.pop('a') is None
+    assert cache.get('a', 'missing') == 'missing'
+    assert cache.stats()['misses'] == 1 and cache.stats()['hit_rate'] == 0
@@ -0,0 +1,200 @@
+##
+## Triggers against a real database: estruturasv2.sql, migrations.sql and
+## triggers.sql are run on the database named by API_TEST_DATABASE (same user,
+## host and port as demoApi.DB_PARAMS). Skipped without it. That database is
+## wiped: never point it at real data.
+##
+
+import os
+
+import pytest
+
+demoApi = pytest.importorskip('demoApi')
+
+import psycopg2
+import psycopg2.errors
+
+TEST_DATABASE = os.environ.get('API_TEST_DATABASE')
+ENTREGA = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+pytestmark = pytest.mark.skipif(not TEST_DATABASE, reason='API_TEST_DATABASE not set')
+
+
+def run_script(cur, name):
+    with open(os.path.join(ENTREGA, name), encoding='utf-8') as file:
+        cur.execute(file.read())
+
+
+@pytest.fixture(scope='module')
+def database():
+    """Connection to API_TEST_DATABASE with a fresh schema, tables and triggers"""
+    conn = psycopg2.connect(**{**demoApi.DB_PARAMS, 'database': TEST_DATABASE})
+    cur = conn.cursor()
+    cur.execute('DROP SCHEMA public CASCADE; CREATE SCHEMA public')
+    run_script(cur, 'estruturasv2.sql')
+    run_script(cur, 'migrations.sql')
+    run_script(cur, 'triggers.sql')
+    conn.commit()
+    yield conn
+    conn.close()
+
+
+@pytest.fixture
+def cur(database):
+    cur = database.cursor()
+    yield cur
+    database.rollback()
+
+
+def test_migration_and_triggers_can_be_rerun(cur):
+    run_script(cur, 'migrations.sql')
+    run_script(cur, 'triggers.sql')
+    cur.execute("SELECT rebuild_academic_records(), rebuild_grade_rankings(), "
+                "rebuild_monthly_stats(), rebuild_course_edition_summary()")
+
+
+def add_student(cur, username):
+    cur.execute("INSERT INTO users (username, password, role) VALUES (%s, 'x', 'student') RETURNING user_id", (username,))
+    student_id = cur.fetchone()[0]
+    cur.execute("INSERT INTO student (user_id, name) VALUES (%s, %s)", (student_id, username))
+    return student_id
+
+
+def add_edition(cur, capacity):
+    cur.execute("INSERT INTO users (username, password, role) VALUES ('coordinator', 'x', 'instructor') RETURNING user_id")
+    coordinator_id = cur.fetchone()[0]
+    cur.execute("INSERT INTO instructor (user_id, is_coordinator) VALUES (%s, TRUE)", (coordinator_id,))
+    cur.execute("INSERT INTO course (code, name, credits) VALUES ('BD', 'Bases de Dados', 6)")
+    cur.execute("""
+        INSERT INTO course_edition (course_code, year, capacity, coordinator_id)
+        VALUES ('BD', 2025, %s, %s) RETURNING edition_id
+    """, (capacity, coordinator_id))
+    return cur.fetchone()[0]
+
+
+def enrolled_count(cur, edition_id):
+    cur.execute("SELECT enrolled_count FROM course_edition WHERE edition_id = %s", (edition_id,))
+    return cur.fetchone()[0]
+
+
+def test_seat_counter_follows_enrollments(cur):
+    edition_id = add_edition(cur, capacity=2)
+    students = [add_student(cur, f'student{i}') for i in range(3)]
+
+    cur.execute("INSERT INTO course_enrollment (student_id, edition_id) VALUES (%s, %s), (%s, %s)",
+                (students[0], edition_id, students[1], edition_id))
+    assert enrolled_count(cur, edition_id) == 2
+
+    cur.execute('SAVEPOINT full_edition')
+    with pytest.raises(psycopg2.errors.CheckViolation):
+        cur.execute("INSERT INTO course_enrollment (student_id, edition_id) VALUES (%s, %s)", (students[2], edition_id))
+    cur.execute('ROLLBACK TO SAVEPOINT full_edition')
+    assert enrolled_count(cur, edition_id) == 2
+
+    cur.execute("DELETE FROM course_enrollment WHERE student_id = %s", (students[0],))
+    assert enrolled_count(cur, edition_id) == 1
+
+    cur.execute("UPDATE student SET deleted_at = CURRENT_TIMESTAMP WHERE user_id = %s", (students[1],))
+    assert enrolled_count(cur, edition_id) == 0
+
+    cur.execute("SELECT rebuild_course_seats()")
+    assert enrolled_count(cur, edition_id) == 0
+
+
+def add_degree(cur, name, students):
+    cur.execute("INSERT INTO degree_program (name, tuition_fee) VALUES (%s, 697) RETURNING degree_id", (name,))
+    degree_id = cur.fetchone()[0]
+    for student_id in students:
+        cur.execute("INSERT INTO degree_enrollment (student_id, degree_id, enrollment_date) VALUES (%s, %s, CURRENT_DATE)",
+                    (student_id, degree_id))
+    return degree_id
+
+
+def leaderboard_ids(cur, degree_id=None):
+    return [row['student_id'] for row in demoApi.fetch_leaderboard(cur, 2025, degree_id, n=3)]
+
+
+def test_leaderboard_by_degree_follows_grades_and_degrees(cur):
+    edition_id = add_edition(cur, capacity=10)
+    students = [add_student(cur, f'ranked{i}') for i in range(4)]
+    lei = add_degree(cur, 'LEI', students[:2])
+    cur.execute("INSERT INTO course_enrollment (student_id, edition_id, grade) SELECT unnest(%s), %s, unnest(%s)",
+                (students[:3], edition_id, [12, 18, 15]))
+    # Sem notas: não entra no ranking
+    cur.execute("INSERT INTO course_enrollment (student_id, edition_id) VALUES (%s, %s)", (students[3], edition_id))
+    assert leaderboard_ids(cur) == [students[1], students[2], students[0]]
+    assert leaderboard_ids(cur, lei) == [students[1], students[0]]
+
+    cur.execute("UPDATE course_enrollment SET grade = 20 WHERE student_id = %s", (students[0],))
+    assert leaderboard_ids(cur, lei) == [students[0], students[1]]
+
+    mei = add_degree(cur, 'MEI', [students[2]])
+    assert leaderboard_ids(cur, mei) == [students[2]]
+    cur.execute("DELETE FROM degree_enrollment WHERE student_id = %s", (students[0],))
+    assert leaderboard_ids(cur, lei) == [students[1]]
+
+    cur.execute("SELECT rebuild_grade_rankings()")
+    assert leaderboard_ids(cur, lei) == [students[1]]
+    assert leaderboard_ids(cur, mei) == [students[2]]
+
+
+def balance(cur, student_id):
+    cur.execute("SELECT balance FROM financial_balance WHERE student_id = %s", (student_id,))
+    return cur.fetchone()[0]
+
+
+def test_ledger_balance_survives_compaction(cur):
+    student_id = add_student(cur, 'payer')
+    cur.execute("INSERT INTO degree_program (name, tuition_fee) VALUES ('LEI', 697) RETURNING degree_id")
+    degree_id = cur.fetchone()[0]
+    cur.execute("INSERT INTO degree_enrollment (student_id, degree_id, enrollment_date) VALUES (%s, %s, CURRENT_DATE)",
+                (student_id, degree_id))
+    assert balance(cur, student_id) == 697
+
+    for amount in (10, 20, -50):
+        cur.execute("SELECT post_financial_transaction(%s, %s, 'Activity fee')", (student_id, amount))
+    assert balance(cur, student_id) == 677
+
+    cur.execute("SELECT compact_financial_transactions(2)")
+    assert cur.fetchone()[0] == 2
+    assert balance(cur, student_id) == 677
+    cur.execute("SELECT compact_financial_transactions(100)")
+    assert cur.fetchone()[0] == 2
+    cur.execute("SELECT fa.balance, COUNT(ft.*) FILTER (WHERE NOT ft.compacted) FROM financial_account fa "
+                "JOIN financial_transaction ft USING (account_id) WHERE fa.student_id = %s GROUP BY fa.balance",
+                (student_id,))
+    assert cur.fetchone() == (677, 0)
+    assert balance(cur, student_id) == 677
+
+    cur.execute('SAVEPOINT append_only')
+    with pytest.raises(psycopg2.Error, match='append-only'):
+        cur.execute("UPDATE financial_transaction SET amount = 0 WHERE account_id = "
+                    "(SELECT account_id FROM financial_account WHERE student_id = %s)", (student_id,))
+    cur.execute('ROLLBACK TO SAVEPOINT append_only')
+
+
+def test_student_data_notified_once_per_statement(database):
+    cur = database.cursor()
+    listener = psycopg2.connect(**{**demoApi.DB_PARAMS, 'database': TEST_DATABASE})
+    listener.autocommit = True
+    try:
+        listener.cursor().execute(f'LISTEN {demoApi.STUDENT_DATA_CHANNEL}')
+        edition_id = add_edition(cur, capacity=10)
+        students = [add_student(cur, f'notified{i}') for i in range(3)]
+        cur.execute("INSERT INTO course_enrollment (student_id, edition_id) SELECT unnest(%s), %s",
+                    (students, edition_id))
+        database.commit()
+        listener.poll()
+        payloads = [notify.payload for notify in listener.notifies]
+        assert len(payloads) == 1
+        assert sorted(int(student_id) for student_id in payloads[0].split(',')) == students
+    finally:
+        listener.close()
+        # Os outros testes contam com a base de dados vazia
+        database.rollback()
+        cur.execute("DELETE FROM course_enrollment")
+        cur.execute("DELETE FROM course_edition")
+        cur.execute("DELETE FROM course")
+        cur.execute("DELETE FROM instructor")
+        cur.execute("DELETE FROM users")
+        database.commit()
@@ -0,0 +1,48 @@
+import base64
+import json
+
+import pytest
+
+demoApi = pytest.importorskip('demoApi')
+
+
+
+def test_cursor_round_trip():
+    cursor = demoApi.encode_cursor((2024, 17))
+    assert demoApi.decode_cursor(cursor, (int, int)) == [2024, 17]
+
+
+def test_cursor_round_trip_with_text_key():
+    cursor = demoApi.encode_cursor((2024, 'LEI, 1', 3))
+    assert demoApi.decode_cursor(cursor, (int, str, int)) == [2024, 'LEI, 1', 3]
+
+
+def test_cursor_is_url_safe():
+    cursor = demoApi.encode_cursor(('??>>', 0))
+    assert '=' not in cursor and '+' not in cursor and '/' not in cursor
+
+
+@pytest.mark.parametrize('cursor', [
+    'not base64!',
+    base64.urlsafe_b64encode(b'{"a": 1}').decode(),
+    demoApi.encode_cursor((1,)),
+    demoApi.encode_cursor(('2024', 1)),
+    demoApi.encode_cursor((True, 1)),
+])
+def test_invalid_cursors_are_rejected(cursor):
+    with pytest.raises(ValueError):
+        demoApi.decode_cursor(cursor, (int, int))
+
+
+def test_json_document_cursor_matches_encode_cursor():
+    # Texto de json_build_array(...)::text, com os separadores do Postgres
+    document = demoApi.json_document(('{"status": 200, "errors" : null, "results" : []}', '[2024, "LEI, 1", 3]'), 50)
+    cursor = json.loads(document)['next_cursor']
+    assert cursor == demoApi.encode_cursor((2024, 'LEI, 1', 3))
+    assert demoApi.decode_cursor(cursor, (int, str, int)) == [2024, 'LEI, 1', 3]
+
+
+def test_json_document_last_page():
+    document = demoApi.json_document(('{"results" : []}', None), 50)
+    assert json.loads(document) == {'results': [], 'next_cursor': None}
+    assert demoApi.json_document(('{"results" : []}', None)) == '{"results" : []}'
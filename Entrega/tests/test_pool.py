@@ -0,0 +1,129 @@
+import types
+
+import pytest
+
+demoApi = pytest.importorskip('demoApi')
+
+import psycopg2
+import psycopg2.extensions
+
+
+class FakeCursor:
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, sql, params=None):
+        if self.conn.broken:
+            raise psycopg2.OperationalError('server closed the connection unexpectedly')
+        self.conn.info.transaction_status = psycopg2.extensions.TRANSACTION_STATUS_INTRANS
+
+
+class FakeConnection:
+    def __init__(self):
+        self.closed = 0
+        self.broken = False
+        self.autocommit = False
+        self.rollbacks = 0
+        self.info = types.SimpleNamespace(transaction_status=psycopg2.extensions.TRANSACTION_STATUS_IDLE)
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def rollback(self):
+        self.rollbacks += 1
+        self.info.transaction_status = psycopg2.extensions.TRANSACTION_STATUS_IDLE
+
+    def close(self):
+        self.closed = 1
+
+
+@pytest.fixture
+def connections(monkeypatch):
+    opened = []
+
+    def connect(**params):
+        conn = FakeConnection()
+        opened.append(conn)
+        return conn
+
+    monkeypatch.setattr(demoApi.psycopg2, 'connect', connect)
+    return opened
+
+
+def make_pool(minconn=0, maxconn=2, timeout=0.05, ping_after=60):
+    return demoApi.ConnectionPool(minconn, maxconn, timeout, ping_after)
+
+
+def test_opens_minconn_connections(connections):
+    pool = make_pool(minconn=2, maxconn=3)
+    assert len(connections) == 2
+    assert pool.stats()['idle'] == 2
+
+
+def test_reuses_the_last_returned_connection(connections):
+    pool = make_pool()
+    first = pool.getconn()
+    pool.putconn(first)
+    assert pool.getconn() is first
+    assert len(connections) == 1
+
+
+def test_times_out_when_all_connections_are_in_use(connections):
+    pool = make_pool(maxconn=1)
+    pool.getconn()
+    with pytest.raises(demoApi.PoolTimeout):
+        pool.getconn()
+    assert pool.stats()['timeouts'] == 1
+
+
+def test_rolls_back_an_open_transaction_on_return(connections):
+    pool = make_pool()
+    conn = pool.getconn()
+    with conn.cursor() as cur:
+        cur.execute('SELECT 1')
+    pool.putconn(conn)
+    assert conn.rollbacks == 1
+    assert conn.info.transaction_status == psycopg2.extensions.TRANSACTION_STATUS_IDLE
+
+
+def test_replaces_a_broken_connection(connections):
+    pool = make_pool(ping_after=0)
+    conn = pool.getconn()
+    pool.putconn(conn)
+    conn.broken = True
+    replacement = pool.getconn()
+    assert replacement is not conn and conn.closed
+    assert pool.stats()['discarded'] == 1 and pool.stats()['size'] == 1
+
+
+def test_discarded_connections_free_their_slot(connections):
+    pool = make_pool(maxconn=1)
+    pool.putconn(pool.getconn(), discard=True)
+    pool.getconn()
+    assert pool.stats()['size'] == 1
+
+
+def test_connect_failure_raises_database_unavailable(monkeypatch):
+    def connect(**params):
+        raise psycopg2.OperationalError('could not connect to server')
+
+    monkeypatch.setattr(demoApi.psycopg2, 'connect', connect)
+    pool = make_pool(maxconn=1)
+    with pytest.raises(demoApi.DatabaseUnavailable):
+        pool.getconn()
+    # O lugar reservado é devolvido
+    assert pool.stats()['size'] == 0
+
+
+def test_closed_pool_refuses_connections(connections):
+    pool = make_pool(minconn=1)
+    pool.closeall()
+    assert connections[0].closed
+    with pytest.raises(psycopg2.pool.PoolError):
+        pool.getconn()
@@ -0,0 +1,80 @@
+import threading
+import time
+
+import pytest
+
+demoApi = pytest.importorskip('demoApi')
+
+
+def start_leader(flight, key, release, result='leader'):
+    started = threading.Event()
+
+    def func():
+        started.set()
+        release.wait(5)
+        return result
+
+    thread = threading.Thread(target=flight.do, args=(key, func))
+    thread.start()
+    started.wait(5)
+    return thread
+
+
+def test_single_flight_shares_one_execution():
+    flight = demoApi.SingleFlight()
+    release = threading.Event()
+    leader = start_leader(flight, 'k', release)
+
+    results = []
+    followers = [threading.Thread(target=lambda: results.append(flight.do('k', lambda: 'own', timeout=5)))
+                 for _ in range(3)]
+    for thread in followers:
+        thread.start()
+    while flight.stats()['shared'] < 3:
+        time.sleep(0.01)
+    release.set()
+    for thread in [leader, *followers]:
+        thread.join(5)
+
+    assert results == ['leader'] * 3
+    assert flight.stats() == {'executions': 1, 'shared': 3, 'timeouts': 0, 'in_flight': 0}
+
+
+def test_single_flight_shares_errors():
+    flight = demoApi.SingleFlight()
+    with pytest.raises(KeyError):
+        flight.do('k', lambda: {}['missing'])
+    assert not flight.in_flight('k')
+    assert flight.do('k', lambda: 'again') == 'again'
+
+
+def test_single_flight_follower_runs_func_after_timeout():
+    flight = demoApi.SingleFlight()
+    release = threading.Event()
+    leader = start_leader(flight, 'k', release)
+    try:
+        assert flight.do('k', lambda: 'own', timeout=0.05) == 'own'
+        assert flight.stats()['timeouts'] == 1
+    finally:
+        release.set()
+        leader.join(5)
+
+
+def test_single_flight_starts_one_background_run_per_key():
+    flight = demoApi.SingleFlight()
+    release = threading.Event()
+    runs = []
+
+    def func():
+        runs.append(1)
+        release.wait(5)
+        return 'fresh'
+
+    started = [flight.start('k', func) for _ in range(10)]
+    assert started.count(True) == 1
+    assert flight.in_flight('k')
+    release.set()
+    assert flight.do('k', lambda: 'own', timeout=5) in ('fresh', 'own')
+    while flight.in_flight('k'):
+        time.sleep(0.01)
+    assert runs == [1]
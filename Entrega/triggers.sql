@@ -2,117 +2,1087 @@
 -- TRIGGERS FOR UNIVERSITY DATABASE
 -- =============================================
 
--- 1. Function para financial account
+-- 1. Functions para financial account (ledger só de inserções)
+-- Cada cobrança é uma nova linha de financial_transaction; a linha de
+-- financial_account só é escrita na criação e pela compactação, por isso
+-- cobranças concorrentes ao mesmo student não esperam umas pelas outras.
+-- Saldo atual = financial_account.balance + transações por compactar
+-- (view financial_balance).
+CREATE OR REPLACE FUNCTION post_financial_transaction(
+    p_student_id INT, p_amount NUMERIC, p_description TEXT,
+    p_activity_id INT DEFAULT NULL, p_degree_id INT DEFAULT NULL)
+RETURNS INT AS $$
+DECLARE
+    v_account_id INT;
+    v_transaction_id INT;
+BEGIN
+    SELECT account_id INTO v_account_id FROM financial_account WHERE student_id = p_student_id;
+    IF v_account_id IS NULL THEN
+        INSERT INTO financial_account (student_id)
+        VALUES (p_student_id)
+        ON CONFLICT (student_id) DO NOTHING
+        RETURNING account_id INTO v_account_id;
+        -- Criada entretanto por outra transação
+        IF v_account_id IS NULL THEN
+            SELECT account_id INTO v_account_id FROM financial_account WHERE student_id = p_student_id;
+        END IF;
+    END IF;
+
+    INSERT INTO financial_transaction (account_id, amount, description, activity_id, degree_id)
+    VALUES (v_account_id, p_amount, p_description, p_activity_id, p_degree_id)
+    RETURNING transaction_id INTO v_transaction_id;
+    RETURN v_transaction_id;
+END;
+$$ LANGUAGE plpgsql;
+
 CREATE OR REPLACE FUNCTION create_financial_account()
 RETURNS TRIGGER AS $$
 BEGIN
-    IF NOT EXISTS (SELECT 1 FROM financial_account WHERE student_id = NEW.student_id) THEN
-        INSERT INTO financial_account (student_id, balance)
-        SELECT NEW.student_id, dp.tuition_fee
-        FROM degree_program dp
-        WHERE dp.degree_id = NEW.degree_id;
-    ELSE
-        UPDATE financial_account 
-        SET balance = balance + (SELECT tuition_fee FROM degree_program WHERE degree_id = NEW.degree_id),
-            last_update = CURRENT_TIMESTAMP
-        WHERE student_id = NEW.student_id;
-    END IF;
+    -- Dívida da propina (conforme enunciado), criando a conta se ainda não existir
+    PERFORM post_financial_transaction(NEW.student_id, dp.tuition_fee, 'Tuition fee: ' || dp.name, NULL, dp.degree_id)
+    FROM degree_program dp
+    WHERE dp.degree_id = NEW.degree_id;
     RETURN NEW;
 END;
 $$ LANGUAGE plpgsql;
 
+-- Soma ao saldo compactado até p_batch transações por compactar e marca-as
+-- como compactadas, tudo na mesma transação (quem lê financial_balance vê o
+-- antes ou o depois, nunca as duas). Só as transações já confirmadas são
+-- vistas, as que confirmarem depois ficam para a próxima vez. Devolve o número
+-- de transações compactadas (0 se outra compactação está a correr).
+CREATE OR REPLACE FUNCTION compact_financial_transactions(p_batch INT)
+RETURNS INT AS $$
+DECLARE
+    v_count INT;
+BEGIN
+    IF NOT pg_try_advisory_xact_lock(hashtext('compact_financial_transactions')) THEN
+        RETURN 0;
+    END IF;
+
+    WITH folded AS (
+        UPDATE financial_transaction
+        SET compacted = TRUE
+        WHERE transaction_id IN (
+            SELECT transaction_id
+            FROM financial_transaction
+            WHERE NOT compacted
+            ORDER BY transaction_id
+            LIMIT p_batch
+        )
+        RETURNING account_id, amount
+    ),
+    totals AS (
+        SELECT account_id, SUM(amount) AS amount, COUNT(*) AS transactions
+        FROM folded
+        GROUP BY account_id
+    ),
+    updated AS (
+        UPDATE financial_account fa
+        SET balance = fa.balance + t.amount,
+            compacted_at = CURRENT_TIMESTAMP
+        FROM totals t
+        WHERE fa.account_id = t.account_id
+        RETURNING t.transactions
+    )
+    SELECT COALESCE(SUM(transactions), 0) INTO v_count FROM updated;
+
+    RETURN v_count;
+END;
+$$ LANGUAGE plpgsql;
+
+-- As transações são o extrato do student: depois de inseridas só a compactação
+-- lhes toca (coluna compacted)
+CREATE OR REPLACE FUNCTION reject_financial_transaction_update()
+RETURNS TRIGGER AS $$
+BEGIN
+    RAISE EXCEPTION 'financial_transaction is append-only (transaction %)', OLD.transaction_id;
+END;
+$$ LANGUAGE plpgsql;
+
 -- 2. Function para academic records
-'''CREATE OR REPLACE FUNCTION update_academic_records()
-RETURNS TRIGGER AS $$
-BEGIN
-    IF NEW.grade >= 9.5 THEN
-        UPDATE academic_record 
-        SET 
-            approved_courses = approved_courses + 1,
-            average = (
-                SELECT AVG(grade) 
-                FROM course_enrollment 
-                WHERE student_id = NEW.student_id AND grade >= 9.5
-            )
-        WHERE student_id = NEW.student_id;
+-- Trigger por instrução (FOR EACH STATEMENT) com transition tables: uma pauta
+-- inteira é processada numa só passagem. O academic_record guarda a soma e o
+-- número de notas aprovadas (>= 9.5), pelo que a média é atualizada de forma
+-- incremental a partir das diferenças entre a nota antiga e a nova, sem voltar
+-- a ler todas as inscrições do student.
+CREATE OR REPLACE FUNCTION update_academic_records()
+RETURNS TRIGGER AS $$
+DECLARE
+    student_ids INT[];
+    sum_deltas NUMERIC[];
+    count_deltas INT[];
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        SELECT array_agg(student_id), array_agg(sum_delta), array_agg(count_delta)
+        INTO student_ids, sum_deltas, count_deltas
+        FROM (
+            SELECT n.student_id,
+                   SUM(n.grade) AS sum_delta,
+                   COUNT(*)::INT AS count_delta
+            FROM new_rows n
+            WHERE n.grade >= 9.5
+            GROUP BY n.student_id
+        ) d;
+    ELSIF TG_OP = 'UPDATE' THEN
+        -- Correções de nota: retirar a nota antiga (se era aprovada) e somar a nova (se for)
+        SELECT array_agg(student_id), array_agg(sum_delta), array_agg(count_delta)
+        INTO student_ids, sum_deltas, count_deltas
+        FROM (
+            SELECT n.student_id,
+                   SUM(CASE WHEN n.grade >= 9.5 THEN n.grade ELSE 0 END
+                     - CASE WHEN o.grade >= 9.5 THEN o.grade ELSE 0 END) AS sum_delta,
+                   SUM(CASE WHEN n.grade >= 9.5 THEN 1 ELSE 0 END
+                     - CASE WHEN o.grade >= 9.5 THEN 1 ELSE 0 END)::INT AS count_delta
+            FROM new_rows n
+            JOIN old_rows o ON o.student_id = n.student_id AND o.edition_id = n.edition_id
+            WHERE n.grade IS DISTINCT FROM o.grade
+            GROUP BY n.student_id
+        ) d
+        WHERE sum_delta <> 0 OR count_delta <> 0;
+    ELSE
+        SELECT array_agg(student_id), array_agg(sum_delta), array_agg(count_delta)
+        INTO student_ids, sum_deltas, count_deltas
+        FROM (
+            SELECT o.student_id,
+                   -SUM(o.grade) AS sum_delta,
+                   -COUNT(*)::INT AS count_delta
+            FROM old_rows o
+            WHERE o.grade >= 9.5
+            GROUP BY o.student_id
+        ) d;
+    END IF;
+
+    IF student_ids IS NULL THEN
+        RETURN NULL;
+    END IF;
+
+    -- Aplicar todas as diferenças de uma vez (students removidos são ignorados)
+    INSERT INTO academic_record AS ar (student_id, approved_courses, approved_grade_sum, average)
+    SELECT d.student_id,
+           d.count_delta,
+           d.sum_delta,
+           CASE WHEN d.count_delta > 0 THEN d.sum_delta / d.count_delta ELSE 0 END
+    FROM unnest(student_ids, sum_deltas, count_deltas) AS d(student_id, sum_delta, count_delta)
+    WHERE EXISTS (SELECT 1 FROM student s WHERE s.user_id = d.student_id)
+    ON CONFLICT (student_id) DO UPDATE
+    SET approved_courses = COALESCE(ar.approved_courses, 0) + EXCLUDED.approved_courses,
+        approved_grade_sum = ar.approved_grade_sum + EXCLUDED.approved_grade_sum,
+        average = CASE
+            WHEN COALESCE(ar.approved_courses, 0) + EXCLUDED.approved_courses > 0
+            THEN (ar.approved_grade_sum + EXCLUDED.approved_grade_sum)
+                 / (COALESCE(ar.approved_courses, 0) + EXCLUDED.approved_courses)
+            ELSE 0
+        END;
+
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Recalcular todos os academic_record a partir de course_enrollment
+-- (usar uma vez depois de atualizar uma base de dados existente)
+CREATE OR REPLACE FUNCTION rebuild_academic_records()
+RETURNS VOID AS $$
+BEGIN
+    INSERT INTO academic_record AS ar (student_id, approved_courses, approved_grade_sum, average)
+    SELECT s.user_id,
+           COUNT(ce.grade),
+           COALESCE(SUM(ce.grade), 0),
+           COALESCE(AVG(ce.grade), 0)
+    FROM student s
+    LEFT JOIN course_enrollment ce ON ce.student_id = s.user_id AND ce.grade >= 9.5
+    GROUP BY s.user_id
+    ON CONFLICT (student_id) DO UPDATE
+    SET approved_courses = EXCLUDED.approved_courses,
+        approved_grade_sum = EXCLUDED.approved_grade_sum,
+        average = EXCLUDED.average;
+END;
+$$ LANGUAGE plpgsql;
+
+-- 3. Functions para os lugares de course_edition
+-- enrolled_count é mantido aqui nos dois sentidos, qualquer que seja a origem
+-- das inscrições (API, seeds, SQL de administração). O incremento toma o lock
+-- da linha de course_edition até ao commit, por isso duas inscrições
+-- concorrentes nunca ocupam o último lugar; a inscrição que ultrapassaria a
+-- capacidade falha com check_violation.
+CREATE OR REPLACE FUNCTION claim_course_seats()
+RETURNS TRIGGER AS $$
+BEGIN
+    UPDATE course_edition ced
+    SET enrolled_count = ced.enrolled_count + a.added
+    FROM (
+        SELECT edition_id, COUNT(*)::INT AS added
+        FROM new_rows
+        WHERE NOT is_soft_deleted(student_id)
+        GROUP BY edition_id
+    ) a
+    WHERE ced.edition_id = a.edition_id;
+
+    IF EXISTS (
+        SELECT 1
+        FROM course_edition ced
+        WHERE ced.edition_id IN (SELECT edition_id FROM new_rows)
+          AND ced.enrolled_count > ced.capacity
+    ) THEN
+        RAISE EXCEPTION 'Course edition is full' USING ERRCODE = 'check_violation';
+    END IF;
+
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION release_course_seats()
+RETURNS TRIGGER AS $$
+BEGIN
+    UPDATE course_edition ced
+    SET enrolled_count = GREATEST(ced.enrolled_count - d.removed, 0)
+    FROM (
+        SELECT edition_id, COUNT(*)::INT AS removed
+        FROM old_rows
+        WHERE NOT is_soft_deleted(student_id)
+        GROUP BY edition_id
+    ) d
+    WHERE ced.edition_id = d.edition_id;
+
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Recalcular enrolled_count a partir de course_enrollment
+-- (chamada por create_triggers depois deste script, e pelo admin)
+CREATE OR REPLACE FUNCTION rebuild_course_seats()
+RETURNS VOID AS $$
+BEGIN
+    UPDATE course_edition ced
+    SET enrolled_count = (
+        SELECT COUNT(*) FROM course_enrollment ce
+        WHERE ce.edition_id = ced.edition_id AND NOT is_soft_deleted(ce.student_id)
+    );
+END;
+$$ LANGUAGE plpgsql;
+
+-- 4. Functions para course_prerequisites
+-- Impedir ciclos (um curso não pode depender, direta ou indiretamente, de si próprio).
+-- Duas transações concorrentes podiam cada uma acrescentar metade de um ciclo sem
+-- ver a outra: o advisory lock serializa as verificações até ao commit, e a
+-- pesquisa, feita depois dele, já vê as alterações que confirmaram entretanto.
+CREATE OR REPLACE FUNCTION check_prerequisite_cycle()
+RETURNS TRIGGER AS $$
+BEGIN
+    PERFORM pg_advisory_xact_lock(hashtext('course_prerequisites'));
+
+    IF NEW.course_code = NEW.prerequisite_code OR EXISTS (
+        WITH RECURSIVE reachable(code) AS (
+            SELECT cp.prerequisite_code
+            FROM course_prerequisites cp
+            WHERE cp.course_code = NEW.prerequisite_code
+            UNION
+            SELECT cp.prerequisite_code
+            FROM course_prerequisites cp
+            JOIN reachable r ON cp.course_code = r.code
+        )
+        SELECT 1 FROM reachable WHERE code = NEW.course_code
+    ) THEN
+        RAISE EXCEPTION 'Prerequisite cycle: % cannot require %', NEW.course_code, NEW.prerequisite_code;
     END IF;
     RETURN NEW;
 END;
 $$ LANGUAGE plpgsql;
-'''
-CREATE OR REPLACE FUNCTION update_academic_records()
+
+-- Incrementar a versão para a API reconstruir o fecho transitivo em memória
+CREATE OR REPLACE FUNCTION bump_prerequisites_version()
+RETURNS TRIGGER AS $$
+BEGIN
+    INSERT INTO cache_version (name, version) VALUES ('course_prerequisites', 1)
+    ON CONFLICT (name) DO UPDATE SET version = cache_version.version + 1;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- 5. Functions para course_edition_summary
+-- approved_count é mantido de forma incremental a partir das transition tables
+-- de course_enrollment (o número de inscritos é course_edition.enrolled_count)
+CREATE OR REPLACE FUNCTION update_edition_approved_counts()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        INSERT INTO course_edition_summary AS s (edition_id, approved_count)
+        SELECT n.edition_id, COUNT(*)
+        FROM new_rows n
+        WHERE n.grade >= 9.5 AND NOT is_soft_deleted(n.student_id)
+        GROUP BY n.edition_id
+        ON CONFLICT (edition_id) DO UPDATE
+        SET approved_count = s.approved_count + EXCLUDED.approved_count;
+    ELSIF TG_OP = 'UPDATE' THEN
+        INSERT INTO course_edition_summary AS s (edition_id, approved_count)
+        SELECT d.edition_id, d.delta
+        FROM (
+            SELECT n.edition_id,
+                   SUM(CASE WHEN n.grade >= 9.5 THEN 1 ELSE 0 END
+                     - CASE WHEN o.grade >= 9.5 THEN 1 ELSE 0 END)::INT AS delta
+            FROM new_rows n
+            JOIN old_rows o ON o.student_id = n.student_id AND o.edition_id = n.edition_id
+            WHERE n.grade IS DISTINCT FROM o.grade AND NOT is_soft_deleted(n.student_id)
+            GROUP BY n.edition_id
+        ) d
+        WHERE d.delta <> 0
+        ON CONFLICT (edition_id) DO UPDATE
+        SET approved_count = s.approved_count + EXCLUDED.approved_count;
+    ELSE
+        UPDATE course_edition_summary s
+        SET approved_count = GREATEST(s.approved_count - d.removed, 0)
+        FROM (
+            SELECT o.edition_id, COUNT(*)::INT AS removed
+            FROM old_rows o
+            WHERE o.grade >= 9.5 AND NOT is_soft_deleted(o.student_id)
+            GROUP BY o.edition_id
+        ) d
+        WHERE s.edition_id = d.edition_id;
+    END IF;
+
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Lista de docentes da edição (atribuições são raras, recalcula só a edição afetada)
+CREATE OR REPLACE FUNCTION update_edition_instructors()
+RETURNS TRIGGER AS $$
+DECLARE
+    affected_edition INT;
+BEGIN
+    FOREACH affected_edition IN ARRAY ARRAY[
+        CASE WHEN TG_OP <> 'DELETE' THEN NEW.edition_id END,
+        CASE WHEN TG_OP <> 'INSERT' THEN OLD.edition_id END
+    ] LOOP
+        CONTINUE WHEN affected_edition IS NULL;
+        INSERT INTO course_edition_summary AS s (edition_id, instructors)
+        SELECT affected_edition,
+               COALESCE(ARRAY_AGG(DISTINCT ia.instructor_id ORDER BY ia.instructor_id), '{}')
+        FROM instructor_assignment ia
+        WHERE ia.edition_id = affected_edition
+        ON CONFLICT (edition_id) DO UPDATE
+        SET instructors = EXCLUDED.instructors;
+    END LOOP;
+
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION create_course_edition_summary()
+RETURNS TRIGGER AS $$
+BEGIN
+    INSERT INTO course_edition_summary (edition_id)
+    VALUES (NEW.edition_id)
+    ON CONFLICT (edition_id) DO NOTHING;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Reconstruir o resumo de raiz a partir de course_enrollment e instructor_assignment
+CREATE OR REPLACE FUNCTION rebuild_course_edition_summary()
+RETURNS VOID AS $$
+BEGIN
+    INSERT INTO course_edition_summary AS s (edition_id, approved_count, instructors)
+    SELECT ced.edition_id,
+           (SELECT COUNT(*) FROM course_enrollment ce
+            WHERE ce.edition_id = ced.edition_id AND ce.grade >= 9.5
+              AND NOT is_soft_deleted(ce.student_id)),
+           COALESCE((SELECT ARRAY_AGG(DISTINCT ia.instructor_id ORDER BY ia.instructor_id)
+                     FROM instructor_assignment ia
+                     WHERE ia.edition_id = ced.edition_id), '{}')
+    FROM course_edition ced
+    ON CONFLICT (edition_id) DO UPDATE
+    SET approved_count = EXCLUDED.approved_count,
+        instructors = EXCLUDED.instructors;
+END;
+$$ LANGUAGE plpgsql;
+
+-- 6. Functions para os rankings de médias
+-- Soma e número de notas por student e ano, atualizados de forma incremental
+-- (todas as notas lançadas contam, aprovadas ou não)
+CREATE OR REPLACE FUNCTION update_grade_rankings()
 RETURNS TRIGGER AS $$
 DECLARE
-    current_avg NUMERIC;
-    course_count INTEGER;
-BEGIN
-    -- Debug inicial
-    RAISE NOTICE '🔍 TRIGGER INICIADO: student=%, new_grade=%, old_grade=%', 
-        NEW.student_id, NEW.grade, OLD.grade;
-
-    -- Verificar se grade é válida e >= 9.5
-    IF NEW.grade IS NOT NULL AND NEW.grade >= 9.5 THEN
-        RAISE NOTICE '✅ Student % APROVADO com %', NEW.student_id, NEW.grade;
-        
-        -- Verificar se academic_record existe
-        SELECT COUNT(*) INTO course_count FROM academic_record WHERE student_id = NEW.student_id;
-        RAISE NOTICE '📊 Academic_record existe? %', (course_count > 0);
-        
-        -- Calcular média atual
-        SELECT COALESCE(AVG(grade), 0) INTO current_avg
-        FROM course_enrollment 
-        WHERE student_id = NEW.student_id AND grade >= 9.5;
-        
-        RAISE NOTICE '📈 Média calculada: %', current_avg;
-        
-        -- Se academic_record não existe, criar
-        IF course_count = 0 THEN
-            RAISE NOTICE '👤 CRIANDO academic_record para student %', NEW.student_id;
-            INSERT INTO academic_record (student_id, degree_id, enrollment_date, approved_courses, average)
-            SELECT 
-                NEW.student_id,
-                de.degree_id,
-                de.enrollment_date,
-                0,
-                0
-            FROM degree_enrollment de
-            WHERE de.student_id = NEW.student_id
-            LIMIT 1
-            RETURNING record_id;
-            
-            RAISE NOTICE '📝 Academic_record criado';
+    student_ids INT[];
+    edition_ids INT[];
+    sum_deltas NUMERIC[];
+    count_deltas INT[];
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        SELECT array_agg(n.student_id), array_agg(n.edition_id), array_agg(n.grade), array_agg(1)
+        INTO student_ids, edition_ids, sum_deltas, count_deltas
+        FROM new_rows n
+        WHERE n.grade IS NOT NULL AND NOT is_soft_deleted(n.student_id);
+    ELSIF TG_OP = 'UPDATE' THEN
+        SELECT array_agg(n.student_id), array_agg(n.edition_id),
+               array_agg(COALESCE(n.grade, 0) - COALESCE(o.grade, 0)),
+               array_agg((n.grade IS NOT NULL)::INT - (o.grade IS NOT NULL)::INT)
+        INTO student_ids, edition_ids, sum_deltas, count_deltas
+        FROM new_rows n
+        JOIN old_rows o ON o.student_id = n.student_id AND o.edition_id = n.edition_id
+        WHERE n.grade IS DISTINCT FROM o.grade AND NOT is_soft_deleted(n.student_id);
+    ELSE
+        SELECT array_agg(o.student_id), array_agg(o.edition_id), array_agg(-o.grade), array_agg(-1)
+        INTO student_ids, edition_ids, sum_deltas, count_deltas
+        FROM old_rows o
+        WHERE o.grade IS NOT NULL AND NOT is_soft_deleted(o.student_id);
+    END IF;
+
+    IF student_ids IS NULL THEN
+        RETURN NULL;
+    END IF;
+
+    INSERT INTO student_year_average AS sya (student_id, year, grade_sum, grade_count, average)
+    SELECT d.student_id, ced.year, SUM(d.sum_delta), SUM(d.count_delta),
+           CASE WHEN SUM(d.count_delta) > 0 THEN SUM(d.sum_delta) / SUM(d.count_delta) END
+    FROM unnest(student_ids, edition_ids, sum_deltas, count_deltas) AS d(student_id, edition_id, sum_delta, count_delta)
+    JOIN course_edition ced ON ced.edition_id = d.edition_id
+    WHERE EXISTS (SELECT 1 FROM student s WHERE s.user_id = d.student_id)
+    GROUP BY d.student_id, ced.year
+    ON CONFLICT (student_id, year) DO UPDATE
+    SET grade_sum = sya.grade_sum + EXCLUDED.grade_sum,
+        grade_count = sya.grade_count + EXCLUDED.grade_count,
+        average = CASE
+            WHEN sya.grade_count + EXCLUDED.grade_count > 0
+            THEN (sya.grade_sum + EXCLUDED.grade_sum) / (sya.grade_count + EXCLUDED.grade_count)
+        END;
+
+    -- Média global (todos os anos), com o distrito do student para o ranking por distrito
+    INSERT INTO student_average AS sa (student_id, district, grade_sum, grade_count, average)
+    SELECT d.student_id, s.district, SUM(d.sum_delta), SUM(d.count_delta),
+           CASE WHEN SUM(d.count_delta) > 0 THEN SUM(d.sum_delta) / SUM(d.count_delta) END
+    FROM unnest(student_ids, sum_deltas, count_deltas) AS d(student_id, sum_delta, count_delta)
+    JOIN student s ON s.user_id = d.student_id
+    GROUP BY d.student_id, s.district
+    ON CONFLICT (student_id) DO UPDATE
+    SET grade_sum = sa.grade_sum + EXCLUDED.grade_sum,
+        grade_count = sa.grade_count + EXCLUDED.grade_count,
+        average = CASE
+            WHEN sa.grade_count + EXCLUDED.grade_count > 0
+            THEN (sa.grade_sum + EXCLUDED.grade_sum) / (sa.grade_count + EXCLUDED.grade_count)
+        END;
+
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- degree_year_average acompanha student_year_average (uma linha por degree do
+-- student) e as inscrições em degrees. As linhas de student_year_average nunca
+-- mudam de chave (as alterações são ON CONFLICT DO UPDATE).
+CREATE OR REPLACE FUNCTION update_degree_year_average()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_TABLE_NAME = 'student_year_average' THEN
+        IF TG_OP = 'INSERT' THEN
+            INSERT INTO degree_year_average (student_id, degree_id, year, grade_count, average)
+            SELECT n.student_id, de.degree_id, n.year, n.grade_count, n.average
+            FROM new_rows n
+            JOIN degree_enrollment de ON de.student_id = n.student_id
+            ON CONFLICT (student_id, degree_id, year) DO UPDATE
+            SET grade_count = EXCLUDED.grade_count, average = EXCLUDED.average;
+        ELSIF TG_OP = 'UPDATE' THEN
+            UPDATE degree_year_average dya
+            SET grade_count = n.grade_count, average = n.average
+            FROM new_rows n
+            WHERE dya.student_id = n.student_id AND dya.year = n.year;
+        ELSE
+            DELETE FROM degree_year_average dya
+            USING old_rows o
+            WHERE dya.student_id = o.student_id AND dya.year = o.year;
+        END IF;
+    ELSE
+        IF TG_OP IN ('UPDATE', 'DELETE') THEN
+            DELETE FROM degree_year_average dya
+            USING old_rows o
+            WHERE dya.student_id = o.student_id AND dya.degree_id = o.degree_id;
+        END IF;
+        IF TG_OP IN ('INSERT', 'UPDATE') THEN
+            INSERT INTO degree_year_average (student_id, degree_id, year, grade_count, average)
+            SELECT n.student_id, n.degree_id, sya.year, sya.grade_count, sya.average
+            FROM new_rows n
+            JOIN student_year_average sya ON sya.student_id = n.student_id
+            ON CONFLICT (student_id, degree_id, year) DO UPDATE
+            SET grade_count = EXCLUDED.grade_count, average = EXCLUDED.average;
         END IF;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
 
-        -- Atualizar academic_record
-        RAISE NOTICE '🔄 ATUALIZANDO academic_record para student %', NEW.student_id;
-        
-        UPDATE academic_record 
-        SET 
-            approved_courses = approved_courses + 1,
-            average = current_avg
-        WHERE student_id = NEW.student_id;
-        
-        -- Verificar se update funcionou
-        GET DIAGNOSTICS course_count = ROW_COUNT;
-        RAISE NOTICE '✅ Update afectou % linhas', course_count;
-        
+-- Melhor média de cada distrito afetado por alterações em student_average.
+-- As linhas de district_best são bloqueadas (por ordem, sem deadlocks) antes de
+-- recalcular o máximo, para que transações concorrentes vejam as alterações
+-- umas das outras; o máximo vem do índice (district, average DESC).
+CREATE OR REPLACE FUNCTION refresh_district_best()
+RETURNS TRIGGER AS $$
+DECLARE
+    districts TEXT[];
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        SELECT array_agg(DISTINCT district) INTO districts
+        FROM new_rows WHERE district IS NOT NULL;
+    ELSIF TG_OP = 'UPDATE' THEN
+        SELECT array_agg(DISTINCT district) INTO districts
+        FROM (SELECT district FROM new_rows UNION SELECT district FROM old_rows) d
+        WHERE district IS NOT NULL;
     ELSE
-        RAISE NOTICE '❌ NÃO APROVADO: student=%, grade=%', NEW.student_id, NEW.grade;
+        SELECT array_agg(DISTINCT district) INTO districts
+        FROM old_rows WHERE district IS NOT NULL;
     END IF;
-    
-    RETURN NEW;
+
+    IF districts IS NULL THEN
+        RETURN NULL;
+    END IF;
+
+    INSERT INTO district_best (district)
+    SELECT unnest(districts)
+    ON CONFLICT (district) DO NOTHING;
+
+    PERFORM 1 FROM district_best
+    WHERE district = ANY(districts)
+    ORDER BY district
+    FOR UPDATE;
+
+    UPDATE district_best db
+    SET best_average = (
+        SELECT MAX(sa.average)
+        FROM student_average sa
+        WHERE sa.district = db.district AND sa.grade_count > 0
+    )
+    WHERE db.district = ANY(districts);
+
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Mudança de distrito de um student
+CREATE OR REPLACE FUNCTION update_student_average_district()
+RETURNS TRIGGER AS $$
+BEGIN
+    UPDATE student_average
+    SET district = NEW.district
+    WHERE student_id = NEW.user_id;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Reconstruir student_year_average, student_average e district_best a partir de
+-- course_enrollment (degree_year_average é refeita pelos triggers de student_year_average)
+CREATE OR REPLACE FUNCTION rebuild_grade_rankings()
+RETURNS VOID AS $$
+BEGIN
+    DELETE FROM degree_year_average;
+    DELETE FROM student_year_average;
+    INSERT INTO student_year_average (student_id, year, grade_sum, grade_count, average)
+    SELECT ce.student_id, ced.year, SUM(ce.grade), COUNT(*), AVG(ce.grade)
+    FROM course_enrollment ce
+    JOIN course_edition ced ON ced.edition_id = ce.edition_id
+    JOIN student s ON s.user_id = ce.student_id
+    WHERE ce.grade IS NOT NULL AND s.deleted_at IS NULL
+    GROUP BY ce.student_id, ced.year;
+
+    DELETE FROM student_average;
+    INSERT INTO student_average (student_id, district, grade_sum, grade_count, average)
+    SELECT ce.student_id, s.district, SUM(ce.grade), COUNT(*), AVG(ce.grade)
+    FROM course_enrollment ce
+    JOIN student s ON s.user_id = ce.student_id
+    WHERE ce.grade IS NOT NULL AND s.deleted_at IS NULL
+    GROUP BY ce.student_id, s.district;
+
+    DELETE FROM district_best;
+    INSERT INTO district_best (district, best_average)
+    SELECT district, MAX(average)
+    FROM student_average
+    WHERE district IS NOT NULL AND grade_count > 0
+    GROUP BY district;
 END;
 $$ LANGUAGE plpgsql;
 
--- 3. Drop e create triggers com IF EXISTS
+-- 7. Functions para o relatório mensal
+-- Cada nota conta no mês de evaluated_at (notas antigas sem data contam em
+-- janeiro do ano da edição). Uma alteração retira a contribuição antiga e
+-- soma a nova, o que também move a nota de mês se for relançada.
+CREATE OR REPLACE FUNCTION update_monthly_stats()
+RETURNS TRIGGER AS $$
+DECLARE
+    months DATE[];
+    edition_ids INT[];
+    evaluated_deltas INT[];
+    approved_deltas INT[];
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        SELECT array_agg(month), array_agg(edition_id), array_agg(evaluated), array_agg(approved)
+        INTO months, edition_ids, evaluated_deltas, approved_deltas
+        FROM (
+            SELECT COALESCE(date_trunc('month', n.evaluated_at)::DATE, make_date(ced.year, 1, 1)) AS month,
+                   n.edition_id,
+                   COUNT(*)::INT AS evaluated,
+                   COUNT(*) FILTER (WHERE n.grade >= 9.5)::INT AS approved
+            FROM new_rows n
+            JOIN course_edition ced ON ced.edition_id = n.edition_id
+            WHERE n.grade IS NOT NULL AND NOT is_soft_deleted(n.student_id)
+            GROUP BY 1, 2
+        ) d;
+    ELSIF TG_OP = 'UPDATE' THEN
+        SELECT array_agg(month), array_agg(edition_id), array_agg(evaluated), array_agg(approved)
+        INTO months, edition_ids, evaluated_deltas, approved_deltas
+        FROM (
+            SELECT month, edition_id, SUM(evaluated)::INT AS evaluated, SUM(approved)::INT AS approved
+            FROM (
+                SELECT COALESCE(date_trunc('month', n.evaluated_at)::DATE, make_date(ced.year, 1, 1)) AS month,
+                       n.edition_id,
+                       (n.grade IS NOT NULL)::INT AS evaluated,
+                       (n.grade >= 9.5 AND n.grade IS NOT NULL)::INT AS approved
+                FROM new_rows n
+                JOIN old_rows o ON o.student_id = n.student_id AND o.edition_id = n.edition_id
+                JOIN course_edition ced ON ced.edition_id = n.edition_id
+                WHERE (n.grade IS DISTINCT FROM o.grade OR n.evaluated_at IS DISTINCT FROM o.evaluated_at)
+                  AND NOT is_soft_deleted(n.student_id)
+                UNION ALL
+                SELECT COALESCE(date_trunc('month', o.evaluated_at)::DATE, make_date(ced.year, 1, 1)),
+                       o.edition_id,
+                       -(o.grade IS NOT NULL)::INT,
+                       -(o.grade >= 9.5 AND o.grade IS NOT NULL)::INT
+                FROM old_rows o
+                JOIN new_rows n ON n.student_id = o.student_id AND n.edition_id = o.edition_id
+                JOIN course_edition ced ON ced.edition_id = o.edition_id
+                WHERE (n.grade IS DISTINCT FROM o.grade OR n.evaluated_at IS DISTINCT FROM o.evaluated_at)
+                  AND NOT is_soft_deleted(o.student_id)
+            ) c
+            GROUP BY month, edition_id
+        ) d
+        WHERE evaluated <> 0 OR approved <> 0;
+    ELSE
+        SELECT array_agg(month), array_agg(edition_id), array_agg(-evaluated), array_agg(-approved)
+        INTO months, edition_ids, evaluated_deltas, approved_deltas
+        FROM (
+            SELECT COALESCE(date_trunc('month', o.evaluated_at)::DATE, make_date(ced.year, 1, 1)) AS month,
+                   o.edition_id,
+                   COUNT(*)::INT AS evaluated,
+                   COUNT(*) FILTER (WHERE o.grade >= 9.5)::INT AS approved
+            FROM old_rows o
+            JOIN course_edition ced ON ced.edition_id = o.edition_id
+            WHERE o.grade IS NOT NULL AND NOT is_soft_deleted(o.student_id)
+            GROUP BY 1, 2
+        ) d;
+    END IF;
+
+    IF months IS NULL THEN
+        RETURN NULL;
+    END IF;
+
+    INSERT INTO monthly_edition_stats AS m (month, edition_id, evaluated, approved)
+    SELECT d.month, d.edition_id, d.evaluated, d.approved
+    FROM unnest(months, edition_ids, evaluated_deltas, approved_deltas) AS d(month, edition_id, evaluated, approved)
+    WHERE EXISTS (SELECT 1 FROM course_edition ced WHERE ced.edition_id = d.edition_id)
+    ON CONFLICT (month, edition_id) DO UPDATE
+    SET evaluated = m.evaluated + EXCLUDED.evaluated,
+        approved = m.approved + EXCLUDED.approved;
+
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Reconstruir monthly_edition_stats a partir de course_enrollment
+CREATE OR REPLACE FUNCTION rebuild_monthly_stats()
+RETURNS VOID AS $$
+BEGIN
+    DELETE FROM monthly_edition_stats;
+    INSERT INTO monthly_edition_stats (month, edition_id, evaluated, approved)
+    SELECT COALESCE(date_trunc('month', ce.evaluated_at)::DATE, make_date(ced.year, 1, 1)),
+           ce.edition_id,
+           COUNT(*),
+           COUNT(*) FILTER (WHERE ce.grade >= 9.5)
+    FROM course_enrollment ce
+    JOIN course_edition ced ON ced.edition_id = ce.edition_id
+    WHERE ce.grade IS NOT NULL AND NOT is_soft_deleted(ce.student_id)
+    GROUP BY 1, 2;
+END;
+$$ LANGUAGE plpgsql;
+
+-- 8. Functions para o soft delete de students
+-- Um student com deleted_at deixa de contar nos agregados: as suas contribuições
+-- são retiradas quando é marcado e os triggers acima ignoram as suas linhas, para
+-- que o purge (que apaga course_enrollment antes de student) não as retire outra vez.
+CREATE OR REPLACE FUNCTION is_soft_deleted(p_student_id INT)
+RETURNS BOOLEAN AS $$
+    SELECT EXISTS (
+        SELECT 1 FROM student
+        WHERE user_id = p_student_id AND deleted_at IS NOT NULL
+    );
+$$ LANGUAGE sql STABLE;
+
+CREATE OR REPLACE FUNCTION soft_delete_student()
+RETURNS TRIGGER AS $$
+BEGIN
+    UPDATE course_edition ced
+    SET enrolled_count = GREATEST(ced.enrolled_count - d.removed, 0)
+    FROM (
+        SELECT edition_id, COUNT(*)::INT AS removed
+        FROM course_enrollment
+        WHERE student_id = NEW.user_id
+        GROUP BY edition_id
+    ) d
+    WHERE ced.edition_id = d.edition_id;
+
+    UPDATE course_edition_summary s
+    SET approved_count = GREATEST(s.approved_count - d.removed, 0)
+    FROM (
+        SELECT edition_id, COUNT(*)::INT AS removed
+        FROM course_enrollment
+        WHERE student_id = NEW.user_id AND grade >= 9.5
+        GROUP BY edition_id
+    ) d
+    WHERE s.edition_id = d.edition_id;
+
+    UPDATE monthly_edition_stats m
+    SET evaluated = m.evaluated - d.evaluated,
+        approved = m.approved - d.approved
+    FROM (
+        SELECT COALESCE(date_trunc('month', ce.evaluated_at)::DATE, make_date(ced.year, 1, 1)) AS month,
+               ce.edition_id,
+               COUNT(*)::INT AS evaluated,
+               COUNT(*) FILTER (WHERE ce.grade >= 9.5)::INT AS approved
+        FROM course_enrollment ce
+        JOIN course_edition ced ON ced.edition_id = ce.edition_id
+        WHERE ce.student_id = NEW.user_id AND ce.grade IS NOT NULL
+        GROUP BY 1, 2
+    ) d
+    WHERE m.month = d.month AND m.edition_id = d.edition_id;
+
+    -- district_best é recalculado pelos triggers de student_average
+    DELETE FROM student_year_average WHERE student_id = NEW.user_id;
+    DELETE FROM student_average WHERE student_id = NEW.user_id;
+
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- 9. Functions para a cache de dados de referência da API
+-- Avisar os processos da API (LISTEN reference_data) de que degree_program,
+-- activity, course ou course_edition mudaram. A notificação só é entregue no
+-- commit e as repetidas na mesma transação chegam como uma só.
+CREATE OR REPLACE FUNCTION notify_reference_data_changed()
+RETURNS TRIGGER AS $$
+BEGIN
+    PERFORM pg_notify('reference_data', TG_TABLE_NAME);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- 10. Functions para as caches por student da API
+-- Avisar os processos da API (LISTEN student_data) de que as inscrições, notas
+-- ou o soft delete de students mudaram: uma notificação por statement com os
+-- student_ids (distintos) separados por vírgulas. Como em reference_data, só
+-- são entregues no commit e as repetidas chegam uma vez.
+CREATE OR REPLACE FUNCTION notify_student_data_changed()
+RETURNS TRIGGER AS $$
+DECLARE
+    student_ids INT[];
+    i INT;
+BEGIN
+    IF TG_TABLE_NAME = 'student' THEN
+        IF TG_OP = 'DELETE' THEN
+            SELECT array_agg(o.user_id) INTO student_ids FROM old_rows o;
+        ELSE
+            SELECT array_agg(n.user_id) INTO student_ids
+            FROM new_rows n
+            JOIN old_rows o ON o.user_id = n.user_id
+            WHERE n.deleted_at IS DISTINCT FROM o.deleted_at;
+        END IF;
+    ELSIF TG_OP = 'INSERT' THEN
+        SELECT array_agg(DISTINCT n.student_id) INTO student_ids FROM new_rows n;
+    ELSIF TG_OP = 'DELETE' THEN
+        SELECT array_agg(DISTINCT o.student_id) INTO student_ids FROM old_rows o;
+    ELSE
+        SELECT array_agg(DISTINCT n.student_id) INTO student_ids
+        FROM new_rows n
+        JOIN old_rows o ON o.student_id = n.student_id AND o.edition_id = n.edition_id
+        WHERE (n.grade, n.evaluation_period, n.attendance) IS DISTINCT FROM (o.grade, o.evaluation_period, o.attendance);
+    END IF;
+
+    -- O payload tem no máximo 8000 bytes: 500 student_ids por notificação
+    FOR i IN 1 .. COALESCE(array_length(student_ids, 1), 0) BY 500 LOOP
+        PERFORM pg_notify('student_data', array_to_string(student_ids[i:i + 499], ','));
+    END LOOP;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- 11. Drop e create triggers com IF EXISTS
 DROP TRIGGER IF EXISTS trigger_after_degree_enrollment ON degree_enrollment;
 CREATE TRIGGER trigger_after_degree_enrollment
     AFTER INSERT ON degree_enrollment
     FOR EACH ROW
     EXECUTE FUNCTION create_financial_account();
 
+DROP TRIGGER IF EXISTS trigger_financial_transaction_append_only ON financial_transaction;
+CREATE TRIGGER trigger_financial_transaction_append_only
+    BEFORE UPDATE OF account_id, amount, description, transaction_date, activity_id, degree_id ON financial_transaction
+    FOR EACH ROW
+    EXECUTE FUNCTION reject_financial_transaction_update();
+
+-- Transition tables não podem ser usadas com listas de colunas nem com mais
+-- do que um evento por trigger, daí um trigger por operação
+DROP TRIGGER IF EXISTS trigger_after_grade_insert ON course_enrollment;
+CREATE TRIGGER trigger_after_grade_insert
+    AFTER INSERT ON course_enrollment
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT
+    EXECUTE FUNCTION update_academic_records();
+
 DROP TRIGGER IF EXISTS trigger_after_grade_update ON course_enrollment;
 CREATE TRIGGER trigger_after_grade_update
-    AFTER UPDATE OF grade ON course_enrollment
+    AFTER UPDATE ON course_enrollment
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT
+    EXECUTE FUNCTION update_academic_records();
+
+DROP TRIGGER IF EXISTS trigger_after_grade_delete ON course_enrollment;
+CREATE TRIGGER trigger_after_grade_delete
+    AFTER DELETE ON course_enrollment
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT
+    EXECUTE FUNCTION update_academic_records();
+
+DROP TRIGGER IF EXISTS trigger_claim_course_seats ON course_enrollment;
+CREATE TRIGGER trigger_claim_course_seats
+    AFTER INSERT ON course_enrollment
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT
+    EXECUTE FUNCTION claim_course_seats();
+
+DROP TRIGGER IF EXISTS trigger_release_course_seats ON course_enrollment;
+CREATE TRIGGER trigger_release_course_seats
+    AFTER DELETE ON course_enrollment
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT
+    EXECUTE FUNCTION release_course_seats();
+
+DROP TRIGGER IF EXISTS trigger_check_prerequisite_cycle ON course_prerequisites;
+CREATE TRIGGER trigger_check_prerequisite_cycle
+    BEFORE INSERT OR UPDATE ON course_prerequisites
+    FOR EACH ROW
+    EXECUTE FUNCTION check_prerequisite_cycle();
+
+DROP TRIGGER IF EXISTS trigger_prerequisites_changed ON course_prerequisites;
+CREATE TRIGGER trigger_prerequisites_changed
+    AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON course_prerequisites
+    FOR EACH STATEMENT
+    EXECUTE FUNCTION bump_prerequisites_version();
+
+DROP TRIGGER IF EXISTS trigger_edition_approved_insert ON course_enrollment;
+CREATE TRIGGER trigger_edition_approved_insert
+    AFTER INSERT ON course_enrollment
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT
+    EXECUTE FUNCTION update_edition_approved_counts();
+
+DROP TRIGGER IF EXISTS trigger_edition_approved_update ON course_enrollment;
+CREATE TRIGGER trigger_edition_approved_update
+    AFTER UPDATE ON course_enrollment
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT
+    EXECUTE FUNCTION update_edition_approved_counts();
+
+DROP TRIGGER IF EXISTS trigger_edition_approved_delete ON course_enrollment;
+CREATE TRIGGER trigger_edition_approved_delete
+    AFTER DELETE ON course_enrollment
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT
+    EXECUTE FUNCTION update_edition_approved_counts();
+
+DROP TRIGGER IF EXISTS trigger_edition_instructors ON instructor_assignment;
+CREATE TRIGGER trigger_edition_instructors
+    AFTER INSERT OR UPDATE OR DELETE ON instructor_assignment
+    FOR EACH ROW
+    EXECUTE FUNCTION update_edition_instructors();
+
+DROP TRIGGER IF EXISTS trigger_create_edition_summary ON course_edition;
+CREATE TRIGGER trigger_create_edition_summary
+    AFTER INSERT ON course_edition
+    FOR EACH ROW
+    EXECUTE FUNCTION create_course_edition_summary();
+
+DROP TRIGGER IF EXISTS trigger_grade_rankings_insert ON course_enrollment;
+CREATE TRIGGER trigger_grade_rankings_insert
+    AFTER INSERT ON course_enrollment
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT
+    EXECUTE FUNCTION update_grade_rankings();
+
+DROP TRIGGER IF EXISTS trigger_grade_rankings_update ON course_enrollment;
+CREATE TRIGGER trigger_grade_rankings_update
+    AFTER UPDATE ON course_enrollment
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT
+    EXECUTE FUNCTION update_grade_rankings();
+
+DROP TRIGGER IF EXISTS trigger_grade_rankings_delete ON course_enrollment;
+CREATE TRIGGER trigger_grade_rankings_delete
+    AFTER DELETE ON course_enrollment
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT
+    EXECUTE FUNCTION update_grade_rankings();
+
+DROP TRIGGER IF EXISTS trigger_degree_year_average_insert ON student_year_average;
+CREATE TRIGGER trigger_degree_year_average_insert
+    AFTER INSERT ON student_year_average
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT
+    EXECUTE FUNCTION update_degree_year_average();
+
+DROP TRIGGER IF EXISTS trigger_degree_year_average_update ON student_year_average;
+CREATE TRIGGER trigger_degree_year_average_update
+    AFTER UPDATE ON student_year_average
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT
+    EXECUTE FUNCTION update_degree_year_average();
+
+DROP TRIGGER IF EXISTS trigger_degree_year_average_delete ON student_year_average;
+CREATE TRIGGER trigger_degree_year_average_delete
+    AFTER DELETE ON student_year_average
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT
+    EXECUTE FUNCTION update_degree_year_average();
+
+DROP TRIGGER IF EXISTS trigger_degree_enrollment_ranking_insert ON degree_enrollment;
+CREATE TRIGGER trigger_degree_enrollment_ranking_insert
+    AFTER INSERT ON degree_enrollment
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT
+    EXECUTE FUNCTION update_degree_year_average();
+
+DROP TRIGGER IF EXISTS trigger_degree_enrollment_ranking_update ON degree_enrollment;
+CREATE TRIGGER trigger_degree_enrollment_ranking_update
+    AFTER UPDATE ON degree_enrollment
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT
+    EXECUTE FUNCTION update_degree_year_average();
+
+DROP TRIGGER IF EXISTS trigger_degree_enrollment_ranking_delete ON degree_enrollment;
+CREATE TRIGGER trigger_degree_enrollment_ranking_delete
+    AFTER DELETE ON degree_enrollment
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT
+    EXECUTE FUNCTION update_degree_year_average();
+
+DROP TRIGGER IF EXISTS trigger_student_district_changed ON student;
+CREATE TRIGGER trigger_student_district_changed
+    AFTER UPDATE OF district ON student
     FOR EACH ROW
-    EXECUTE FUNCTION update_academic_records();
\ No newline at end of file
+    WHEN (OLD.district IS DISTINCT FROM NEW.district)
+    EXECUTE FUNCTION update_student_average_district();
+
+DROP TRIGGER IF EXISTS trigger_district_best_insert ON student_average;
+CREATE TRIGGER trigger_district_best_insert
+    AFTER INSERT ON student_average
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT
+    EXECUTE FUNCTION refresh_district_best();
+
+DROP TRIGGER IF EXISTS trigger_district_best_update ON student_average;
+CREATE TRIGGER trigger_district_best_update
+    AFTER UPDATE ON student_average
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT
+    EXECUTE FUNCTION refresh_district_best();
+
+DROP TRIGGER IF EXISTS trigger_district_best_delete ON student_average;
+CREATE TRIGGER trigger_district_best_delete
+    AFTER DELETE ON student_average
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT
+    EXECUTE FUNCTION refresh_district_best();
+
+DROP TRIGGER IF EXISTS trigger_monthly_stats_insert ON course_enrollment;
+CREATE TRIGGER trigger_monthly_stats_insert
+    AFTER INSERT ON course_enrollment
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT
+    EXECUTE FUNCTION update_monthly_stats();
+
+DROP TRIGGER IF EXISTS trigger_monthly_stats_update ON course_enrollment;
+CREATE TRIGGER trigger_monthly_stats_update
+    AFTER UPDATE ON course_enrollment
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT
+    EXECUTE FUNCTION update_monthly_stats();
+
+DROP TRIGGER IF EXISTS trigger_monthly_stats_delete ON course_enrollment;
+CREATE TRIGGER trigger_monthly_stats_delete
+    AFTER DELETE ON course_enrollment
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT
+    EXECUTE FUNCTION update_monthly_stats();
+
+DROP TRIGGER IF EXISTS trigger_student_soft_deleted ON student;
+CREATE TRIGGER trigger_student_soft_deleted
+    AFTER UPDATE OF deleted_at ON student
+    FOR EACH ROW
+    WHEN (OLD.deleted_at IS NULL AND NEW.deleted_at IS NOT NULL)
+    EXECUTE FUNCTION soft_delete_student();
+
+DROP TRIGGER IF EXISTS trigger_degree_program_changed ON degree_program;
+CREATE TRIGGER trigger_degree_program_changed
+    AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON degree_program
+    FOR EACH STATEMENT
+    EXECUTE FUNCTION notify_reference_data_changed();
+
+DROP TRIGGER IF EXISTS trigger_activity_changed ON activity;
+CREATE TRIGGER trigger_activity_changed
+    AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON activity
+    FOR EACH STATEMENT
+    EXECUTE FUNCTION notify_reference_data_changed();
+
+DROP TRIGGER IF EXISTS trigger_course_changed ON course;
+CREATE TRIGGER trigger_course_changed
+    AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON course
+    FOR EACH STATEMENT
+    EXECUTE FUNCTION notify_reference_data_changed();
+
+-- enrolled_count, atualizado em cada inscrição, não faz parte da cache
+DROP TRIGGER IF EXISTS trigger_course_edition_changed ON course_edition;
+CREATE TRIGGER trigger_course_edition_changed
+    AFTER INSERT OR DELETE OR TRUNCATE OR UPDATE OF course_code, year, capacity, coordinator_id ON course_edition
+    FOR EACH STATEMENT
+    EXECUTE FUNCTION notify_reference_data_changed();
+
+-- Antigos triggers por linha
+DROP TRIGGER IF EXISTS trigger_student_enrollment_changed ON course_enrollment;
+DROP TRIGGER IF EXISTS trigger_student_data_changed ON student;
+
+DROP TRIGGER IF EXISTS trigger_student_enrollment_changed_insert ON course_enrollment;
+CREATE TRIGGER trigger_student_enrollment_changed_insert
+    AFTER INSERT ON course_enrollment
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT
+    EXECUTE FUNCTION notify_student_data_changed();
+
+DROP TRIGGER IF EXISTS trigger_student_enrollment_changed_update ON course_enrollment;
+CREATE TRIGGER trigger_student_enrollment_changed_update
+    AFTER UPDATE ON course_enrollment
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT
+    EXECUTE FUNCTION notify_student_data_changed();
+
+DROP TRIGGER IF EXISTS trigger_student_enrollment_changed_delete ON course_enrollment;
+CREATE TRIGGER trigger_student_enrollment_changed_delete
+    AFTER DELETE ON course_enrollment
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT
+    EXECUTE FUNCTION notify_student_data_changed();
+
+DROP TRIGGER IF EXISTS trigger_student_data_changed_update ON student;
+CREATE TRIGGER trigger_student_data_changed_update
+    AFTER UPDATE ON student
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT
+    EXECUTE FUNCTION notify_student_data_changed();
+
+DROP TRIGGER IF EXISTS trigger_student_data_changed_delete ON student;
+CREATE TRIGGER trigger_student_data_changed_delete
+    AFTER DELETE ON student
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT
+    EXECUTE FUNCTION notify_student_data_changed();
\ No newline at end of file
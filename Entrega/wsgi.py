@@ -0,0 +1,207 @@
+##
+## Production entry point for the API
+##
+## Runs demoApi under gunicorn (pre-fork, one master and several worker
+## processes, each with a few threads) instead of the Werkzeug dev server:
+##
+##   python wsgi.py --workers 8 --threads 4 --bind 0.0.0.0:5000
+##   gunicorn 'wsgi:create_app()' -c wsgi.py      (equivalent, gunicorn CLI)
+##
+## Every option can also be given by environment variable (API_WORKERS,
+## API_THREADS, API_BIND, ...). Each worker opens its own connection pool
+## after the fork, so the total number of database connections is at most
+## workers * DB_POOL_MAX_SIZE.
+##
+## The master imports demoApi before forking (preload_app), so kill -HUP only
+## restarts the workers on the code already loaded. To deploy new code without
+## dropping requests, start a new master next to the old one and then retire
+## the old one (its in-flight requests finish first):
+##
+##   kill -USR2 $(cat <pidfile>)             # new master and workers, new code
+##   kill -WINCH $(cat <pidfile>.oldbin)     # old workers stop gracefully
+##   kill -QUIT $(cat <pidfile>.oldbin)      # old master exits
+##
+## Green-thread mode (--green or API_GREEN=1): gevent workers, each serving up
+## to API_WORKER_CONNECTIONS requests as greenlets, with psycopg2 made
+## cooperative, so a request waiting for Postgres (enroll_course_edition,
+## submit_grades, ...) lets the others run instead of holding a thread:
+##
+##   python wsgi.py --green --workers 2
+##   API_GREEN=1 gunicorn 'wsgi:create_app()' -c wsgi.py
+##
+
+import argparse
+import multiprocessing
+import os
+import sys
+
+
+def env_flag(name):
+    return os.environ.get(name, '').lower() in ('1', 'true', 'yes')
+
+
+# Tem de ser decidido antes de importar demoApi: o monkey patching do gevent só
+# torna cooperativos os locks e sockets criados depois dele
+green = env_flag('API_GREEN') or (__name__ == '__main__' and '--green' in sys.argv)
+
+if green:
+    try:
+        from gevent import monkey
+    except ImportError:
+        raise SystemExit('gevent is required for the green-thread mode (pip install gevent)')
+    monkey.patch_all()
+
+import demoApi
+
+if green:
+    demoApi.make_psycopg2_green()
+
+
+def env_int(name, default):
+    return int(os.environ.get(name, default))
+
+
+def create_app(**config):
+    """Apply config (and API_CONFIG_* environment variables) to demoApi.app and return it.
+
+    Not a factory: there is one app per process, the module-level demoApi.app,
+    and every call changes that same app.
+    """
+    app = demoApi.app
+    for key, value in os.environ.items():
+        if key.startswith('API_CONFIG_'):
+            name = key[len('API_CONFIG_'):]
+            # Mantém o tipo do valor por omissão (int, bool, ...)
+            default = app.config.get(name)
+            if isinstance(default, bool):
+                value = value.lower() in ('1', 'true', 'yes')
+            elif isinstance(default, int):
+                value = int(value)
+            app.config[name] = value
+    app.config.update(config)
+    return app
+
+
+# Configuração do gunicorn: valores por omissão do launcher e lidos
+# diretamente quando este ficheiro é usado com gunicorn -c wsgi.py
+bind = os.environ.get('API_BIND', '127.0.0.1:5000')
+workers = env_int('API_WORKERS', multiprocessing.cpu_count() * 2 + 1)
+threads = env_int('API_THREADS', 4)
+worker_connections = env_int('API_WORKER_CONNECTIONS', 1000)   # greenlets por worker (modo green)
+
+
+def worker_class_for(green, threads):
+    if green:
+        return 'gevent'
+    return 'gthread' if threads > 1 else 'sync'
+
+
+worker_class = worker_class_for(green, threads)
+timeout = env_int('API_TIMEOUT', 30)
+graceful_timeout = env_int('API_GRACEFUL_TIMEOUT', 30)
+max_requests = env_int('API_MAX_REQUESTS', 0)
+pidfile = os.environ.get('API_PIDFILE', 'api.pid')
+accesslog = '-'
+preload_app = True   # ver no início do ficheiro como atualizar o código
+
+
+# Hooks do gunicorn
+
+def when_ready(server):
+    # O master não serve pedidos: fechar o pool antes de criar os workers
+    demoApi.close_db_pool()
+
+
+def post_fork(server, worker):
+    # Cada worker abre o seu pool (as conexões do master não podem ser partilhadas)
+    demoApi.get_db_pool()
+    # Os processos do pool de passwords arrancam já, não no primeiro login
+    demoApi.get_password_pool()
+    if demoApi.app.config['STUDENT_SOFT_DELETE']:
+        # Arranca em todos os workers mas só um faz o purge (ver student_purge_worker)
+        demoApi.start_student_purge_worker()
+    demoApi.start_reference_listener()
+    demoApi.start_financial_compaction_worker()
+    if demoApi.app.config['ENROLL_QUEUE_MODE']:
+        # A fila está na base de dados: os workers de todos os processos partilham-na
+        demoApi.start_enrollment_workers()
+    worker.log.info(f'Worker {worker.pid} ready, pool {demoApi.get_db_pool().stats()}')
+
+
+def worker_exit(server, worker):
+    demoApi.close_db_pool()
+
+
+def options_from(args):
+    return {
+        'bind': args.bind,
+        'workers': args.workers,
+        'threads': args.threads,
+        'worker_class': worker_class_for(args.green, args.threads),
+        'worker_connections': args.worker_connections,
+        'timeout': args.timeout,
+        'graceful_timeout': args.graceful_timeout,
+        'max_requests': args.max_requests,
+        'max_requests_jitter': args.max_requests // 10,
+        'pidfile': args.pidfile,
+        'accesslog': accesslog,
+        'preload_app': preload_app,
+        'when_ready': when_ready,
+        'post_fork': post_fork,
+        'worker_exit': worker_exit
+    }
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Run the API under gunicorn')
+    parser.add_argument('--bind', default=bind)
+    parser.add_argument('--workers', type=int, default=workers)
+    parser.add_argument('--threads', type=int, default=threads)
+    parser.add_argument('--green', action='store_true', default=green,
+                        help='gevent workers with cooperative psycopg2 (--threads is ignored)')
+    parser.add_argument('--worker-connections', type=int, default=worker_connections,
+                        help='concurrent requests per gevent worker')
+    parser.add_argument('--timeout', type=int, default=timeout)
+    parser.add_argument('--graceful-timeout', type=int, default=graceful_timeout)
+    parser.add_argument('--max-requests', type=int, default=max_requests,
+                        help='restart a worker after this many requests (0 = never)')
+    parser.add_argument('--pidfile', default=pidfile)
+    parser.add_argument('--pool-size', type=int, default=env_int('API_POOL_SIZE', 0),
+                        help='DB_POOL_MAX_SIZE per worker (default: threads + 2, or DB_POOL_MAX_SIZE with --green)')
+    parser.add_argument('--init-db', action='store_true', help='create the tables and triggers before starting')
+    return parser.parse_args()
+
+
+def main():
+    try:
+        from gunicorn.app.base import BaseApplication
+    except ImportError:
+        raise SystemExit('gunicorn is required (pip install gunicorn); it does not run on Windows')
+
+    args = parse_args()
+    if args.pool_size:
+        pool = {'DB_POOL_MAX_SIZE': args.pool_size}
+    elif args.green:
+        pool = {}   # os greenlets em curso não limitam as conexões: fica DB_POOL_MAX_SIZE
+    else:
+        pool = {'DB_POOL_MAX_SIZE': args.threads + 2}
+    app = create_app(**pool)
+
+    if args.init_db:
+        demoApi.initialize_database()
+        demoApi.create_triggers()
+        demoApi.close_db_pool()
+
+    class APIServer(BaseApplication):
+        def load_config(self):
+            for key, value in options_from(args).items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            return app
+
+    APIServer().run()
+
+
+if __name__ == '__main__':
+    main()